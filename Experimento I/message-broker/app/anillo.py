@@ -0,0 +1,35 @@
+import bisect
+import hashlib
+
+# Claves de Redis compartidas por los shards del monitor y el broker
+CLAVE_SHARDS = 'monitor:shards'            # sorted set: shard_id -> último registro (epoch)
+CLAVE_SHARDS_URLS = 'monitor:shards:urls'  # hash: shard_id -> URL base
+CLAVE_ESTADO = 'monitor:estado'            # hash: servicio -> JSON con el último estado conocido
+
+
+def _hash(valor):
+    return int.from_bytes(hashlib.md5(valor.encode('utf-8')).digest()[:8], 'big')
+
+
+class AnilloConsistente:
+    """
+    Anillo de hashing consistente con nodos virtuales.
+
+    Usa md5 (y no hash() de Python) para que el broker y todos los shards
+    calculen el mismo dueño para cada `servicio_origen`.
+    """
+
+    def __init__(self, nodos, replicas=100):
+        self.nodos = sorted(nodos)
+        self._puntos = []
+        self._duenos = []
+        for punto, nodo in sorted((_hash(f"{nodo}#{i}"), nodo) for nodo in self.nodos for i in range(replicas)):
+            self._puntos.append(punto)
+            self._duenos.append(nodo)
+
+    def nodo(self, clave):
+        """Retorna el nodo dueño de la clave, o None si el anillo está vacío"""
+        if not self._puntos:
+            return None
+        indice = bisect.bisect(self._puntos, _hash(clave)) % len(self._puntos)
+        return self._duenos[indice]
@@ -0,0 +1,127 @@
+"""
+Carriles (colas) por clase de mensaje con prioridad estricta y límite de concurrencia.
+
+BROKER_CARRILES define los carriles en orden de prioridad y cuántos workers
+dedicados tiene cada uno, p. ej. "eventos:2,heartbeats:1,default:1". La
+concurrencia de un carril nunca supera sus workers dedicados más los de
+carriles de menor prioridad que lo ayudan cuando están ociosos
+(BROKER_CARRILES_AYUDA): la capacidad fluye hacia arriba pero nunca hacia
+abajo, así que una avalancha de heartbeats no puede ocupar a los workers de
+eventos de seguridad. Un carril particionado (ver particiones.py) no recibe
+ayuda: cada partición tiene un solo consumidor para conservar el orden.
+
+Uso como comando:
+    python carriles.py metricas
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import redis
+from rq import Queue
+from rq.registry import StartedJobRegistry
+
+from particiones import cola_para, colas_de_carril, particiones_de
+
+CARRIL_EVENTOS = 'eventos'
+CARRIL_HEARTBEATS = 'heartbeats'
+CARRIL_DEFECTO = 'default'
+
+# Carril de cada función de tasks (para re-encolar reintentos en la cola correcta)
+CARRIL_POR_FUNCION = {
+    'tasks.evento_ping': CARRIL_EVENTOS,
+    'tasks.heartbeat_ping': CARRIL_HEARTBEATS,
+}
+
+BROKER_CARRILES = os.environ.get('BROKER_CARRILES', 'eventos:2,heartbeats:1,default:1')
+BROKER_CARRILES_AYUDA = os.environ.get('BROKER_CARRILES_AYUDA', 'true').lower() == 'true'
+BROKER_METRICAS_INTERVAL_SECONDS = float(os.environ.get('BROKER_METRICAS_INTERVAL_SECONDS', 5))
+
+CLAVE_METRICAS = 'broker:metricas:carriles'
+
+
+def carriles_configurados():
+    """Lista de (carril, concurrencia) en orden de prioridad"""
+    carriles = []
+    for parte in BROKER_CARRILES.split(','):
+        nombre, _, concurrencia = parte.strip().partition(':')
+        if nombre:
+            carriles.append((nombre, int(concurrencia or 1)))
+    return carriles
+
+
+def carriles_de_ayuda(carril):
+    """Carriles no particionados de mayor prioridad que un worker del carril atiende si está ocioso"""
+    nombres = [nombre for nombre, _ in carriles_configurados()]
+    if not BROKER_CARRILES_AYUDA or carril not in nombres:
+        return []
+    return [nombre for nombre in nombres[:nombres.index(carril)] if particiones_de(nombre) == 1]
+
+
+def colas_de_worker(carril):
+    """
+    Colas que escucha un worker de un carril no particionado. rq desencola
+    siempre de la primera cola no vacía, así que el orden de la lista es la
+    prioridad estricta: primero el carril propio y luego, si está ocioso, los
+    de mayor prioridad.
+    """
+    return [carril] + carriles_de_ayuda(carril)
+
+
+def carril_de(funcion):
+    return CARRIL_POR_FUNCION.get(funcion, CARRIL_DEFECTO)
+
+
+def cola_de(funcion, datos):
+    """Cola (partición del carril) a la que va un mensaje de `funcion` con `datos`"""
+    return cola_para(carril_de(funcion), datos)
+
+
+def metricas(conexion):
+    """Profundidad y jobs en ejecución por carril (y por partición si está particionado)"""
+    resultado = {}
+    for nombre, concurrencia in carriles_configurados():
+        colas = {
+            cola: {
+                "profundidad": Queue(cola, connection=conexion).count,
+                "en_ejecucion": StartedJobRegistry(cola, connection=conexion).count,
+            }
+            for cola in colas_de_carril(nombre)
+        }
+        resultado[nombre] = {
+            "profundidad": sum(c["profundidad"] for c in colas.values()),
+            "en_ejecucion": sum(c["en_ejecucion"] for c in colas.values()),
+            "concurrencia": concurrencia,
+        }
+        if len(colas) > 1:
+            resultado[nombre]["particiones"] = colas
+    return resultado
+
+
+def iniciar_metricas(conexion):
+    """Publica periódicamente las métricas de los carriles en Redis y en el log"""
+    def bucle():
+        while True:
+            try:
+                actuales = metricas(conexion)
+                conexion.set(CLAVE_METRICAS, json.dumps({"fecha": time.time(), "carriles": actuales}))
+                print(f"Métricas de carriles: {actuales}")
+            except redis.RedisError as e:
+                print(f"Error publicando métricas de carriles: {e}")
+            time.sleep(BROKER_METRICAS_INTERVAL_SECONDS)
+
+    hilo = threading.Thread(target=bucle, name='metricas-carriles', daemon=True)
+    hilo.start()
+    return hilo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Métricas de los carriles del broker")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    subcomandos.add_parser('metricas', help="Muestra profundidad y jobs en ejecución por carril")
+    args = parser.parse_args()
+
+    conexion = redis.Redis(host=os.environ.get('REDIS_HOST', 'redis'), port=int(os.environ.get('REDIS_PORT', 6379)))
+    print(json.dumps(metricas(conexion), indent=2))
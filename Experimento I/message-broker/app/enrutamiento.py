@@ -0,0 +1,40 @@
+import os
+import time
+
+from rq import get_current_connection
+
+from anillo import AnilloConsistente, CLAVE_SHARDS, CLAVE_SHARDS_URLS
+
+# Destino cuando no hay shards registrados (monitor único)
+MONITOR_SHARD_DEFECTO = 'monitor'
+MONITOR_URL_DEFECTO = os.environ.get('MONITOR_URL', 'http://monitor:5000')
+SHARD_TTL_SECONDS = int(os.environ.get('SHARD_TTL_SECONDS', 10))
+
+_anillos = {}
+
+
+def _anillo(miembros):
+    # El anillo se reutiliza mientras la membresía no cambie
+    clave = tuple(miembros)
+    if clave not in _anillos:
+        _anillos.clear()
+        _anillos[clave] = AnilloConsistente(miembros)
+    return _anillos[clave]
+
+
+def shard_para(servicio_origen, conexion=None):
+    """
+    Retorna (shard_id, url_base) del shard del monitor dueño del servicio,
+    según los shards vivos registrados en Redis.
+    """
+    conexion = conexion or get_current_connection()
+    pipe = conexion.pipeline()
+    pipe.zrangebyscore(CLAVE_SHARDS, time.time() - SHARD_TTL_SECONDS, '+inf')
+    pipe.hgetall(CLAVE_SHARDS_URLS)
+    miembros, urls = pipe.execute()
+    miembros = sorted(m.decode() for m in miembros)
+    if not miembros:
+        return MONITOR_SHARD_DEFECTO, MONITOR_URL_DEFECTO
+    shard = _anillo(miembros).nodo(servicio_origen)
+    url = urls.get(shard.encode())
+    return shard, url.decode() if url else MONITOR_URL_DEFECTO
@@ -0,0 +1,290 @@
+"""
+Colas particionadas por clave: orden por clave con consumidores en paralelo.
+
+Un carril particionado (BROKER_PARTICIONES, p. ej. "eventos:4,heartbeats:4")
+se reparte en N colas <carril>-0 .. <carril>-(N-1). El productor elige la
+partición con md5(clave) % N; la clave es `id_usuario` en los eventos y
+`servicio_origen` en los heartbeats, así todos los mensajes de una clave caen
+en la misma cola y se consumen en orden. Los carriles que no aparecen en
+BROKER_PARTICIONES usan una sola cola con el nombre del carril, como antes.
+BROKER_PARTICIONES se define una sola vez en particiones.env del experimento,
+que docker-compose carga en el broker y en los productores; sin ella ningún
+carril se particiona.
+
+Cada partición tiene un único consumidor a la vez. Los workers de un carril
+se registran con latido en broker:particiones:<carril>:miembros y todos
+calculan el mismo reparto: la partición p es del miembro p % M en la lista
+ordenada de los M miembros vivos. Cuando un worker entra o sale (otro
+contenedor del broker, un worker relanzado) el reparto cambia, pero solo se
+consume una partición con su concesión (broker:particiones:<cola>:dueno, SET NX
+con TTL): el dueño anterior la suelta al terminar el mensaje en curso y el
+nuevo la toma recién entonces, o cuando vence si el anterior murió.
+
+Uso como comando:
+    python particiones.py estado
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import redis
+from rq import Queue, Worker
+from rq.exceptions import DequeueTimeout
+from rq.worker import WorkerStatus
+
+BROKER_PARTICIONES = os.environ.get('BROKER_PARTICIONES', '')
+BROKER_REPARTO_INTERVAL_SECONDS = int(os.environ.get('BROKER_REPARTO_INTERVAL_SECONDS', 1))
+BROKER_REPARTO_TTL_SECONDS = int(os.environ.get('BROKER_REPARTO_TTL_SECONDS', 10))
+
+# Campo de los datos del mensaje que define el orden en cada carril
+CLAVE_POR_CARRIL = {
+    'eventos': 'id_usuario',
+    'heartbeats': 'servicio_origen',
+}
+
+PREFIJO_REPARTO = 'broker:particiones:'
+
+# Renueva la concesión si es propia o la toma si está libre
+LUA_RENOVAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 1
+end
+return 0
+"""
+
+# Suelta la concesión solo si sigue siendo propia
+LUA_SOLTAR = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _leer_particiones():
+    particiones = {}
+    for parte in BROKER_PARTICIONES.split(','):
+        nombre, _, cantidad = parte.strip().partition(':')
+        if nombre:
+            particiones[nombre] = max(1, int(cantidad or 1))
+    return particiones
+
+
+PARTICIONES = _leer_particiones()
+
+
+def particiones_de(carril):
+    return PARTICIONES.get(carril, 1)
+
+
+def nombre_particion(carril, particion):
+    return carril if particiones_de(carril) == 1 else f"{carril}-{particion}"
+
+
+def colas_de_carril(carril):
+    """Nombres de las colas del carril, en orden de partición"""
+    return [nombre_particion(carril, p) for p in range(particiones_de(carril))]
+
+
+def _hash(valor):
+    # md5 y no hash() de Python: productores y broker deben calcular la misma partición
+    return int.from_bytes(hashlib.md5(valor.encode('utf-8')).digest()[:8], 'big')
+
+
+def cola_para(carril, datos):
+    """Cola de la partición del carril que corresponde a la clave de `datos`"""
+    n = particiones_de(carril)
+    if n == 1:
+        return carril
+    clave = (datos or {}).get(CLAVE_POR_CARRIL.get(carril))
+    return nombre_particion(carril, _hash(str(clave)) % n)
+
+
+def _clave_dueno(cola):
+    return f'{PREFIJO_REPARTO}{cola}:dueno'
+
+
+class RepartoParticiones:
+    """Membresía de los workers de un carril y concesiones exclusivas de sus particiones"""
+
+    def __init__(self, carril, miembro, conexion):
+        self.carril = carril
+        self.miembro = miembro
+        self.conexion = conexion
+        self.clave_miembros = f'{PREFIJO_REPARTO}{carril}:miembros'
+        # Colas con concesión vigente, en orden de partición
+        self.propias = []
+        self._renovar = conexion.register_script(LUA_RENOVAR)
+        self._soltar = conexion.register_script(LUA_SOLTAR)
+
+    def asignadas(self):
+        """Registra el latido del miembro y retorna las colas que le tocan en el reparto actual"""
+        ahora = time.time()
+        pipe = self.conexion.pipeline()
+        pipe.zadd(self.clave_miembros, {self.miembro: ahora})
+        pipe.zremrangebyscore(self.clave_miembros, '-inf', ahora - BROKER_REPARTO_TTL_SECONDS)
+        pipe.zrange(self.clave_miembros, 0, -1)
+        miembros = sorted(m.decode() for m in pipe.execute()[2])
+        posicion = miembros.index(self.miembro)
+        return [cola for p, cola in enumerate(colas_de_carril(self.carril)) if p % len(miembros) == posicion]
+
+    def actualizar(self, ocupado=False):
+        """
+        Renueva la membresía y las concesiones y retorna las colas propias.
+        Entre mensajes además suelta las particiones que ya no le tocan y
+        toma las nuevas; con un mensaje en curso solo renueva, para no ceder
+        su partición antes de terminarlo.
+        """
+        asignadas = self.asignadas()
+        if ocupado:
+            objetivo = self.propias
+        else:
+            for cola in self.propias:
+                if cola not in asignadas:
+                    self._soltar(keys=[_clave_dueno(cola)], args=[self.miembro])
+            objetivo = asignadas
+        ttl_ms = BROKER_REPARTO_TTL_SECONDS * 1000
+        propias = [cola for cola in objetivo if self._renovar(keys=[_clave_dueno(cola)], args=[self.miembro, ttl_ms])]
+        if propias != self.propias:
+            pendientes = [cola for cola in asignadas if cola not in propias]
+            print(f"Worker {self.miembro} del carril '{self.carril}' consume {propias}"
+                  + (f" (esperando concesión de {pendientes})" if pendientes else ""))
+        self.propias = propias
+        return propias
+
+    def retirarse(self):
+        """Suelta todas las concesiones y sale de la membresía para que el reparto cambie de inmediato"""
+        for cola in self.propias:
+            self._soltar(keys=[_clave_dueno(cola)], args=[self.miembro])
+        self.conexion.zrem(self.clave_miembros, self.miembro)
+        self.propias = []
+
+
+class WorkerParticionado(Worker):
+    """
+    Worker de rq que escucha solo las particiones con concesión propia y
+    después las colas de `ayuda` (carriles no particionados de mayor
+    prioridad). El reparto se actualiza en el latido del worker: cada
+    BROKER_REPARTO_INTERVAL_SECONDS mientras espera mensajes y durante un
+    mensaje, al monitorear el proceso hijo.
+    """
+
+    def __init__(self, carril, ayuda=(), **kwargs):
+        self.carril = carril
+        self.ayuda = list(ayuda)
+        self.reparto = None
+        self._ocupado = False
+        self._propias = set()
+        self._ultimo_reparto = 0.0
+        kwargs.setdefault('job_monitoring_interval', BROKER_REPARTO_INTERVAL_SECONDS)
+        super().__init__([Queue(self._cola_en_espera(), connection=kwargs.get('connection'))], **kwargs)
+        self.reparto = RepartoParticiones(carril, self.name, self.connection)
+
+    def _cola_en_espera(self):
+        # Cola vacía para el BLPOP cuando el worker todavía no tiene particiones ni ayuda
+        return f'{self.carril}-en-espera'
+
+    def heartbeat(self, timeout=None, pipeline=None):
+        super().heartbeat(timeout, pipeline)
+        if self.reparto is None or time.monotonic() - self._ultimo_reparto < BROKER_REPARTO_INTERVAL_SECONDS / 2:
+            return
+        self._ultimo_reparto = time.monotonic()
+        propias = self.reparto.actualizar(ocupado=self._ocupado)
+        if self._ocupado:
+            return
+        self._propias = set(propias)
+        nombres = propias + self.ayuda or [self._cola_en_espera()]
+        self.queues = [Queue(nombre, connection=self.connection, job_class=self.job_class, serializer=self.serializer)
+                       for nombre in nombres]
+        self._ordered_queues = self.queues[:]
+
+    def dequeue_job_and_maintain_ttl(self, timeout):
+        """
+        Igual al de rq 1.10, salvo dos cosas: el BLPOP es corto para notar a
+        tiempo los cambios de reparto, y el worker queda ocupado apenas
+        desencola. rq late otra vez entre el desencolado y execute_job, y ese
+        latido no debe soltar la partición del mensaje en mano.
+        """
+        if timeout:
+            timeout = min(timeout, BROKER_REPARTO_INTERVAL_SECONDS)
+        self.set_state(WorkerStatus.IDLE)
+        self.procline('Listening on ' + ','.join(self.queue_names()))
+        espera_conexion = 1.0
+        while True:
+            try:
+                self.heartbeat()
+                if self.should_run_maintenance_tasks:
+                    self.run_maintenance_tasks()
+                resultado = self.queue_class.dequeue_any(self._ordered_queues, timeout,
+                                                         connection=self.connection,
+                                                         job_class=self.job_class,
+                                                         serializer=self.serializer)
+                if resultado is not None:
+                    self._ocupado = True
+                    job, queue = resultado
+                    job.redis_server_version = self.get_redis_server_version()
+                    self.log.info('%s: %s', queue.name, job.id)
+                break
+            except DequeueTimeout:
+                pass
+            except redis.exceptions.ConnectionError as e:
+                self.log.error('Sin conexión a Redis: %s. Reintento en %d s', e, espera_conexion)
+                time.sleep(espera_conexion)
+                espera_conexion = min(espera_conexion * self.exponential_backoff_factor, self.max_connection_wait_time)
+            else:
+                espera_conexion = 1.0
+        self.heartbeat()
+        return resultado
+
+    def reorder_queues(self, reference_queue):
+        # Turno rotativo entre particiones propias: una con atraso no deja sin atender a las demás
+        propias = [q for q in self._ordered_queues if q.name in self._propias]
+        if reference_queue in propias:
+            i = propias.index(reference_queue)
+            propias = propias[i + 1:] + propias[:i + 1]
+        self._ordered_queues = propias + [q for q in self._ordered_queues if q.name not in self._propias]
+
+    def execute_job(self, job, queue):
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            self._ocupado = False
+
+    def register_death(self):
+        try:
+            self.reparto.retirarse()
+        except redis.RedisError as e:
+            print(f"No se pudieron soltar las particiones del worker {self.name}: {e}")
+        super().register_death()
+
+
+def estado(conexion):
+    """Miembros vivos, dueño y profundidad de cada partición"""
+    resultado = {}
+    for carril in PARTICIONES:
+        limite = time.time() - BROKER_REPARTO_TTL_SECONDS
+        miembros = conexion.zrangebyscore(f'{PREFIJO_REPARTO}{carril}:miembros', limite, '+inf')
+        colas = {}
+        for cola in colas_de_carril(carril):
+            dueno = conexion.get(_clave_dueno(cola))
+            colas[cola] = {
+                "dueno": dueno.decode() if dueno else None,
+                "profundidad": Queue(cola, connection=conexion).count,
+            }
+        resultado[carril] = {"miembros": sorted(m.decode() for m in miembros), "particiones": colas}
+    return resultado
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reparto de las colas particionadas del broker")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    subcomandos.add_parser('estado', help="Muestra miembros, dueño y profundidad de cada partición")
+    args = parser.parse_args()
+
+    conexion = redis.Redis(host=os.environ.get('REDIS_HOST', 'redis'), port=int(os.environ.get('REDIS_PORT', 6379)))
+    print(json.dumps(estado(conexion), indent=2))
@@ -1,11 +1,64 @@
+import os
+import time
+
 import requests
 
-def heartbeat_ping(datos):
+from idempotencia import reclamar, confirmar, liberar
+from entrega import programar_reintento, estacionar, vencido, edad
+from circuito import permitir, registrar_resultado, TIMEOUT
+from enrutamiento import shard_para
+from vida import marcar_vida, VIDA_EDAD_MAX_SECONDS
+
+# Un heartbeat más viejo ya no prueba vida; misma regla que BUZON_TTL_HEARTBEAT_SECONDS en los productores
+ENTREGA_TTL_HEARTBEAT_SECONDS = float(os.environ.get('ENTREGA_TTL_HEARTBEAT_SECONDS', 10))
+
+def heartbeat_ping(datos, intento=0):
     """
     La única función de este worker es notificar al monitor.
+    El heartbeat se enruta al shard del monitor dueño de su servicio_origen.
+    Si la entrega falla se agenda un reintento diferido en vez de bloquear el worker,
+    y si el circuito del shard está abierto el mensaje se estaciona sin intentarlo.
+    Un heartbeat vencido no se entrega ni se reintenta: el monitor lo tomaría
+    como vida actual de un servicio que quizás ya cayó. Los implícitos (ver
+    vida.py) vencen a VIDA_EDAD_MAX_SECONDS y se intentan una sola vez.
     """
+    implicito = bool(datos.get('implicito'))
+    ttl = VIDA_EDAD_MAX_SECONDS if implicito else ENTREGA_TTL_HEARTBEAT_SECONDS
+    if vencido(datos, ttl):
+        print(f"Heartbeat vencido descartado ({edad(datos):.1f}s): {datos.get('id')}")
+        return
+    # Se reclama antes de consultar el circuito: un duplicado no debe tomar la sonda del semiabierto
+    if not reclamar(datos.get('id')):
+        print(f"Heartbeat duplicado descartado: {datos.get('id')}")
+        return
+    shard, url = shard_para(datos.get('servicio_origen', 'desconocido'))
+    permitido, reintentar_en = permitir(shard)
+    if not permitido:
+        liberar(datos.get('id'))
+        if implicito:
+            print(f"Circuito del monitor '{shard}' abierto, heartbeat implícito descartado: {datos.get('id')}")
+            return
+        estacionar('tasks.heartbeat_ping', datos, intento, reintentar_en, ttl=ttl)
+        print(f"Circuito del monitor '{shard}' abierto, heartbeat estacionado: {datos.get('id')}")
+        return
+    inicio = time.perf_counter()
     try:
-        requests.post("http://monitor:5000/reportar-heartbeat", json=datos)
-        print(f"Heartbeat consumido y reportado al monitor: {datos}")
+        respuesta = requests.post(f"{url}/reportar-heartbeat", json=datos, timeout=TIMEOUT)
+        if respuesta.status_code >= 500:
+            registrar_resultado(shard, False, time.perf_counter() - inicio)
+            liberar(datos.get('id'))
+            print(f"Error del monitor al reportar heartbeat ({respuesta.status_code}): {datos}")
+            if not implicito:
+                programar_reintento('tasks.heartbeat_ping', datos, intento, f"HTTP {respuesta.status_code}", ttl=ttl)
+            return
+        registrar_resultado(shard, True, time.perf_counter() - inicio)
+        confirmar(datos.get('id'))
+        # Ocupa la ventana de vida del servicio: no hace falta reenviar heartbeats implícitos
+        marcar_vida(datos.get('servicio_origen'))
+        print(f"Heartbeat consumido y reportado al monitor '{shard}': {datos}")
     except requests.exceptions.RequestException as e:
+        registrar_resultado(shard, False, time.perf_counter() - inicio)
+        liberar(datos.get('id'))
         print(f"Error al reportar heartbeat al monitor: {e}")
+        if not implicito:
+            programar_reintento('tasks.heartbeat_ping', datos, intento, e, ttl=ttl)
@@ -0,0 +1,65 @@
+"""
+Vida implícita: cualquier mensaje de un servicio prueba que está vivo.
+
+Al consumir un mensaje de negocio con `servicio_origen`, el broker reenvía al
+monitor un heartbeat implícito (partición del carril, circuito y shard, como
+los explícitos). Para no multiplicar el tráfico hacia el monitor se reenvía a
+lo sumo uno por servicio cada VIDA_COALESCER_SECONDS; los heartbeats
+explícitos también ocupan esa ventana. Un mensaje más viejo que
+VIDA_EDAD_MAX_SECONDS (p. ej. atrasado en la cola) ya no prueba nada: no se
+reenvía, y el heartbeat implícito que llega a esa edad antes de entregarse se
+descarta. El implícito se intenta una sola vez, sin reintentos, estacionamiento
+ni DLQ; el siguiente mensaje del servicio ya trae vida más reciente. Los
+productores, a su vez, solo envían un heartbeat explícito cuando no enviaron
+ningún otro mensaje en el intervalo.
+
+VIDA_REENVIAR es la función que entrega la vida al monitor; vacía desactiva
+el reenvío (p. ej. en un despliegue sin monitor).
+"""
+import os
+from datetime import datetime, timezone
+
+from rq import Queue, get_current_connection
+
+from carriles import cola_de
+
+VIDA_REENVIAR = os.environ.get('VIDA_REENVIAR', 'tasks.heartbeat_ping')
+VIDA_COALESCER_SECONDS = float(os.environ.get('VIDA_COALESCER_SECONDS', 1.0))
+VIDA_EDAD_MAX_SECONDS = float(os.environ.get('VIDA_EDAD_MAX_SECONDS', 5.0))
+PREFIJO_VIDA = 'vida:'
+
+
+def marcar_vida(servicio_origen, conexion=None):
+    """Un heartbeat explícito entregado ocupa la ventana de coalescencia del servicio"""
+    if not servicio_origen:
+        return
+    conexion = conexion or get_current_connection()
+    conexion.set(PREFIJO_VIDA + servicio_origen, 'explicito', px=int(VIDA_COALESCER_SECONDS * 1000))
+
+
+def reportar_vida(datos, conexion=None):
+    """
+    Reenvía al monitor la vida del `servicio_origen` de un mensaje de negocio.
+    Retorna True si se encoló un heartbeat implícito.
+    """
+    servicio_origen = datos.get('servicio_origen')
+    if not VIDA_REENVIAR or not servicio_origen or not datos.get('timestamp'):
+        return False
+    try:
+        edad = (datetime.now(timezone.utc) - datetime.fromisoformat(datos['timestamp'])).total_seconds()
+    except (ValueError, TypeError):
+        return False
+    if edad > VIDA_EDAD_MAX_SECONDS:
+        return False
+    conexion = conexion or get_current_connection()
+    if not conexion.set(PREFIJO_VIDA + servicio_origen, 'implicito', nx=True, px=int(VIDA_COALESCER_SECONDS * 1000)):
+        return False
+    latido = {
+        "id": f"vida-{datos.get('id')}",
+        "timestamp": datos['timestamp'],
+        "servicio_origen": servicio_origen,
+        "implicito": True,
+        "origen_id": datos.get('id'),
+    }
+    Queue(cola_de(VIDA_REENVIAR, latido), connection=conexion).enqueue(VIDA_REENVIAR, latido)
+    return True
@@ -1,65 +1,113 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Blueprint, jsonify, request
 import uuid
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import os
 import redis
-from rq import Queue
-from apscheduler.schedulers.background import BackgroundScheduler
 import logging
+from planificador import PlanificadorUnico
+from particiones import ColaParticionada
+from buzon import BuzonSalida, BUZON_TTL_HEARTBEAT_SECONDS
+import perfilado
+from perfilado import span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
+bp = Blueprint('pedidos', __name__)
 
 # Redis and RQ setup
 redis_host = os.environ.get('REDIS_HOST', 'redis')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
-redis_conn = redis.Redis(host=redis_host, port=redis_port)
-q = Queue(connection=redis_conn)
+redis_timeout = float(os.environ.get('REDIS_TIMEOUT_SECONDS', 2))
+redis_conn = redis.Redis(host=redis_host, port=redis_port, socket_timeout=redis_timeout, socket_connect_timeout=redis_timeout)
+# Los heartbeats van a su propio carril del broker, particionado por servicio_origen
+q = ColaParticionada('heartbeats', redis_conn)
+
+# El scheduler deja los mensajes en el buzón y un hilo aparte los envía a Redis
+buzon = BuzonSalida(q, 'modulo-pedidos')
 
 # Scheduler interval configuration
 SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_INTERVAL_SECONDS', 3))
 
+# Cada heartbeat anuncia el intervalo del emisor y su número de secuencia. La época se
+# renueva en cada proceso que gana el liderazgo para que el monitor distinga un reinicio
+# de la secuencia de heartbeats perdidos
+heartbeats = {"epoca": None, "secuencia": 0, "intervalo_anunciado": None}
+
+
+def nueva_epoca():
+    heartbeats.update(epoca=str(uuid.uuid4()), secuencia=0, intervalo_anunciado=None)
+
+
 def encolar_tarea():
     """
     Encola una tarea en Redis.
     """
-    with app.app_context():
-        pedido_id = str(uuid.uuid4())
-        colombia_tz = ZoneInfo("America/Bogota")
-        now_colombia = datetime.now(colombia_tz)
-        timestamp = now_colombia.isoformat()
-
-        task_payload = {
-            "id": pedido_id,
-            "timestamp": timestamp,
-            "servicio_origen": "modulo-pedidos-2"
-        }
-
-        q.enqueue('tasks.heartbeat_ping', task_payload)
-        
+    # El intervalo vigente es el del job en el líder (/reschedule puede llegar a otro worker)
+    intervalo = scheduler.intervalo('encolar_tarea_job') or SCHEDULER_INTERVAL_SECONDS
+
+    # Cualquier mensaje del servicio prueba que está vivo (el broker reenvía esa vida al monitor):
+    # el heartbeat explícito solo sale si no hubo otro envío en el último medio intervalo,
+    # así entre dos pruebas de vida nunca pasan más de 1.5 intervalos. Un intervalo nuevo
+    # siempre se anuncia de inmediato
+    if intervalo == heartbeats["intervalo_anunciado"] and buzon.segundos_sin_encolar() < intervalo / 2:
+        logging.debug("Heartbeat omitido: el servicio envió otros mensajes en el intervalo.")
+        return
+
+    pedido_id = str(uuid.uuid4())
+    colombia_tz = ZoneInfo("America/Bogota")
+    now_colombia = datetime.now(colombia_tz)
+    timestamp = now_colombia.isoformat()
+
+    task_payload = {
+        "id": pedido_id,
+        "timestamp": timestamp,
+        "servicio_origen": "modulo-pedidos-2",
+        "intervalo": intervalo,
+        "secuencia": heartbeats["secuencia"] + 1,
+        "epoca": heartbeats["epoca"]
+    }
+
+    # Un heartbeat atrasado ya no prueba que el servicio esté vivo: caduca en el buzón
+    with span('enqueue'):
+        buzon.encolar('tasks.heartbeat_ping', task_payload, ttl=BUZON_TTL_HEARTBEAT_SECONDS)
+    heartbeats.update(secuencia=task_payload["secuencia"], intervalo_anunciado=intervalo)
+
+    with span('logging'):
         logging.info(f"Tarea encolada: {task_payload}")
 
-@app.route('/')
+@bp.route('/')
 def home():
     return jsonify({"mensaje": "Hola, soy el microservicio de respaldo zona 1 de pedidos! Ahora funciono como un scheduler."})
 
-@app.route('/shutdown', methods=['POST'])
+@bp.route('/shutdown', methods=['POST'])
 def shutdown_scheduler():
     """
     Shuts down the component.
     """
     try:
-        scheduler.shutdown()
+        scheduler.apagar()
         logging.info("component shut down via API request.")
         return jsonify({"mensaje": "component shut down successfully."}), 200
     except Exception as e:
         logging.error(f"Error shutting down component: {e}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/reschedule', methods=['POST'])
+@bp.route('/resume', methods=['POST'])
+def resume_scheduler():
+    """
+    Resumes the component after a shutdown.
+    """
+    try:
+        scheduler.reanudar()
+        logging.info("component resumed via API request.")
+        return jsonify({"mensaje": "component resumed successfully."}), 200
+    except Exception as e:
+        logging.error(f"Error resuming component: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/reschedule', methods=['POST'])
 def reschedule_job():
     """
     Reschedules the task with a new interval.
@@ -73,7 +121,7 @@ def reschedule_job():
         if new_interval <= 0:
             raise ValueError("Interval must be a positive integer.")
             
-        scheduler.reschedule_job('encolar_tarea_job', trigger='interval', seconds=new_interval)
+        scheduler.reprogramar('encolar_tarea_job', new_interval)
         
         global SCHEDULER_INTERVAL_SECONDS
         SCHEDULER_INTERVAL_SECONDS = new_interval
@@ -86,17 +134,44 @@ def reschedule_job():
         logging.error(f"Error rescheduling job: {e}")
         return jsonify({"error": str(e)}), 500
 
-# Initialize and start the scheduler
-scheduler = BackgroundScheduler()
+# El scheduler corre en un único proceso aunque gunicorn levante varios workers
+scheduler = PlanificadorUnico('modulo-pedidos')
+scheduler.al_ser_lider(nueva_epoca)
+scheduler.al_ser_lider(buzon.iniciar)
 scheduler.add_job(encolar_tarea, 'interval', seconds=SCHEDULER_INTERVAL_SECONDS, id='encolar_tarea_job')
-scheduler.start()
-logging.info(f"component iniciado. respaldo zona 1 de pedidos! Encolando tareas cada {SCHEDULER_INTERVAL_SECONDS} segundos.")
+
+
+def create_app():
+    """
+    Crea la aplicación Flask sin efectos secundarios; los hilos se arrancan en iniciar_servicio().
+    """
+    app = Flask(__name__)
+    perfilado.instalar(app)
+    app.register_blueprint(bp)
+    return app
+
+
+def iniciar_servicio():
+    """
+    Hook de arranque de cada proceso (post_worker_init en gunicorn).
+    """
+    scheduler.iniciar()
+    logging.info(f"component iniciado. respaldo zona 1 de pedidos! Encolando tareas cada {SCHEDULER_INTERVAL_SECONDS} segundos.")
+
+
+def detener_servicio():
+    """
+    Hook de apagado de cada proceso (worker_exit en gunicorn).
+    """
+    scheduler.detener()
+    buzon.detener()
 
 
 if __name__ == '__main__':
-    # This block is now only for local development (python main.py)
-    # The scheduler is already started above.
+    # Solo para desarrollo local (python main.py); en producción se usa gunicorn.conf.py
+    app = create_app()
+    iniciar_servicio()
     try:
         app.run(host='0.0.0.0', port=5000)
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
+    finally:
+        detener_servicio()
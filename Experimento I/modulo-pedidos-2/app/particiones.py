@@ -0,0 +1,73 @@
+"""
+Reparto de los mensajes en las colas particionadas del broker.
+
+Debe coincidir con message-broker/app/particiones.py: mismo campo clave por
+carril y mismo hash (md5), para que los mensajes de una clave caigan siempre
+en la misma partición y el broker los consuma en orden. BROKER_PARTICIONES
+no tiene valor propio aquí: viene de particiones.env del experimento, el mismo
+archivo que lee el broker. Un carril sin particiones usa la cola con su nombre.
+"""
+import hashlib
+import os
+
+from rq import Queue
+
+BROKER_PARTICIONES = os.environ.get('BROKER_PARTICIONES', '')
+
+# Campo de los datos del mensaje que define el orden en cada carril
+CLAVE_POR_CARRIL = {
+    'eventos': 'id_usuario',
+    'heartbeats': 'servicio_origen',
+}
+
+
+def _leer_particiones():
+    particiones = {}
+    for parte in BROKER_PARTICIONES.split(','):
+        nombre, _, cantidad = parte.strip().partition(':')
+        if nombre:
+            particiones[nombre] = max(1, int(cantidad or 1))
+    return particiones
+
+
+PARTICIONES = _leer_particiones()
+
+
+def _hash(valor):
+    return int.from_bytes(hashlib.md5(valor.encode('utf-8')).digest()[:8], 'big')
+
+
+def cola_para(carril, datos):
+    """Cola de la partición del carril que corresponde a la clave de `datos`"""
+    n = PARTICIONES.get(carril, 1)
+    if n == 1:
+        return carril
+    clave = (datos or {}).get(CLAVE_POR_CARRIL.get(carril))
+    return f"{carril}-{_hash(str(clave)) % n}"
+
+
+class ColaParticionada:
+    """
+    Reemplaza a rq.Queue en el buzón y el generador de carga: enqueue_many
+    envía cada trabajo a la partición de la clave de su primer argumento,
+    todo en un solo pipeline y en el orden recibido.
+    """
+
+    def __init__(self, carril, connection):
+        self.carril = carril
+        self.connection = connection
+        self._colas = {}
+
+    def _cola(self, nombre):
+        cola = self._colas.get(nombre)
+        if cola is None:
+            cola = self._colas[nombre] = Queue(nombre, connection=self.connection)
+        return cola
+
+    def enqueue_many(self, trabajos):
+        pipe = self.connection.pipeline()
+        jobs = []
+        for trabajo in trabajos:
+            jobs.extend(self._cola(cola_para(self.carril, trabajo.args[0])).enqueue_many([trabajo], pipeline=pipe))
+        pipe.execute()
+        return jobs
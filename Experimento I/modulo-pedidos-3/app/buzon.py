@@ -0,0 +1,245 @@
+"""
+Buzón de salida del productor: el scheduler nunca espera a Redis.
+
+`encolar` no toca la red: agrega el mensaje a un anillo en memoria de
+BUZON_CAPACIDAD entradas y, si está lleno, desplaza el más antiguo a un
+archivo de solo-agregado (BUZON_DIR/<nombre>.jsonl). Un hilo vaciador lo
+envía a Redis en lotes de hasta BUZON_LOTE mensajes con enqueue_many de la
+cola (un pipeline por lote; ColaParticionada pone cada mensaje en la
+partición de su clave): primero el lote que había fallado, luego el archivo
+y al final el anillo, así se respeta el orden de llegada. Si Redis no
+responde, el vaciador reintenta con backoff exponencial mientras el anillo
+sigue absorbiendo mensajes.
+
+Cada mensaje puede tener un `ttl` en segundos. Un heartbeat atrasado haría
+creer al monitor que el servicio sigue vivo, así que los heartbeats más
+viejos que BUZON_TTL_HEARTBEAT_SECONDS se descartan; los eventos no tienen
+ttl y se conservan siempre. La posición ya enviada del archivo se guarda en
+<nombre>.offset para retomar tras un reinicio.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import redis
+from rq import Queue
+
+from perfilado import span
+
+logger = logging.getLogger('buzon')
+
+BUZON_DIR = os.environ.get('BUZON_DIR', '/var/spool/buzon')
+BUZON_CAPACIDAD = int(os.environ.get('BUZON_CAPACIDAD', 1000))
+BUZON_LOTE = int(os.environ.get('BUZON_LOTE', 100))
+BUZON_ESPERA_SECONDS = float(os.environ.get('BUZON_ESPERA_SECONDS', 0.5))
+BUZON_BACKOFF_MAX_SECONDS = float(os.environ.get('BUZON_BACKOFF_MAX_SECONDS', 10))
+# 0 conserva también los heartbeats atrasados
+BUZON_TTL_HEARTBEAT_SECONDS = float(os.environ.get('BUZON_TTL_HEARTBEAT_SECONDS', 10))
+
+
+class BuzonSalida:
+
+    def __init__(self, cola, nombre, directorio=BUZON_DIR, capacidad=BUZON_CAPACIDAD):
+        self.cola = cola
+        self.nombre = nombre
+        self.directorio = directorio
+        self.ruta_archivo = os.path.join(directorio, f'{nombre}.jsonl')
+        self.ruta_offset = os.path.join(directorio, f'{nombre}.offset')
+        self.capacidad = capacidad
+        self.anillo = deque()
+        self.enviados = 0
+        self.derramados = 0
+        self.descartados = 0
+        self.conectado = True
+        self.ultimo_encolado = None
+        self._en_vuelo = []
+        self._en_vuelo_del_archivo = False
+        self._offset = 0
+        self._offset_siguiente = 0
+        self._escritura = None
+        self._lock = threading.Lock()
+        self._hay_mensajes = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def encolar(self, funcion, datos, ttl=None):
+        """Agrega el mensaje sin bloquear; `ttl` en segundos (None: no caduca)"""
+        mensaje = {"funcion": funcion, "datos": datos, "creado": time.time(), "ttl": ttl}
+        with self._lock:
+            if len(self.anillo) >= self.capacidad:
+                self._derramar(self.anillo.popleft())
+            self.anillo.append(mensaje)
+            self.ultimo_encolado = time.monotonic()
+        self._hay_mensajes.set()
+
+    def segundos_sin_encolar(self):
+        """Segundos desde el último mensaje de cualquier tipo (infinito si nunca hubo uno)"""
+        ultimo = self.ultimo_encolado
+        return float('inf') if ultimo is None else time.monotonic() - ultimo
+
+    @staticmethod
+    def _vencido(mensaje, ahora):
+        return bool(mensaje.get('ttl')) and ahora - mensaje['creado'] > mensaje['ttl']
+
+    def _derramar(self, mensaje):
+        # Se llama con el lock tomado; solo escribe en disco local
+        if self._vencido(mensaje, time.time()):
+            self.descartados += 1
+            return
+        try:
+            if self._escritura is None:
+                os.makedirs(self.directorio, exist_ok=True)
+                self._escritura = open(self.ruta_archivo, 'a', encoding='utf-8')
+            self._escritura.write(json.dumps(mensaje) + '\n')
+            self._escritura.flush()
+            self.derramados += 1
+        except OSError as e:
+            self.descartados += 1
+            logger.error(f"No se pudo derramar al archivo {self.ruta_archivo}, se descarta el mensaje: {e}")
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        """Arranca el hilo vaciador (idempotente); retoma el archivo desde el último offset"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._offset = self._leer_offset()
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name=f'buzon-{self.nombre}', daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        """Detiene el vaciador y derrama al archivo lo que quedó en memoria"""
+        self._detener.set()
+        self._hay_mensajes.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+        with self._lock:
+            # Un lote tomado del archivo sigue ahí: su offset no se confirmó
+            pendientes = ([] if self._en_vuelo_del_archivo else self._en_vuelo) + list(self.anillo)
+            self._en_vuelo = []
+            self.anillo.clear()
+            for mensaje in pendientes:
+                self._derramar(mensaje)
+            if self._escritura:
+                self._escritura.close()
+                self._escritura = None
+        if pendientes:
+            logger.info(f"Buzón '{self.nombre}': {len(pendientes)} mensajes derramados al archivo al detener.")
+
+    def _bucle(self):
+        espera = BUZON_ESPERA_SECONDS
+        while not self._detener.is_set():
+            self._hay_mensajes.clear()
+            try:
+                while self._enviar_lote() and not self._detener.is_set():
+                    pass
+            except redis.RedisError as e:
+                if self.conectado:
+                    logger.error(f"Redis no disponible, el buzón '{self.nombre}' retiene los mensajes: {e}")
+                self.conectado = False
+                self._detener.wait(espera)
+                espera = min(espera * 2, BUZON_BACKOFF_MAX_SECONDS)
+                continue
+            if not self.conectado:
+                logger.info(f"Conexión con Redis recuperada, buzón '{self.nombre}' vaciado ({self.descartados} descartados).")
+            self.conectado = True
+            espera = BUZON_ESPERA_SECONDS
+            self._hay_mensajes.wait(BUZON_ESPERA_SECONDS)
+
+    # --- Vaciado ---
+
+    def _enviar_lote(self):
+        """Envía un lote; retorna False si no quedaba nada por enviar"""
+        if not self._en_vuelo:
+            self._en_vuelo = self._tomar_del_archivo()
+            self._en_vuelo_del_archivo = bool(self._en_vuelo)
+            if not self._en_vuelo:
+                self._en_vuelo = self._tomar_del_anillo()
+            if not self._en_vuelo:
+                return False
+        ahora = time.time()
+        vigentes = [m for m in self._en_vuelo if not self._vencido(m, ahora)]
+        if vigentes:
+            with span('redis'):
+                self.cola.enqueue_many([Queue.prepare_data(m['funcion'], args=(m['datos'],)) for m in vigentes])
+        self.enviados += len(vigentes)
+        self.descartados += len(self._en_vuelo) - len(vigentes)
+        if self._en_vuelo_del_archivo:
+            self._confirmar_archivo()
+        self._en_vuelo = []
+        self._en_vuelo_del_archivo = False
+        return True
+
+    def _tomar_del_anillo(self):
+        with self._lock:
+            return [self.anillo.popleft() for _ in range(min(BUZON_LOTE, len(self.anillo)))]
+
+    def _tomar_del_archivo(self):
+        mensajes = []
+        self._offset_siguiente = self._offset
+        try:
+            with open(self.ruta_archivo, 'rb') as archivo:
+                archivo.seek(self._offset)
+                while len(mensajes) < BUZON_LOTE:
+                    linea = archivo.readline()
+                    # Fin del archivo o una línea que se está escribiendo todavía
+                    if not linea.endswith(b'\n'):
+                        break
+                    self._offset_siguiente += len(linea)
+                    try:
+                        mensajes.append(json.loads(linea))
+                    except ValueError:
+                        logger.error(f"Línea inválida en {self.ruta_archivo}, se omite: {linea[:200]!r}")
+        except FileNotFoundError:
+            return []
+        if not mensajes:
+            # Solo había líneas inválidas: se confirman para no releerlas
+            if self._offset_siguiente > self._offset:
+                self._confirmar_archivo()
+        return mensajes
+
+    def _confirmar_archivo(self):
+        self._offset = self._offset_siguiente
+        with self._lock:
+            # Archivo vaciado por completo: se trunca para que no crezca sin límite
+            if self._offset >= os.path.getsize(self.ruta_archivo):
+                os.truncate(self.ruta_archivo, 0)
+                self._offset = 0
+        self._guardar_offset()
+
+    def _leer_offset(self):
+        try:
+            with open(self.ruta_offset) as archivo:
+                offset = int(archivo.read().strip() or 0)
+            return offset if offset <= os.path.getsize(self.ruta_archivo) else 0
+        except (OSError, ValueError):
+            return 0
+
+    def _guardar_offset(self):
+        temporal = f'{self.ruta_offset}.{os.getpid()}.tmp'
+        try:
+            with open(temporal, 'w') as archivo:
+                archivo.write(str(self._offset))
+            os.replace(temporal, self.ruta_offset)
+        except OSError as e:
+            logger.error(f"No se pudo guardar el offset del buzón '{self.nombre}': {e}")
+
+    def estado(self):
+        with self._lock:
+            en_memoria = len(self.anillo) + len(self._en_vuelo)
+        try:
+            en_archivo_bytes = os.path.getsize(self.ruta_archivo) - self._offset
+        except OSError:
+            en_archivo_bytes = 0
+        return {
+            "conectado": self.conectado,
+            "en_memoria": en_memoria,
+            "en_archivo_bytes": en_archivo_bytes,
+            "enviados": self.enviados,
+            "derramados": self.derramados,
+            "descartados": self.descartados,
+        }
@@ -0,0 +1,202 @@
+"""
+Scheduler de un único proceso por contenedor.
+
+Con gunicorn y varios workers, cada worker arrancaría su propio
+BackgroundScheduler y los jobs se ejecutarían duplicados. Los workers compiten
+por un flock sobre PLANIFICADOR_DIR/<nombre>.lock: solo el que lo obtiene
+arranca el scheduler; los demás reintentan cada PLANIFICADOR_REINTENTO_SECONDS
+y toman el relevo si el líder muere (el sistema operativo libera el lock).
+
+/shutdown, /resume y /reschedule pueden llegar a cualquier worker, así que no tocan el
+scheduler directamente: actualizan el archivo de control <nombre>.json y el
+líder lo aplica. Lo mismo sirve para otras órdenes del servicio: solicitar()
+guarda una clave en el control y el líder la recibe en sus callbacks
+al_aplicar_control; publicar_estado() deja en <nombre>.estado.json lo que el
+líder quiera mostrar desde cualquier worker. PLANIFICADOR_DIR es por defecto /dev/shm (tmpfs), que se
+vacía al reiniciar el contenedor, igual que antes se perdía el estado del
+scheduler en memoria.
+"""
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_PAUSED
+
+logger = logging.getLogger('planificador')
+
+PLANIFICADOR_DIR = os.environ.get('PLANIFICADOR_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+PLANIFICADOR_REINTENTO_SECONDS = float(os.environ.get('PLANIFICADOR_REINTENTO_SECONDS', 1.0))
+
+
+class PlanificadorUnico:
+
+    def __init__(self, nombre, directorio=PLANIFICADOR_DIR):
+        self.nombre = nombre
+        self.scheduler = BackgroundScheduler()
+        self.ruta_lock = os.path.join(directorio, f'{nombre}.lock')
+        self.ruta_control = os.path.join(directorio, f'{nombre}.json')
+        self.ruta_estado = os.path.join(directorio, f'{nombre}.estado.json')
+        self.es_lider = False
+        self._al_ser_lider = []
+        self._al_aplicar_control = []
+        self._en_cada_ciclo = []
+        self._archivo_lock = None
+        self._control_aplicado = None
+        self._mutex = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def add_job(self, *args, **kwargs):
+        return self.scheduler.add_job(*args, **kwargs)
+
+    def al_ser_lider(self, callback):
+        """Registra una función que se ejecuta en el proceso que gana el lock"""
+        self._al_ser_lider.append(callback)
+
+    def al_aplicar_control(self, callback):
+        """Registra una función que el líder llama con el control cada vez que este cambia"""
+        self._al_aplicar_control.append(callback)
+
+    def en_cada_ciclo(self, callback):
+        """Registra una función que el líder llama cada PLANIFICADOR_REINTENTO_SECONDS"""
+        self._en_cada_ciclo.append(callback)
+
+    def iniciar(self):
+        """Arranca el hilo que compite por el liderazgo (idempotente)"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name=f'planificador-{self.nombre}', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Detiene el scheduler (si este proceso es el líder) y libera el lock"""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(PLANIFICADOR_REINTENTO_SECONDS * 2)
+        with self._mutex:
+            if self.scheduler.running:
+                self.scheduler.shutdown(wait=False)
+            if self._archivo_lock:
+                self._archivo_lock.close()
+                self._archivo_lock = None
+            self.es_lider = False
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            with self._mutex:
+                if not self.es_lider:
+                    self._intentar_liderar()
+                if self.es_lider:
+                    self._aplicar_control()
+                    self._llamar(self._en_cada_ciclo)
+            self._detener.wait(PLANIFICADOR_REINTENTO_SECONDS)
+
+    def _intentar_liderar(self):
+        archivo = open(self.ruta_lock, 'a')
+        try:
+            fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            archivo.close()
+            return
+        self._archivo_lock = archivo
+        self.es_lider = True
+        # None fuerza a aplicar el control (y arrancar el scheduler) en el primer ciclo
+        self._control_aplicado = None
+        logger.info(f"Proceso {os.getpid()} es el líder del scheduler '{self.nombre}'")
+        self._llamar(self._al_ser_lider)
+
+    def _llamar(self, callbacks, *args):
+        for callback in callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error en un callback del líder del scheduler '{self.nombre}': {e}")
+
+    def _leer_control(self):
+        try:
+            with open(self.ruta_control) as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return {}
+
+    def _aplicar_control(self):
+        control = self._leer_control()
+        if control == self._control_aplicado:
+            return
+        apagado = bool(control.get('apagado'))
+        # Apagar pausa el scheduler en lugar de cerrarlo: shutdown() descarta los jobs
+        if not self.scheduler.running:
+            self.scheduler.start(paused=apagado)
+            logger.info(f"Scheduler '{self.nombre}' iniciado{' (apagado)' if apagado else ''}.")
+        elif apagado and self.scheduler.state != STATE_PAUSED:
+            self.scheduler.pause()
+            logger.info(f"Scheduler '{self.nombre}' apagado.")
+        elif not apagado and self.scheduler.state == STATE_PAUSED:
+            self.scheduler.resume()
+            logger.info(f"Scheduler '{self.nombre}' reanudado.")
+        for job_id, segundos in control.get('intervalos', {}).items():
+            if (self._control_aplicado or {}).get('intervalos', {}).get(job_id) != segundos:
+                self.scheduler.reschedule_job(job_id, trigger='interval', seconds=segundos)
+                # Corre de inmediato para que la nueva cadencia se note (p. ej. el heartbeat la anuncia)
+                self.scheduler.modify_job(job_id, next_run_time=datetime.now(self.scheduler.timezone))
+                logger.info(f"Job '{job_id}' reprogramado cada {segundos} segundos.")
+        self._llamar(self._al_aplicar_control, control)
+        self._control_aplicado = control
+
+    def _escribir_json(self, ruta, datos):
+        temporal = f'{ruta}.{os.getpid()}.tmp'
+        with open(temporal, 'w') as archivo:
+            json.dump(datos, archivo)
+        os.replace(temporal, ruta)
+
+    def _actualizar_control(self, cambio):
+        # El lock del archivo de control serializa escrituras de workers distintos
+        with open(self.ruta_control + '.lock', 'a') as candado:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+            control = self._leer_control()
+            cambio(control)
+            self._escribir_json(self.ruta_control, control)
+        # Si este proceso es el líder se aplica sin esperar al siguiente ciclo
+        with self._mutex:
+            if self.es_lider:
+                self._aplicar_control()
+
+    def apagar(self):
+        self._actualizar_control(lambda control: control.update(apagado=True))
+
+    def reanudar(self):
+        self._actualizar_control(lambda control: control.update(apagado=False))
+
+    def solicitar(self, clave, valor):
+        """Guarda `valor` bajo `clave` en el control para que lo aplique el líder"""
+        self._actualizar_control(lambda control: control.update({clave: valor}))
+
+    def publicar_estado(self, estado):
+        self._escribir_json(self.ruta_estado, estado)
+
+    def leer_estado(self):
+        """Último estado publicado por el líder ({} si todavía no hay)"""
+        try:
+            with open(self.ruta_estado) as archivo:
+                return json.load(archivo)
+        except (OSError, ValueError):
+            return {}
+
+    def reprogramar(self, job_id, segundos):
+        if self.scheduler.get_job(job_id) is None:
+            raise KeyError(f"No existe el job '{job_id}'")
+        self._actualizar_control(lambda control: control.setdefault('intervalos', {}).update({job_id: segundos}))
+
+    def intervalo(self, job_id):
+        """Segundos del trigger interval vigente del job en este proceso (None si no existe)"""
+        job = self.scheduler.get_job(job_id)
+        return job.trigger.interval.total_seconds() if job else None
+
+    def estado(self):
+        return {"lider": self.es_lider, "pid": os.getpid(), "control": self._leer_control()}
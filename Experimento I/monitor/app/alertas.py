@@ -0,0 +1,296 @@
+"""
+Alertas por flanco: máquina de estados por servicio y notificador asíncrono.
+
+    UP         -> heartbeats al día
+    SUSPECT    -> sin heartbeat por más de ALERTAS_FACTOR_SOSPECHA intervalos, o
+                  se perdieron ALERTAS_PERDIDOS_SOSPECHA heartbeats seguidos
+    DOWN       -> sin heartbeat por más de ALERTAS_FACTOR_CAIDA intervalos
+    RECOVERED  -> volvió a llegar heartbeat tras DOWN; pasa a UP después de
+                  ALERTAS_INTERVALOS_RECUPERACION intervalos sanos
+
+El intervalo de cada servicio es el que anuncia en sus heartbeats (el de la
+configuración del monitor hasta recibir el primero), así los umbrales siguen
+su cadencia real tras un /reschedule. La secuencia de los heartbeats revela
+los perdidos antes de que venza el umbral, y los que llegan atrasados (p. ej.
+un reintento del broker) no cuentan como prueba de vida.
+
+La histéresis (dos umbrales y la confirmación de recuperación) evita que un
+servicio que oscila alrededor del umbral genere una alerta por evaluación.
+Solo se notifican las transiciones; el envío a los sumideros (archivo,
+webhook, Redis pub/sub) ocurre en un hilo aparte para no bloquear al
+scheduler, con un límite de alertas por servicio y ventana de tiempo.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import datetime, timezone
+
+import redis
+
+logger = logging.getLogger('monitor.alertas')
+
+UP = 'UP'
+SUSPECT = 'SUSPECT'
+DOWN = 'DOWN'
+RECOVERED = 'RECOVERED'
+
+ALERTAS_FACTOR_SOSPECHA = float(os.environ.get('ALERTAS_FACTOR_SOSPECHA', 2))
+ALERTAS_FACTOR_CAIDA = float(os.environ.get('ALERTAS_FACTOR_CAIDA', 4))
+# ALERTAS_TICKS_RECUPERACION es el nombre anterior (cuando se contaban evaluaciones)
+ALERTAS_INTERVALOS_RECUPERACION = float(os.environ.get(
+    'ALERTAS_INTERVALOS_RECUPERACION', os.environ.get('ALERTAS_TICKS_RECUPERACION', 3)))
+ALERTAS_PERDIDOS_SOSPECHA = int(os.environ.get('ALERTAS_PERDIDOS_SOSPECHA', 2))
+ALERTAS_INTERVALO_MAX_SECONDS = float(os.environ.get('ALERTAS_INTERVALO_MAX_SECONDS', 3600))
+# Cada cuánto se evalúan los umbrales: debe ser menor que el intervalo más corto de los servicios
+ALERTAS_EVALUACION_SECONDS = float(os.environ.get('ALERTAS_EVALUACION_SECONDS', 0.5))
+ALERTAS_SUMIDEROS = os.environ.get('ALERTAS_SUMIDEROS', 'archivo,redis')
+ALERTAS_ARCHIVO = os.environ.get('ALERTAS_ARCHIVO', '/var/logs/monitor/alertas.jsonl')
+ALERTAS_WEBHOOK_URL = os.environ.get('ALERTAS_WEBHOOK_URL', '')
+ALERTAS_WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get('ALERTAS_WEBHOOK_TIMEOUT_SECONDS', 2))
+ALERTAS_CANAL = os.environ.get('ALERTAS_CANAL', 'monitor:alertas')
+ALERTAS_COLA_MAXSIZE = int(os.environ.get('ALERTAS_COLA_MAXSIZE', 1000))
+ALERTAS_MAX_POR_VENTANA = int(os.environ.get('ALERTAS_MAX_POR_VENTANA', 5))
+ALERTAS_VENTANA_SEGUNDOS = float(os.environ.get('ALERTAS_VENTANA_SEGUNDOS', 60))
+
+
+class MaquinaAlertas:
+    """Estado de alerta de cada servicio; `evaluar` retorna la transición o None"""
+
+    def __init__(self, intervalo_segundos, ahora=None):
+        self.intervalo_defecto = intervalo_segundos
+        # Un servicio que nunca envió heartbeat se mide desde el arranque del monitor
+        self.inicio = ahora or datetime.now(timezone.utc)
+        self.estados = {}
+        self.intervalos = {}
+        self.secuencias = {}
+        self.perdidos = {}
+        self.perdidos_total = {}
+        self.recuperado_desde = {}
+        self._lock = threading.Lock()
+
+    def estado(self, servicio):
+        return self.estados.get(servicio, UP)
+
+    def intervalo(self, servicio):
+        return self.intervalos.get(servicio, self.intervalo_defecto)
+
+    def registrar_heartbeat(self, servicio, intervalo=None, secuencia=None, epoca=None):
+        """
+        Actualiza el intervalo anunciado y la secuencia del servicio. Retorna
+        (vigente, perdidos): vigente=False si el heartbeat llega atrasado y no
+        prueba vida; perdidos = heartbeats que faltaron antes de este.
+        """
+        with self._lock:
+            if isinstance(intervalo, (int, float)) and 0 < intervalo <= ALERTAS_INTERVALO_MAX_SECONDS:
+                self.intervalos[servicio] = float(intervalo)
+            if not isinstance(secuencia, int) or epoca is None:
+                # Heartbeat sin secuencia (p. ej. vida implícita reenviada por el broker)
+                return True, 0
+            anterior = self.secuencias.get(servicio)
+            self.secuencias[servicio] = (epoca, max(secuencia, anterior[1]) if anterior and anterior[0] == epoca else secuencia)
+            if anterior is None or anterior[0] != epoca:
+                # Primer heartbeat de este shard o nueva época del emisor: no hay con qué comparar
+                self.perdidos[servicio] = 0
+                return True, 0
+            if secuencia <= anterior[1]:
+                return False, 0
+            perdidos = secuencia - anterior[1] - 1
+            self.perdidos[servicio] = perdidos
+            self.perdidos_total[servicio] = self.perdidos_total.get(servicio, 0) + perdidos
+            return True, perdidos
+
+    def evaluar(self, servicio, ultimo_heartbeat, ahora):
+        with self._lock:
+            intervalo = self.intervalo(servicio)
+            sin_heartbeat = (ahora - (ultimo_heartbeat or self.inicio)).total_seconds()
+            anterior = self.estado(servicio)
+
+            if sin_heartbeat > intervalo * ALERTAS_FACTOR_CAIDA:
+                nuevo = DOWN
+            elif sin_heartbeat > intervalo * ALERTAS_FACTOR_SOSPECHA:
+                # Una vez caído, solo un heartbeat fresco lo saca de DOWN
+                nuevo = DOWN if anterior == DOWN else SUSPECT
+            elif anterior == DOWN:
+                nuevo = RECOVERED
+            elif anterior == RECOVERED:
+                sano = (ahora - self.recuperado_desde.get(servicio, ahora)).total_seconds()
+                nuevo = UP if sano >= intervalo * ALERTAS_INTERVALOS_RECUPERACION else RECOVERED
+            elif self.perdidos.get(servicio, 0) >= ALERTAS_PERDIDOS_SOSPECHA:
+                # Llegan heartbeats pero se pierden otros: sospechoso hasta el siguiente en secuencia
+                nuevo = SUSPECT
+            else:
+                nuevo = UP
+
+            if nuevo == anterior:
+                return None
+            self.estados[servicio] = nuevo
+            if nuevo == RECOVERED:
+                self.recuperado_desde[servicio] = ahora
+            return {
+                "servicio": servicio,
+                "anterior": anterior,
+                "estado": nuevo,
+                "tiempo_sin_heartbeat": round(sin_heartbeat, 3),
+                "ultimo_heartbeat": ultimo_heartbeat.isoformat() if ultimo_heartbeat else None,
+                "intervalo": intervalo,
+                "perdidos": self.perdidos.get(servicio, 0),
+                "fecha": ahora.isoformat(),
+            }
+
+    def restaurar(self, servicio, estado, intervalo=None):
+        """Adopta el estado publicado por el shard anterior (handoff) sin emitir alerta"""
+        with self._lock:
+            if estado in (UP, SUSPECT, DOWN, RECOVERED):
+                self.estados[servicio] = estado
+                self.recuperado_desde[servicio] = datetime.now(timezone.utc)
+            if isinstance(intervalo, (int, float)) and 0 < intervalo <= ALERTAS_INTERVALO_MAX_SECONDS:
+                self.intervalos[servicio] = float(intervalo)
+
+    def olvidar(self, servicio):
+        with self._lock:
+            for registro in (self.estados, self.intervalos, self.secuencias, self.perdidos, self.perdidos_total, self.recuperado_desde):
+                registro.pop(servicio, None)
+
+
+class SumideroArchivo:
+    """Agrega cada alerta como una línea JSON"""
+
+    def __init__(self, ruta=ALERTAS_ARCHIVO):
+        self.ruta = ruta
+
+    def enviar(self, alerta):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            archivo.write(json.dumps(alerta) + '\n')
+
+
+class SumideroWebhook:
+    """POST JSON a una URL externa (p. ej. un canal de chat o un gestor de incidentes)"""
+
+    def __init__(self, url=ALERTAS_WEBHOOK_URL, timeout=ALERTAS_WEBHOOK_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+
+    def enviar(self, alerta):
+        solicitud = urllib.request.Request(
+            self.url,
+            data=json.dumps(alerta).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(solicitud, timeout=self.timeout):
+            pass
+
+
+class SumideroRedis:
+    """Publica cada alerta en un canal de Redis pub/sub"""
+
+    def __init__(self, redis_conn, canal=ALERTAS_CANAL):
+        self.redis = redis_conn
+        self.canal = canal
+
+    def enviar(self, alerta):
+        self.redis.publish(self.canal, json.dumps(alerta))
+
+
+# Sumideros disponibles por nombre; se pueden registrar otros antes de crear el notificador
+SUMIDEROS = {
+    'archivo': lambda redis_conn: SumideroArchivo(),
+    'webhook': lambda redis_conn: SumideroWebhook(),
+    'redis': lambda redis_conn: SumideroRedis(redis_conn),
+}
+
+
+def crear_sumideros(redis_conn, nombres=ALERTAS_SUMIDEROS):
+    sumideros = []
+    for nombre in filter(None, (n.strip() for n in nombres.split(','))):
+        if nombre not in SUMIDEROS:
+            logger.error(f"Sumidero de alertas desconocido: '{nombre}'")
+        elif nombre == 'webhook' and not ALERTAS_WEBHOOK_URL:
+            logger.error("Sumidero 'webhook' configurado sin ALERTAS_WEBHOOK_URL, se omite")
+        else:
+            sumideros.append(SUMIDEROS[nombre](redis_conn))
+    return sumideros
+
+
+class NotificadorAlertas:
+    """
+    Despacha las alertas a los sumideros desde un hilo propio.
+
+    Si un servicio supera ALERTAS_MAX_POR_VENTANA alertas en la ventana, se
+    retiene solo la más reciente y se envía cuando la ventana lo permite (con
+    el conteo de las reemplazadas), así el estado final nunca se pierde.
+    """
+
+    def __init__(self, sumideros):
+        self.sumideros = sumideros
+        self.cola = queue.Queue(maxsize=ALERTAS_COLA_MAXSIZE)
+        self.enviadas = {}
+        self.pendientes = {}
+        self.suprimidas = {}
+        self.descartadas = 0
+        self._hilo = None
+
+    def notificar(self, alerta):
+        """No bloquea: si la cola está llena la alerta se descarta"""
+        try:
+            self.cola.put_nowait(alerta)
+        except queue.Full:
+            self.descartadas += 1
+            logger.error(f"Cola de alertas llena, se descarta: {alerta}")
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._despachar, name='notificador-alertas', daemon=True)
+        self._hilo.start()
+
+    def _permitida(self, servicio, ahora):
+        enviadas = self.enviadas.setdefault(servicio, deque())
+        while enviadas and ahora - enviadas[0] > ALERTAS_VENTANA_SEGUNDOS:
+            enviadas.popleft()
+        return len(enviadas) < ALERTAS_MAX_POR_VENTANA
+
+    def _despachar(self):
+        while True:
+            try:
+                alerta = self.cola.get(timeout=1.0)
+            except queue.Empty:
+                alerta = None
+            ahora = time.monotonic()
+            if alerta is not None:
+                servicio = alerta['servicio']
+                if servicio not in self.pendientes and self._permitida(servicio, ahora):
+                    self._enviar(alerta, ahora)
+                else:
+                    # Solo se conserva la más reciente; las reemplazadas cuentan como suprimidas
+                    if servicio in self.pendientes:
+                        self.suprimidas[servicio] = self.suprimidas.get(servicio, 0) + 1
+                    self.pendientes[servicio] = alerta
+            for servicio in [s for s in self.pendientes if self._permitida(s, ahora)]:
+                self._enviar(self.pendientes.pop(servicio), ahora)
+
+    def _enviar(self, alerta, ahora):
+        servicio = alerta['servicio']
+        suprimidas = self.suprimidas.pop(servicio, 0)
+        if suprimidas:
+            alerta = dict(alerta, suprimidas=suprimidas)
+        self.enviadas[servicio].append(ahora)
+        for sumidero in self.sumideros:
+            try:
+                sumidero.enviar(alerta)
+            except (OSError, redis.RedisError) as e:
+                logger.error(f"Error enviando alerta a {type(sumidero).__name__}: {e}")
+
+    def estadisticas(self):
+        return {
+            "en_cola": self.cola.qsize(),
+            "pendientes": len(self.pendientes),
+            "suprimidas": dict(self.suprimidas),
+            "descartadas": self.descartadas,
+            "sumideros": [type(s).__name__ for s in self.sumideros],
+        }
@@ -0,0 +1,111 @@
+"""
+Filtros probabilísticos compartidos por los consumidores.
+
+Copia idéntica en Experimento I/monitor/app/filtros.py y
+Experimento II/seguridad/app/filtros.py (cada servicio es su propio contexto
+de Docker): un cambio en una debe copiarse a la otra.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+
+class FiltroBloom:
+    """
+    Filtro de Bloom compacto (bytearray) con doble hashing sobre blake2b.
+
+    Un negativo es definitivo; un positivo debe confirmarse contra la fuente
+    exacta (Redis, un LRU). El orden de bits (MSB primero) coincide con
+    SETBIT/GETBIT de Redis, así el mismo filtro puede mantenerse en el
+    servidor y copiarse con un GET.
+    """
+
+    def __init__(self, capacidad: int, tasa_falsos_positivos: float):
+        self.tamano_bits = max(8, int(-capacidad * math.log(tasa_falsos_positivos) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.tamano_bits / capacidad * math.log(2)))
+        self.bits = bytearray((self.tamano_bits + 7) // 8)
+
+    def posiciones(self, elemento: str):
+        digest = hashlib.blake2b(elemento.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.tamano_bits
+
+    def agregar(self, elemento: str):
+        for posicion in self.posiciones(elemento):
+            self.bits[posicion >> 3] |= 0x80 >> (posicion & 7)
+
+    def contiene(self, elemento: str) -> bool:
+        return all(self.bits[posicion >> 3] & (0x80 >> (posicion & 7)) for posicion in self.posiciones(elemento))
+
+    def a_bytes(self) -> bytes:
+        return bytes(self.bits)
+
+    def combinar_bytes(self, datos: bytes):
+        """Une (OR) un filtro serializado con este; SETBIT puede dejarlo más corto"""
+        if len(datos) <= len(self.bits):
+            self.bits = bytearray(a | b for a, b in zip(self.bits, datos.ljust(len(self.bits), b'\x00')))
+
+
+class FiltroDuplicados:
+    """
+    Detector de mensajes duplicados por id: filtro de Bloom + LRU exacto.
+
+    La ventana de deduplicación es la del LRU: los últimos `capacidad_exacta`
+    ids, suficiente para las re-entregas del broker, que llegan poco después
+    del original. El Bloom (dos generaciones de `capacidad` ids que rotan) es
+    la primera etapa compacta: un negativo, el caso común, se resuelve con unos
+    pocos bits sin tocar el LRU, y solo un positivo se confirma contra el LRU.
+    Un positivo que no está en el LRU puede ser un falso positivo o un id más
+    viejo que la ventana, y se deja pasar: perder un mensaje nuevo es peor que
+    procesar un duplicado viejo.
+    """
+
+    def __init__(self, capacidad: int = 100000, capacidad_exacta: int = 10000,
+                 tasa_falsos_positivos: float = 0.001):
+        self.capacidad = capacidad
+        self.capacidad_exacta = capacidad_exacta
+        self.tasa_falsos_positivos = tasa_falsos_positivos
+        self._actual = FiltroBloom(capacidad, tasa_falsos_positivos)
+        self._anterior = FiltroBloom(capacidad, tasa_falsos_positivos)
+        self._insertados = 0
+        self._recientes: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicados = 0
+        self.positivos_sin_confirmar = 0
+
+    def es_duplicado(self, id_mensaje) -> bool:
+        """Registra el id y retorna True si ya se había visto. Los ids vacíos nunca son duplicados"""
+        if not id_mensaje:
+            return False
+        clave = str(id_mensaje)
+        with self._lock:
+            if self._actual.contiene(clave) or self._anterior.contiene(clave):
+                if clave in self._recientes:
+                    self._recientes.move_to_end(clave)
+                    self.duplicados += 1
+                    return True
+                self.positivos_sin_confirmar += 1
+            self._recientes[clave] = None
+            if len(self._recientes) > self.capacidad_exacta:
+                self._recientes.popitem(last=False)
+            self._actual.agregar(clave)
+            self._insertados += 1
+            if self._insertados >= self.capacidad:
+                self._anterior = self._actual
+                self._actual = FiltroBloom(self.capacidad, self.tasa_falsos_positivos)
+                self._insertados = 0
+            return False
+
+    def olvidar(self, id_mensaje):
+        """
+        Quita el id del LRU cuando su mensaje falló al procesarse, para que la
+        re-entrega del broker no se descarte como duplicado. El Bloom no puede
+        borrar, pero un positivo fuera del LRU ya se deja pasar.
+        """
+        if not id_mensaje:
+            return
+        with self._lock:
+            self._recientes.pop(str(id_mensaje), None)
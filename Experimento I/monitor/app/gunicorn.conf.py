@@ -0,0 +1,35 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py "main:create_app()"
+
+La app se importa una vez en el master (preload) y cada worker arranca sus
+hilos en post_worker_init; el scheduler corre en un solo worker gracias a
+PlanificadorUnico.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# Excepción a "un worker por núcleo": los últimos heartbeats, la máquina de
+# alertas y la vista viven en memoria del proceso, así que cada shard es un solo
+# worker con hilos y usa un núcleo para Python. Para usar más núcleos se
+# agregan shards del monitor (monitor-2, ...), no workers (ver README).
+# Cada suscriptor de /estado/stream ocupa un hilo; VISTA_MAX_SUSCRIPTORES
+# debe quedar por debajo de GUNICORN_THREADS para dejar hilos a los heartbeats.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 10))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+preload_app = True
+
+
+def post_worker_init(worker):
+    import main
+    main.iniciar_servicio()
+
+
+def worker_exit(server, worker):
+    import main
+    main.detener_servicio()
@@ -2,9 +2,16 @@ import logging
 import os
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify
 from datetime import datetime, timezone
-from apscheduler.schedulers.background import BackgroundScheduler
+import redis
+from filtros import FiltroDuplicados
+from shards import MembresiaShards
+from alertas import MaquinaAlertas, NotificadorAlertas, crear_sumideros, DOWN, SUSPECT, ALERTAS_EVALUACION_SECONDS
+from vista import VistaEstado
+from planificador import PlanificadorUnico
+import perfilado
+from perfilado import span
 
 # Crear directorio de logs si no existe
 LOGS_DIR = '/var/logs/monitor'  # Dentro del contenedor
@@ -85,26 +92,61 @@ logger = setup_logging()
 # Configure logging básico (para compatibilidad)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
+bp = Blueprint('monitor', __name__)
 
 ULTIMOS_HEARTBEATS = {}
 LATENCIAS = {}
 SERVICIOS_MONITOREADOS = ['modulo-pedidos-1', 'modulo-pedidos-2', 'modulo-pedidos-3']
 SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_INTERVAL_SECONDS', 3))
 
+# Descarta heartbeats re-entregados por el broker para no sesgar las latencias
+filtro_duplicados = FiltroDuplicados(int(os.environ.get('DEDUPE_CAPACIDAD', 100000)),
+                                     int(os.environ.get('DEDUPE_CAPACIDAD_EXACTA', 10000)))
 
-@app.route('/')
+# Sharding: cada instancia es dueña de un rango del anillo consistente de servicios
+redis_conn = redis.Redis(
+    host=os.environ.get('REDIS_HOST', 'redis'),
+    port=int(os.environ.get('REDIS_PORT', 6379)),
+    socket_timeout=1,
+    socket_connect_timeout=1
+)
+membresia = MembresiaShards(redis_conn)
+
+# Alertas por flanco: solo se notifican los cambios de estado de cada servicio
+maquina_alertas = MaquinaAlertas(SCHEDULER_INTERVAL_SECONDS)
+notificador = NotificadorAlertas(crear_sumideros(redis_conn))
+
+# Vista precalculada para /estado y la transmisión en vivo
+vista = VistaEstado(SERVICIOS_MONITOREADOS, max_suscriptores=int(os.environ.get('VISTA_MAX_SUSCRIPTORES', 24)))
+
+
+@bp.route('/')
 def home():
     return jsonify({"mensaje": "Hola, soy el microservicio Monitor!"})
 
-@app.route('/reportar-heartbeat', methods=['POST'])
+@bp.route('/reportar-heartbeat', methods=['POST'])
 def reportar_heartbeat():
-    data = request.json
+    with span('json'):
+        data = request.json
     if not data:
         logger.error("Request body vacío o no JSON")
         return jsonify({"status": "error", "mensaje": "Request body debe ser JSON"}), 400
 
     servicio_origen = data.get('servicio_origen', 'desconocido')
+
+    if filtro_duplicados.es_duplicado(data.get('id')):
+        logger.info(f"Heartbeat duplicado de '{servicio_origen}' descartado: {data.get('id')}")
+        return jsonify({"status": "DUPLICADO", "servicio_origen": servicio_origen}), 200
+
+    try:
+        return procesar_heartbeat(data, servicio_origen)
+    except Exception:
+        # El broker reintenta el 500: la re-entrega no debe descartarse como duplicado
+        filtro_duplicados.olvidar(data.get('id'))
+        raise
+
+
+def procesar_heartbeat(data, servicio_origen):
     timestamp_str = data.get('timestamp')
 
     if not timestamp_str:
@@ -122,16 +164,30 @@ def reportar_heartbeat():
     ahora_utc = datetime.now(timezone.utc)
     latencia = ahora_utc - timestamp_origen
 
+    # El heartbeat anuncia el intervalo del emisor (ajusta sus umbrales) y su secuencia
+    vigente, perdidos = maquina_alertas.registrar_heartbeat(
+        servicio_origen, data.get('intervalo'), data.get('secuencia'), data.get('epoca'))
+    if not vigente:
+        logger.info(f"Heartbeat atrasado de '{servicio_origen}' (secuencia {data.get('secuencia')}), no cuenta como prueba de vida")
+        return jsonify({"status": "ATRASADO", "servicio_origen": servicio_origen}), 200
+    if perdidos:
+        logger.warning(f"⚠️ Se perdieron {perdidos} heartbeats de '{servicio_origen}' antes de la secuencia {data.get('secuencia')}")
+
     # Guardar ultimo heartbeat y latencia
     ULTIMOS_HEARTBEATS[servicio_origen] = ahora_utc
     LATENCIAS[servicio_origen] = latencia.total_seconds()
+    vista.registrar_heartbeat(servicio_origen, ahora_utc, latencia.total_seconds(), maquina_alertas.intervalo(servicio_origen))
 
-    # Log específico para heartbeats (archivo separado)
-    heartbeat_logger = logging.getLogger('monitor.heartbeats')
-    heartbeat_logger.info(f"Servicio: {servicio_origen} | Latencia: {latencia.total_seconds():.4f}s | Timestamp: {timestamp_str}")
-    
-    # Log general
-    logger.info(f"✅ Heartbeat recibido de '{servicio_origen}' - Latencia: {latencia.total_seconds():.4f}s")
+    # Implícito: el broker lo derivó de un mensaje de negocio del servicio (vida implícita)
+    tipo = "implícito" if data.get('implicito') else "explícito"
+
+    with span('logging'):
+        # Log específico para heartbeats (archivo separado)
+        heartbeat_logger = logging.getLogger('monitor.heartbeats')
+        heartbeat_logger.info(f"Servicio: {servicio_origen} | Latencia: {latencia.total_seconds():.4f}s | Timestamp: {timestamp_str} | Tipo: {tipo}")
+
+        # Log general
+        logger.info(f"✅ Heartbeat {tipo} recibido de '{servicio_origen}' - Latencia: {latencia.total_seconds():.4f}s")
     
     return jsonify({
         "status": "OK",
@@ -140,69 +196,204 @@ def reportar_heartbeat():
     }), 200
 
 
+@bp.route('/estado-global')
+def estado_global():
+    """
+    Vista combinada del estado publicado por todos los shards del monitor.
+    """
+    try:
+        estados = membresia.estado_global()
+    except redis.RedisError as e:
+        logger.error(f"No se pudo leer el estado global, se retorna el estado local: {e}")
+        estados = estados_locales(datetime.now(timezone.utc), SERVICIOS_MONITOREADOS)
+    return jsonify({
+        "shard": membresia.shard_id,
+        "shards": membresia.miembros(),
+        "servicios": estados
+    }), 200
+
+
+@bp.route('/estado')
+def estado():
+    """
+    Snapshot del estado de los servicios de este shard, servido desde la vista precalculada.
+    """
+    return Response(vista.snapshot(), mimetype='application/json')
+
+
+@bp.route('/estado/stream')
+def estado_stream():
+    """
+    Server-Sent Events con las transiciones de alerta y el resumen de latencias.
+    Soporta Last-Event-ID para reanudar sin perder eventos.
+    """
+    ultimo_id = request.headers.get('Last-Event-ID')
+    transmision = vista.suscribir(int(ultimo_id) if ultimo_id and ultimo_id.isdigit() else None)
+    if transmision is None:
+        logger.warning(f"Suscripción a /estado/stream rechazada: {vista.suscriptores} suscriptores activos")
+        return jsonify({"status": "error", "mensaje": "Demasiados suscriptores, reintente más tarde"}), 503, {'Retry-After': '5'}
+    respuesta = Response(
+        transmision,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # close() de la respuesta libera el cupo aunque el cliente corte antes del primer byte
+    respuesta.call_on_close(vista.desuscribir)
+    return respuesta
+
+
+@bp.route('/alertas')
+def alertas():
+    """
+    Estado de alerta de los servicios propios y estadísticas del notificador.
+    """
+    return jsonify({
+        "shard": membresia.shard_id,
+        "servicios": {s: maquina_alertas.estado(s) for s in SERVICIOS_MONITOREADOS if membresia.es_propio(s)},
+        "intervalos": {s: maquina_alertas.intervalo(s) for s in SERVICIOS_MONITOREADOS if membresia.es_propio(s)},
+        "heartbeats_perdidos": dict(maquina_alertas.perdidos_total),
+        "notificador": notificador.estadisticas()
+    }), 200
+
+
+def estados_locales(ahora, servicios):
+    """
+    Estado de los servicios dados según los heartbeats recibidos por este shard.
+    """
+    estados = {}
+    for servicio in servicios:
+        ultimo_heartbeat = ULTIMOS_HEARTBEATS.get(servicio)
+        if ultimo_heartbeat is None:
+            estado = 'sin_heartbeat'
+        elif (ahora - ultimo_heartbeat).total_seconds() > maquina_alertas.intervalo(servicio) * 2:
+            estado = 'timeout'
+        else:
+            estado = 'OK'
+        estados[servicio] = {
+            "shard": membresia.shard_id,
+            "estado": estado,
+            "ultimo_heartbeat": ultimo_heartbeat.isoformat() if ultimo_heartbeat else None,
+            "latencia_segundos": LATENCIAS.get(servicio),
+            "alerta": maquina_alertas.estado(servicio),
+            "intervalo": maquina_alertas.intervalo(servicio),
+            "actualizado": ahora.isoformat()
+        }
+    return estados
+
+
+def sincronizar_shards():
+    """
+    Renueva la membresía del shard y hace el handoff de los servicios que cambian de dueño.
+    """
+    ganados, perdidos = membresia.sincronizar(SERVICIOS_MONITOREADOS)
+    if perdidos:
+        membresia.publicar_estado(estados_locales(datetime.now(timezone.utc), perdidos))
+        for servicio in perdidos:
+            ULTIMOS_HEARTBEATS.pop(servicio, None)
+            LATENCIAS.pop(servicio, None)
+            maquina_alertas.olvidar(servicio)
+            vista.olvidar(servicio)
+    for servicio, estado in membresia.cargar_estado(ganados).items():
+        maquina_alertas.restaurar(servicio, estado.get('alerta'), estado.get('intervalo'))
+        if estado.get('ultimo_heartbeat'):
+            recibido = datetime.fromisoformat(estado['ultimo_heartbeat'])
+            if servicio not in ULTIMOS_HEARTBEATS or ULTIMOS_HEARTBEATS[servicio] < recibido:
+                ULTIMOS_HEARTBEATS[servicio] = recibido
+                LATENCIAS[servicio] = estado.get('latencia_segundos')
+
+
+def evaluar_alertas():
+    """
+    Evalúa los umbrales de los servicios propios cada ALERTAS_EVALUACION_SECONDS,
+    así la detección sigue la cadencia de cada servicio y no la del monitoreo.
+    """
+    ahora = datetime.now(timezone.utc)
+    for servicio in SERVICIOS_MONITOREADOS:
+        if not membresia.es_propio(servicio):
+            continue
+        transicion = maquina_alertas.evaluar(servicio, ULTIMOS_HEARTBEATS.get(servicio), ahora)
+        if transicion:
+            mensaje = (f"Servicio '{servicio}' {transicion['anterior']} -> {transicion['estado']} "
+                       f"(sin heartbeat por {transicion['tiempo_sin_heartbeat']:.2f}s, último: {transicion['ultimo_heartbeat']})")
+            if transicion['estado'] in (DOWN, SUSPECT):
+                logger.warning(f"⚠️ ALERTA: {mensaje}")
+            else:
+                logger.info(f"✅ {mensaje}")
+            notificador.notificar({**transicion, "shard": membresia.shard_id})
+            vista.registrar_transicion(transicion)
+
+
 def monitor():
     """
     Función que se ejecuta periódicamente para monitorear los servicios.
+    Solo se reportan los servicios cuyo rango pertenece a este shard.
     """
-    logger.debug(f"Ejecutando monitoreo de {len(SERVICIOS_MONITOREADOS)} servicios")
+    sincronizar_shards()
+    servicios_propios = [s for s in SERVICIOS_MONITOREADOS if membresia.es_propio(s)]
+    logger.debug(f"Ejecutando monitoreo de {len(servicios_propios)} servicios (shard '{membresia.shard_id}')")
     
     ahora = datetime.now(timezone.utc)
-    servicios_con_problemas = []
+    servicios_con_problemas = [s for s in servicios_propios if maquina_alertas.estado(s) in (DOWN, SUSPECT)]
     
-    for servicio in SERVICIOS_MONITOREADOS:
-        ultimo_heartbeat = ULTIMOS_HEARTBEATS.get(servicio)
-        
-        if ultimo_heartbeat:
-            tiempo_desde_ultimo = (ahora - ultimo_heartbeat).total_seconds()
-            
-            if tiempo_desde_ultimo > SCHEDULER_INTERVAL_SECONDS * 2:
-                mensaje_alerta = f"Servicio '{servicio}' sin heartbeat por {tiempo_desde_ultimo:.2f} segundos (último: {ultimo_heartbeat.isoformat()})"
-                logger.warning(f"⚠️ ALERTA: {mensaje_alerta}")
-                servicios_con_problemas.append({
-                    'servicio': servicio,
-                    'problema': 'timeout',
-                    'tiempo_sin_heartbeat': tiempo_desde_ultimo,
-                    'ultimo_heartbeat': ultimo_heartbeat.isoformat()
-                })
-            else:
-                logger.debug(f"✅ Servicio '{servicio}' OK - último heartbeat hace {tiempo_desde_ultimo:.1f}s")
-        else:
-            mensaje_alerta = f"Servicio '{servicio}' nunca ha enviado heartbeat"
-            logger.warning(f"⚠️ ALERTA: {mensaje_alerta}")
-            servicios_con_problemas.append({
-                'servicio': servicio,
-                'problema': 'sin_heartbeat',
-                'tiempo_sin_heartbeat': None,
-                'ultimo_heartbeat': None
-            })
-    
-    # Log de resumen del monitoreo
+    # Resumen del monitoreo (las alertas ya se emitieron solo en las transiciones)
     if servicios_con_problemas:
-        logger.warning(f"🚨 Monitoreo completado: {len(servicios_con_problemas)} servicios con problemas de {len(SERVICIOS_MONITOREADOS)} totales")
+        logger.info(f"🚨 Monitoreo completado: {len(servicios_con_problemas)} servicios con problemas de {len(servicios_propios)} totales: {servicios_con_problemas}")
     else:
-        logger.info(f"✅ Monitoreo completado: Todos los servicios ({len(SERVICIOS_MONITOREADOS)}) funcionando correctamente")
+        logger.debug(f"✅ Monitoreo completado: Todos los servicios ({len(servicios_propios)}) funcionando correctamente")
+    
+    membresia.publicar_estado(estados_locales(ahora, servicios_propios))
+    vista.publicar_resumen()
 
 
-scheduler = BackgroundScheduler()
+# El monitoreo corre en un único proceso aunque gunicorn levante varios workers
+scheduler = PlanificadorUnico('monitor')
 scheduler.add_job(monitor, 'interval', seconds=SCHEDULER_INTERVAL_SECONDS, id='monitor_job')
-scheduler.start()
+scheduler.add_job(evaluar_alertas, 'interval', seconds=ALERTAS_EVALUACION_SECONDS, id='evaluar_alertas_job')
+
+
+def create_app():
+    """
+    Crea la aplicación Flask sin efectos secundarios; los hilos se arrancan en iniciar_servicio().
+    """
+    app = Flask(__name__)
+    perfilado.instalar(app)
+    app.register_blueprint(bp)
+    return app
+
+
+def iniciar_servicio():
+    """
+    Hook de arranque de cada proceso (post_worker_init en gunicorn).
+    """
+    notificador.iniciar()
+    scheduler.iniciar()
 
-logger.info("="*50)
-logger.info("🚀 MONITOR DE SERVICIOS INICIADO")
-logger.info(f"📁 Directorio de logs: {LOGS_DIR}")
-logger.info(f"⏱️  Intervalo de monitoreo: {SCHEDULER_INTERVAL_SECONDS} segundos")
-logger.info(f"🎯 Servicios monitoreados: {', '.join(SERVICIOS_MONITOREADOS)}")
-logger.info(f"🌐 Servidor Flask iniciando en puerto 5000")
-logger.info("="*50)
+    logger.info("="*50)
+    logger.info("🚀 MONITOR DE SERVICIOS INICIADO")
+    logger.info(f"📁 Directorio de logs: {LOGS_DIR}")
+    logger.info(f"⏱️  Intervalo de monitoreo: {SCHEDULER_INTERVAL_SECONDS} segundos (alertas cada {ALERTAS_EVALUACION_SECONDS}s)")
+    logger.info(f"🎯 Servicios monitoreados: {', '.join(SERVICIOS_MONITOREADOS)}")
+    logger.info(f"🧩 Shard: {membresia.shard_id} ({membresia.url})")
+    logger.info(f"🌐 Servidor Flask iniciando en puerto 5000")
+    logger.info("="*50)
+
+
+def detener_servicio():
+    """
+    Hook de apagado de cada proceso (worker_exit en gunicorn).
+    """
+    logger.info("👋 Cerrando monitor de servicios...")
+    scheduler.detener()
 
 
 if __name__ == '__main__':
+    # Solo para desarrollo local (python main.py); en producción se usa gunicorn.conf.py
+    app = create_app()
+    iniciar_servicio()
     try:
         app.run(host='0.0.0.0', port=5000)
-    except KeyboardInterrupt:
-        logger.info("👋 Cerrando monitor de servicios...")
-        scheduler.shutdown()
     except Exception as e:
         logger.error(f"💥 Error fatal en la aplicación: {e}")
-        scheduler.shutdown()
         raise
+    finally:
+        detener_servicio()
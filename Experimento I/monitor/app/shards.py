@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+import time
+
+import redis
+
+from anillo import AnilloConsistente, CLAVE_SHARDS, CLAVE_SHARDS_URLS, CLAVE_ESTADO
+
+logger = logging.getLogger('monitor.shards')
+
+MONITOR_SHARD_ID = os.environ.get('MONITOR_SHARD_ID', 'monitor-1')
+MONITOR_URL = os.environ.get('MONITOR_URL', 'http://monitor:5000')
+# Un shard que no renueva su registro en este tiempo deja de ser miembro
+SHARD_TTL_SECONDS = int(os.environ.get('SHARD_TTL_SECONDS', 10))
+
+
+class MembresiaShards:
+    """
+    Membresía de los shards del monitor en Redis y rango de servicios propio.
+
+    Cada shard renueva periódicamente su registro; con los miembros vivos se
+    arma el anillo consistente y se decide qué `servicio_origen` le pertenece.
+    Al cambiar la membresía, el estado de los servicios cedidos queda
+    publicado en Redis y los servicios ganados se cargan desde ahí (handoff).
+    Sin Redis el shard se comporta como monitor único y es dueño de todo.
+    """
+
+    def __init__(self, redis_conn, shard_id=MONITOR_SHARD_ID, url=MONITOR_URL):
+        self.redis = redis_conn
+        self.shard_id = shard_id
+        self.url = url
+        self.anillo = AnilloConsistente([shard_id])
+        self.disponible = False
+
+    def es_propio(self, servicio):
+        return self.anillo.nodo(servicio) == self.shard_id
+
+    def sincronizar(self, servicios):
+        """
+        Renueva el registro del shard y recalcula el anillo.
+        Retorna (ganados, perdidos): servicios que cambiaron de dueño hacia/desde este shard.
+        """
+        ahora = time.time()
+        try:
+            pipe = self.redis.pipeline()
+            pipe.zadd(CLAVE_SHARDS, {self.shard_id: ahora})
+            pipe.hset(CLAVE_SHARDS_URLS, self.shard_id, self.url)
+            pipe.zremrangebyscore(CLAVE_SHARDS, '-inf', ahora - SHARD_TTL_SECONDS)
+            pipe.zrange(CLAVE_SHARDS, 0, -1)
+            miembros = [m.decode() for m in pipe.execute()[-1]]
+            self.disponible = True
+        except redis.RedisError as e:
+            if self.disponible:
+                logger.error(f"Redis no disponible, el shard '{self.shard_id}' asume todos los servicios: {e}")
+            self.disponible = False
+            miembros = [self.shard_id]
+
+        if miembros == self.anillo.nodos:
+            return [], []
+        anterior = self.anillo
+        self.anillo = AnilloConsistente(miembros)
+        ganados = [s for s in servicios if self.es_propio(s) and anterior.nodo(s) != self.shard_id]
+        perdidos = [s for s in servicios if not self.es_propio(s) and anterior.nodo(s) == self.shard_id]
+        logger.info(f"Membresía de shards: {miembros} | ganados: {ganados} | cedidos: {perdidos}")
+        return ganados, perdidos
+
+    def publicar_estado(self, estados):
+        """Publica el último estado conocido de los servicios propios (para handoff y vista global)"""
+        if not estados or not self.disponible:
+            return
+        try:
+            self.redis.hset(CLAVE_ESTADO, mapping={s: json.dumps(e) for s, e in estados.items()})
+        except redis.RedisError as e:
+            logger.error(f"No se pudo publicar el estado del shard '{self.shard_id}': {e}")
+
+    def cargar_estado(self, servicios):
+        """Lee de Redis el último estado publicado de los servicios dados"""
+        if not servicios or not self.disponible:
+            return {}
+        try:
+            valores = self.redis.hmget(CLAVE_ESTADO, servicios)
+        except redis.RedisError as e:
+            logger.error(f"No se pudo cargar el estado de {servicios}: {e}")
+            return {}
+        return {s: json.loads(v) for s, v in zip(servicios, valores) if v}
+
+    def estado_global(self):
+        """Vista combinada del estado publicado por todos los shards"""
+        crudo = self.redis.hgetall(CLAVE_ESTADO)
+        return {k.decode(): json.loads(v) for k, v in crudo.items()}
+
+    def miembros(self):
+        return self.anillo.nodos
@@ -0,0 +1,163 @@
+"""
+Vista precalculada del estado de los servicios y difusión por Server-Sent Events.
+
+La vista se actualiza incrementalmente con cada heartbeat y cada transición
+de alerta; `/estado` sirve el snapshot ya serializado (se regenera solo si
+cambió la versión). Los eventos de la transmisión se serializan una sola vez
+y se guardan en un buffer circular compartido: cada suscriptor solo mantiene
+su cursor, así que muchos observadores cuestan casi lo mismo que uno. Un
+suscriptor que se queda atrás más allá del buffer recibe un snapshot completo.
+
+Cada suscriptor ocupa un hilo de gunicorn mientras dura la transmisión, así
+que se admiten como máximo `max_suscriptores` (menos que los hilos del
+worker): los demás reciben 503 y los heartbeats siempre tienen hilos libres.
+"""
+import json
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+VISTA_CAPACIDAD_EVENTOS = 1024
+VISTA_VENTANA_LATENCIAS = 100
+VISTA_KEEPALIVE_SECONDS = 15
+VISTA_MAX_SUSCRIPTORES = 24
+
+
+class VistaEstado:
+
+    def __init__(self, servicios, capacidad_eventos=VISTA_CAPACIDAD_EVENTOS, ventana_latencias=VISTA_VENTANA_LATENCIAS,
+                 max_suscriptores=VISTA_MAX_SUSCRIPTORES):
+        self._cond = threading.Condition()
+        self.ventana_latencias = ventana_latencias
+        self.servicios = {s: self._entrada_vacia() for s in servicios}
+        self.latencias = {s: deque(maxlen=ventana_latencias) for s in servicios}
+        self.version = 0
+        self._snapshot = None
+        self._snapshot_version = -1
+        self.eventos = deque(maxlen=capacidad_eventos)
+        self.secuencia = 0
+        self.suscriptores = 0
+        self.max_suscriptores = max_suscriptores
+        self.rechazados = 0
+
+    @staticmethod
+    def _entrada_vacia():
+        return {"alerta": "UP", "ultimo_heartbeat": None, "latencia_segundos": None, "heartbeats": 0, "intervalo": None}
+
+    def _entrada(self, servicio):
+        if servicio not in self.servicios:
+            self.servicios[servicio] = self._entrada_vacia()
+            self.latencias[servicio] = deque(maxlen=self.ventana_latencias)
+        return self.servicios[servicio]
+
+    def registrar_heartbeat(self, servicio, recibido, latencia, intervalo=None):
+        with self._cond:
+            entrada = self._entrada(servicio)
+            entrada["ultimo_heartbeat"] = recibido.isoformat()
+            entrada["latencia_segundos"] = latencia
+            entrada["heartbeats"] += 1
+            entrada["intervalo"] = intervalo
+            self.latencias[servicio].append(latencia)
+            self.version += 1
+
+    def registrar_transicion(self, transicion):
+        with self._cond:
+            self._entrada(transicion["servicio"])["alerta"] = transicion["estado"]
+            self.version += 1
+            self._publicar("transicion", transicion)
+
+    def olvidar(self, servicio):
+        """El servicio pasó a otro shard: deja de aparecer en la vista local"""
+        with self._cond:
+            if self.servicios.pop(servicio, None) is not None:
+                self.latencias.pop(servicio, None)
+                self.version += 1
+
+    def publicar_resumen(self):
+        """Difunde el resumen de latencias de la ventana reciente de cada servicio"""
+        with self._cond:
+            self._publicar("resumen", {
+                "fecha": datetime.now(timezone.utc).isoformat(),
+                "servicios": {s: self._resumen_latencias(s) for s in self.servicios},
+            })
+
+    def _resumen_latencias(self, servicio):
+        muestras = self.latencias.get(servicio)
+        if not muestras:
+            return {"muestras": 0}
+        valores = sorted(muestras)
+        n = len(valores)
+        return {"muestras": n, "p50": valores[(n - 1) // 2], "p95": valores[int(0.95 * (n - 1))], "max": valores[-1]}
+
+    def _publicar(self, tipo, datos):
+        # Se llama con el lock tomado; el evento se serializa una sola vez para todos
+        self.secuencia += 1
+        cuerpo = f"id: {self.secuencia}\nevent: {tipo}\ndata: {json.dumps(datos)}\n\n".encode()
+        self.eventos.append((self.secuencia, cuerpo))
+        self._cond.notify_all()
+
+    def _snapshot_actual(self):
+        if self._snapshot_version != self.version:
+            estado = {
+                "servicios": {
+                    s: {**entrada, "latencias": self._resumen_latencias(s)}
+                    for s, entrada in self.servicios.items()
+                },
+                "version": self.version,
+                "generado": datetime.now(timezone.utc).isoformat(),
+            }
+            self._snapshot = json.dumps(estado).encode()
+            self._snapshot_version = self.version
+        return self._snapshot
+
+    def snapshot(self):
+        """JSON (bytes) del estado actual, regenerado solo si hubo cambios"""
+        with self._cond:
+            return self._snapshot_actual()
+
+    def suscribir(self, ultimo_id=None):
+        """
+        Reserva un cupo de suscriptor y retorna el generador de bytes SSE, o
+        None si no hay cupo. Quien suscribe debe llamar a `desuscribir` al
+        cerrar la respuesta, aunque el generador no llegue a iterarse. Si
+        `ultimo_id` (Last-Event-ID) sigue en el buffer se reanuda desde ahí;
+        si no, se empieza con un snapshot completo.
+        """
+        with self._cond:
+            if self.suscriptores >= self.max_suscriptores:
+                self.rechazados += 1
+                return None
+            self.suscriptores += 1
+            primero = self.eventos[0][0] if self.eventos else self.secuencia + 1
+            if ultimo_id is not None and primero - 1 <= ultimo_id <= self.secuencia:
+                cursor, inicial = ultimo_id, None
+            else:
+                cursor, inicial = self.secuencia, self._evento_snapshot()
+        return self._transmitir(cursor, inicial)
+
+    def desuscribir(self):
+        with self._cond:
+            self.suscriptores -= 1
+
+    def _transmitir(self, cursor, inicial):
+        if inicial:
+            yield inicial
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self.secuencia > cursor, timeout=VISTA_KEEPALIVE_SECONDS):
+                    pendientes = None
+                elif self.eventos[0][0] > cursor + 1:
+                    # Se perdieron eventos que salieron del buffer: resincronizar
+                    pendientes = [self._evento_snapshot()]
+                    cursor = self.secuencia
+                else:
+                    pendientes = [cuerpo for secuencia, cuerpo in self.eventos if secuencia > cursor]
+                    cursor = self.secuencia
+            # La escritura al cliente ocurre fuera del lock
+            if pendientes is None:
+                yield b": keepalive\n\n"
+            else:
+                yield from pendientes
+
+    def _evento_snapshot(self):
+        return b"event: estado\ndata: " + self._snapshot_actual() + b"\n\n"
@@ -28,4 +28,65 @@ INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('Daniela Herrera', tr
 INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('Alejandro Moreno', true, 'CO');
 INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('Gabriela Silva', true, 'UY');
 INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('David Rojas', true, 'CO');
-INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('Natalia Vega', true, 'MX');
\ No newline at end of file
+INSERT INTO usuarios (nombre, acceso, pais_origen) VALUES ('Natalia Vega', true, 'MX');
+
+-- ==============================================
+-- AUDITORÍA DE EVENTOS DE SEGURIDAD
+-- ==============================================
+-- Tabla particionada por día (UTC). Las filas se cargan en lote con COPY
+-- desde el módulo de seguridad y las particiones viejas se eliminan con
+-- purgar_particiones_eventos().
+CREATE TABLE eventos_seguridad (
+    id_evento VARCHAR(64),
+    id_usuario INTEGER,
+    pais_consulta VARCHAR(255),
+    pais_origen VARCHAR(255),
+    decision VARCHAR(32) NOT NULL,
+    latencia_segundos DOUBLE PRECISION,
+    timestamp_origen TIMESTAMPTZ,
+    recibido_en TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (recibido_en);
+
+CREATE INDEX idx_eventos_seguridad_usuario ON eventos_seguridad (id_usuario, recibido_en);
+CREATE INDEX idx_eventos_seguridad_pais ON eventos_seguridad (pais_consulta, recibido_en);
+
+-- Crea (si no existe) la partición diaria eventos_seguridad_YYYYMMDD
+CREATE OR REPLACE FUNCTION crear_particion_eventos(dia DATE) RETURNS VOID AS $$
+DECLARE
+    nombre TEXT := 'eventos_seguridad_' || to_char(dia, 'YYYYMMDD');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF eventos_seguridad FOR VALUES FROM (%L) TO (%L)',
+        nombre,
+        dia::timestamp AT TIME ZONE 'UTC',
+        (dia + 1)::timestamp AT TIME ZONE 'UTC'
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Elimina las particiones con fecha anterior a (hoy - dias_retencion)
+CREATE OR REPLACE FUNCTION purgar_particiones_eventos(dias_retencion INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    particion RECORD;
+    limite DATE := (now() AT TIME ZONE 'UTC')::date - dias_retencion;
+    eliminadas INTEGER := 0;
+BEGIN
+    FOR particion IN
+        SELECT hija.relname
+        FROM pg_inherits herencia
+        JOIN pg_class hija ON hija.oid = herencia.inhrelid
+        JOIN pg_class padre ON padre.oid = herencia.inhparent
+        WHERE padre.relname = 'eventos_seguridad'
+    LOOP
+        IF to_date(substring(particion.relname FROM '\d{8}$'), 'YYYYMMDD') < limite THEN
+            EXECUTE format('DROP TABLE IF EXISTS %I', particion.relname);
+            eliminadas := eliminadas + 1;
+        END IF;
+    END LOOP;
+    RETURN eliminadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Particiones iniciales: hoy y los próximos 7 días
+SELECT crear_particion_eventos(((now() AT TIME ZONE 'UTC')::date + dias)::date)
+FROM generate_series(0, 7) AS dias;
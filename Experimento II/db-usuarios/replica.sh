@@ -0,0 +1,17 @@
+#!/bin/bash
+# Réplica de lectura: clona el primario con pg_basebackup (solo la primera vez) y arranca en hot standby.
+# -R deja standby.signal y primary_conninfo, así que los reinicios retoman el streaming.
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    mkdir -p "$PGDATA"
+    chown postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    until gosu postgres pg_basebackup -h "$PRIMARIO_HOST" -p "${PRIMARIO_PORT:-5432}" -U "$REPLICACION_USER" -D "$PGDATA" -R -X stream; do
+        echo "Esperando al primario ${PRIMARIO_HOST}..."
+        rm -rf "${PGDATA:?}"/*
+        sleep 2
+    done
+fi
+
+exec gosu postgres postgres -c hot_standby=on
@@ -0,0 +1,9 @@
+#!/bin/bash
+# Primario: rol de replicación y regla de pg_hba para que db_usuarios_replica haga streaming
+set -e
+
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-EOSQL
+    CREATE ROLE ${REPLICACION_USER} WITH REPLICATION LOGIN PASSWORD '${REPLICACION_PASSWORD}';
+EOSQL
+
+echo "host replication ${REPLICACION_USER} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,281 @@
+"""
+Generador de carga configurable para el servicio de logística.
+
+Perfiles de tasa (eventos/segundo):
+    constante  -> tasa fija, llegadas equiespaciadas
+    poisson    -> tasa fija, llegadas de Poisson (intervalos exponenciales)
+    rafagas    -> tasa base con ráfagas a tasa_pico de duracion_rafaga cada periodo_rafaga
+    rampa      -> tasa lineal de tasa a tasa_final durante duracion_rampa
+    reproducir -> reproduce una traza grabada con su temporización original
+
+Los usuarios se eligen con una distribución Zipf sobre `usuarios` ids y el
+país consultado difiere del país de origen con probabilidad `ratio_desajuste`.
+Los eventos vencidos se encolan en lote con enqueue_many (un solo pipeline
+de Redis, cada evento en la partición de su id_usuario), y opcionalmente se
+graban en un archivo JSONL.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from itertools import accumulate
+from typing import Optional, Dict, Any, List, Tuple
+from zoneinfo import ZoneInfo
+
+from rq import Queue
+
+from particiones import ColaParticionada
+from perfilado import span
+
+PERFILES = ('constante', 'poisson', 'rafagas', 'rampa', 'reproducir')
+
+PAISES = ['CO', 'MX', 'PE', 'VE', 'BR', 'AR', 'CL', 'UY']
+
+# País de origen de los usuarios sembrados en db-usuarios/init.sql (id 1..23)
+PAISES_ORIGEN_SEMILLA = [
+    'CO', 'MX', 'CO', 'CO', 'MX', 'CO', 'MX', 'CO', 'AR', 'CO', 'MX', 'CO',
+    'PE', 'CO', 'MX', 'CO', 'CL', 'CO', 'MX', 'CO', 'UY', 'CO', 'MX',
+]
+
+COLOMBIA_TZ = ZoneInfo("America/Bogota")
+
+# Máximo de eventos por pipeline; acota la latencia de un lote cuando el generador va atrasado
+MAX_LOTE = 500
+
+
+def configuracion_desde_entorno() -> Dict[str, Any]:
+    """Lee la configuración del generador desde variables de entorno"""
+    return {
+        'perfil': os.environ.get('CARGA_PERFIL', ''),
+        'tasa': float(os.environ.get('CARGA_TASA', 10)),
+        'tasa_pico': float(os.environ.get('CARGA_TASA_PICO', 100)),
+        'duracion_rafaga': float(os.environ.get('CARGA_DURACION_RAFAGA', 5)),
+        'periodo_rafaga': float(os.environ.get('CARGA_PERIODO_RAFAGA', 30)),
+        'tasa_final': float(os.environ.get('CARGA_TASA_FINAL', 100)),
+        'duracion_rampa': float(os.environ.get('CARGA_DURACION_RAMPA', 60)),
+        'duracion': float(os.environ.get('CARGA_DURACION', 0)),
+        'usuarios': int(os.environ.get('CARGA_USUARIOS', 20)),
+        'zipf_s': float(os.environ.get('CARGA_ZIPF_S', 1.1)),
+        'ratio_desajuste': float(os.environ.get('CARGA_RATIO_DESAJUSTE', 0.3)),
+        'semilla': os.environ.get('CARGA_SEMILLA'),
+        'grabar': os.environ.get('CARGA_GRABAR_ARCHIVO', ''),
+        'archivo': os.environ.get('CARGA_REPRODUCIR_ARCHIVO', ''),
+        'velocidad': float(os.environ.get('CARGA_VELOCIDAD_REPRODUCCION', 1.0)),
+    }
+
+
+# Campos numéricos de las opciones: todos deben ser números finitos no negativos
+CAMPOS_REALES = ('tasa', 'tasa_pico', 'duracion_rafaga', 'periodo_rafaga', 'tasa_final',
+                 'duracion_rampa', 'duracion', 'zipf_s', 'ratio_desajuste', 'velocidad')
+
+
+def validar_opciones(opciones: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Valida y normaliza las opciones del generador (las del entorno con los
+    campos del body de /carga/iniciar encima). Retorna una copia con los
+    tipos ya convertidos o lanza ValueError con el primer problema.
+    """
+    desconocidos = set(opciones) - set(configuracion_desde_entorno())
+    if desconocidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(sorted(desconocidos))}")
+    validas = dict(opciones)
+    if validas['perfil'] not in PERFILES:
+        raise ValueError(f"Perfil inválido '{validas['perfil']}'. Opciones: {', '.join(PERFILES)}")
+    for campo in CAMPOS_REALES:
+        valor = validas[campo]
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not math.isfinite(valor) or valor < 0:
+            raise ValueError(f"'{campo}' debe ser un número no negativo, se recibió {valor!r}")
+        validas[campo] = float(valor)
+    usuarios = validas['usuarios']
+    if isinstance(usuarios, bool) or not isinstance(usuarios, int) or usuarios < 1:
+        raise ValueError(f"'usuarios' debe ser un entero positivo, se recibió {usuarios!r}")
+    if validas['ratio_desajuste'] > 1:
+        raise ValueError("'ratio_desajuste' debe estar entre 0 y 1")
+    if validas['perfil'] == 'rafagas' and validas['periodo_rafaga'] == 0:
+        raise ValueError("El perfil 'rafagas' requiere 'periodo_rafaga' mayor que 0")
+    if validas['velocidad'] == 0:
+        raise ValueError("'velocidad' debe ser mayor que 0")
+    semilla = validas['semilla']
+    if semilla in (None, ''):
+        validas['semilla'] = None
+    elif isinstance(semilla, bool) or not (isinstance(semilla, int) or (isinstance(semilla, str) and semilla.lstrip('-').isdigit())):
+        raise ValueError(f"'semilla' debe ser un entero, se recibió {semilla!r}")
+    else:
+        validas['semilla'] = int(semilla)
+    for campo in ('grabar', 'archivo'):
+        if not isinstance(validas[campo], str):
+            raise ValueError(f"'{campo}' debe ser una ruta, se recibió {validas[campo]!r}")
+    if validas['perfil'] == 'reproducir' and not os.path.isfile(validas['archivo']):
+        raise ValueError(f"El perfil 'reproducir' requiere un 'archivo' existente, se recibió {validas['archivo']!r}")
+    if validas['grabar'] and not os.path.isdir(os.path.dirname(os.path.abspath(validas['grabar']))):
+        raise ValueError(f"No existe el directorio de 'grabar': {validas['grabar']!r}")
+    return validas
+
+
+def pais_origen(id_usuario: int) -> str:
+    if 1 <= id_usuario <= len(PAISES_ORIGEN_SEMILLA):
+        return PAISES_ORIGEN_SEMILLA[id_usuario - 1]
+    return PAISES[id_usuario % len(PAISES)]
+
+
+class PoblacionZipf:
+    """Muestreo de (id_usuario, pais_consulta) con popularidad Zipf y ratio de desajuste"""
+
+    def __init__(self, usuarios: int, s: float, ratio_desajuste: float, rng: random.Random):
+        self.rng = rng
+        self.ratio_desajuste = ratio_desajuste
+        self._acumulados = list(accumulate(1.0 / (k ** s) for k in range(1, usuarios + 1)))
+        # Permutación fija para que el usuario más popular no sea siempre el id 1
+        self._ids = list(range(1, usuarios + 1))
+        self.rng.shuffle(self._ids)
+
+    def muestrear(self) -> Tuple[int, str]:
+        indice = bisect.bisect_left(self._acumulados, self.rng.random() * self._acumulados[-1])
+        id_usuario = self._ids[indice]
+        origen = pais_origen(id_usuario)
+        if self.rng.random() < self.ratio_desajuste:
+            return id_usuario, self.rng.choice([p for p in PAISES if p != origen])
+        return id_usuario, origen
+
+
+def construir_evento(id_usuario: int, pais_consulta: str) -> Dict[str, Any]:
+    return {
+        "id": str(uuid.uuid4()),
+        "timestamp": datetime.now(COLOMBIA_TZ).isoformat(),
+        "id_usuario": id_usuario,
+        "pais_consulta": pais_consulta,
+        "servicio_origen": "logistica"
+    }
+
+
+class GeneradorCarga:
+    """Hilo que genera eventos según un perfil y los encola en lotes"""
+
+    def __init__(self, cola: ColaParticionada, opciones: Dict[str, Any]):
+        opciones = validar_opciones(opciones)
+        self.cola = cola
+        self.opciones = opciones
+        self.rng = random.Random(opciones['semilla'])
+        self.poblacion = PoblacionZipf(opciones['usuarios'], opciones['zipf_s'], opciones['ratio_desajuste'], self.rng)
+        self.encolados = 0
+        self.errores = 0
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._grabacion = None
+
+    # --- Perfiles de tasa ---
+
+    def tasa_en(self, t: float) -> float:
+        o = self.opciones
+        perfil = o['perfil']
+        if perfil == 'rafagas':
+            return o['tasa_pico'] if (t % o['periodo_rafaga']) < o['duracion_rafaga'] else o['tasa']
+        if perfil == 'rampa':
+            avance = min(1.0, t / o['duracion_rampa']) if o['duracion_rampa'] > 0 else 1.0
+            return o['tasa'] + (o['tasa_final'] - o['tasa']) * avance
+        return o['tasa']
+
+    def siguiente_intervalo(self, t: float) -> float:
+        tasa = max(self.tasa_en(t), 1e-6)
+        if self.opciones['perfil'] == 'poisson':
+            return self.rng.expovariate(tasa)
+        return 1.0 / tasa
+
+    def _eventos_generados(self):
+        """Genera (offset, id_usuario, pais) indefinidamente"""
+        t = 0.0
+        while True:
+            id_usuario, pais = self.poblacion.muestrear()
+            yield t, id_usuario, pais
+            t += self.siguiente_intervalo(t)
+
+    def _eventos_reproducidos(self):
+        """Lee (offset, id_usuario, pais) de una traza grabada, escalando por la velocidad"""
+        velocidad = self.opciones.get('velocidad') or 1.0
+        with open(self.opciones['archivo'], 'r') as archivo:
+            for linea in archivo:
+                if not linea.strip():
+                    continue
+                registro = json.loads(linea)
+                yield registro['t'] / velocidad, registro['id_usuario'], registro['pais_consulta']
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        if self.opciones.get('grabar'):
+            self._grabacion = open(self.opciones['grabar'], 'a', buffering=1024 * 1024)
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='generador-carga', daemon=True)
+        self._hilo.start()
+        logging.info(f"Generador de carga iniciado: {self.opciones}")
+
+    def detener(self, timeout: float = 5.0):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def activo(self) -> bool:
+        return bool(self._hilo and self._hilo.is_alive())
+
+    def _bucle(self):
+        fuente = self._eventos_reproducidos() if self.opciones['perfil'] == 'reproducir' else self._eventos_generados()
+        duracion = self.opciones.get('duracion') or 0
+        inicio = time.monotonic()
+        ultimo_reporte = inicio
+        pendiente = next(fuente, None)
+        try:
+            while pendiente is not None and not self._detener.is_set():
+                ahora = time.monotonic() - inicio
+                if duracion and ahora >= duracion:
+                    break
+                lote: List[Tuple[float, int, str]] = []
+                while pendiente is not None and pendiente[0] <= ahora and len(lote) < MAX_LOTE:
+                    lote.append(pendiente)
+                    pendiente = next(fuente, None)
+                if lote:
+                    self._encolar_lote(lote)
+                elif pendiente is not None:
+                    self._detener.wait(min(pendiente[0] - ahora, 0.05))
+                if time.monotonic() - ultimo_reporte >= 5:
+                    ultimo_reporte = time.monotonic()
+                    logging.info(f"Carga '{self.opciones['perfil']}': {self.encolados} eventos encolados, {self.errores} errores, t={ahora:.1f}s")
+        finally:
+            if self._grabacion:
+                self._grabacion.close()
+                self._grabacion = None
+            logging.info(f"Generador de carga finalizado: {self.encolados} eventos encolados, {self.errores} errores")
+
+    def _encolar_lote(self, lote: List[Tuple[float, int, str]]):
+        trabajos = [
+            Queue.prepare_data('tasks.evento_ping', args=(construir_evento(id_usuario, pais),))
+            for _, id_usuario, pais in lote
+        ]
+        try:
+            with span('enqueue'):
+                self.cola.enqueue_many(trabajos)
+            self.encolados += len(trabajos)
+        except Exception as e:
+            self.errores += len(trabajos)
+            logging.error(f"Error encolando lote de {len(trabajos)} eventos: {e}")
+            return
+        if self._grabacion:
+            self._grabacion.write(''.join(
+                json.dumps({"t": round(t, 6), "id_usuario": id_usuario, "pais_consulta": pais}) + '\n'
+                for t, id_usuario, pais in lote
+            ))
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "activo": self.activo(),
+            "opciones": self.opciones,
+            "encolados": self.encolados,
+            "errores": self.errores,
+        }
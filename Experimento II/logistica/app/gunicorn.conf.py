@@ -0,0 +1,32 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py "main:create_app()"
+
+La app se importa una vez en el master (preload) y cada worker arranca sus
+hilos en post_worker_init; el scheduler y el generador de carga corren en
+un solo worker gracias a PlanificadorUnico.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# El generador de carga vive en el proceso líder; /carga/* de cualquier worker le
+# llega por el archivo de control de PlanificadorUnico, así que sirven todos los núcleos
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 10))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+preload_app = True
+
+
+def post_worker_init(worker):
+    import main
+    main.iniciar_servicio()
+
+
+def worker_exit(server, worker):
+    import main
+    main.detener_servicio()
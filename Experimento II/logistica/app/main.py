@@ -1,24 +1,33 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Blueprint, jsonify, request
 import uuid
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import os
 import redis
-from rq import Queue
-from apscheduler.schedulers.background import BackgroundScheduler
 import logging
 import random
+from carga import GeneradorCarga, configuracion_desde_entorno, validar_opciones
+from planificador import PlanificadorUnico
+from particiones import ColaParticionada
+from buzon import BuzonSalida
+import perfilado
+from perfilado import span
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
+bp = Blueprint('logistica', __name__)
 
 # Redis and RQ setup
 redis_host = os.environ.get('REDIS_HOST', 'redis')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
-redis_conn = redis.Redis(host=redis_host, port=redis_port)
-q = Queue(connection=redis_conn)
+redis_timeout = float(os.environ.get('REDIS_TIMEOUT_SECONDS', 2))
+redis_conn = redis.Redis(host=redis_host, port=redis_port, socket_timeout=redis_timeout, socket_connect_timeout=redis_timeout)
+# Los eventos de seguridad van al carril de mayor prioridad del broker, particionado por id_usuario
+q = ColaParticionada('eventos', redis_conn)
+
+# El scheduler deja los mensajes en el buzón y un hilo aparte los envía a Redis
+buzon = BuzonSalida(q, 'logistica')
 
 # Scheduler interval configuration
 SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_INTERVAL_SECONDS', 3))
@@ -29,38 +38,149 @@ def encolar_tarea():
     """
     Encola una tarea en Redis.
     """
-    with app.app_context():
-        pedido_id = str(uuid.uuid4())
-        colombia_tz = ZoneInfo("America/Bogota")
-        now_colombia = datetime.now(colombia_tz)
-        timestamp = now_colombia.isoformat()
-        id_usuario = random.randint(1, 20)
-        pais_consulta = random.choice(PAISES)
-
-        task_payload = {
-            "id": pedido_id,
-            "timestamp": timestamp,
-            "id_usuario": id_usuario,
-            "pais_consulta": pais_consulta
-        }
-
-        q.enqueue('tasks.evento_ping', task_payload)
-        
+    pedido_id = str(uuid.uuid4())
+    colombia_tz = ZoneInfo("America/Bogota")
+    now_colombia = datetime.now(colombia_tz)
+    timestamp = now_colombia.isoformat()
+    id_usuario = random.randint(1, 20)
+    pais_consulta = random.choice(PAISES)
+
+    task_payload = {
+        "id": pedido_id,
+        "timestamp": timestamp,
+        "id_usuario": id_usuario,
+        "pais_consulta": pais_consulta,
+        # El broker usa el origen de cada evento como prueba de vida del servicio
+        "servicio_origen": "logistica"
+    }
+
+    with span('enqueue'):
+        buzon.encolar('tasks.evento_ping', task_payload)
+
+    with span('logging'):
         logging.info(f"Tarea encolada: {task_payload}")
 
 
+# Generador de carga (perfiles constante/poisson/rafagas/rampa/reproducir).
+# Vive solo en el proceso líder: las rutas /carga/* de cualquier worker dejan la
+# orden en el control de PlanificadorUnico y el líder publica su estado.
+generador = None
+solicitud_carga_aplicada = None
+
+
+def iniciar_generador(opciones):
+    """
+    Reemplaza el generador activo por uno nuevo con las opciones dadas.
+    """
+    global generador
+    nuevo = GeneradorCarga(q, opciones)
+    if generador:
+        generador.detener()
+    generador = nuevo
+    generador.iniciar()
+    return generador
+
+
+def aplicar_control_carga(control):
+    """
+    En el líder: aplica la última orden de /carga/iniciar o /carga/detener.
+    """
+    global solicitud_carga_aplicada
+    solicitud = control.get('carga')
+    if not solicitud or solicitud['id'] == solicitud_carga_aplicada:
+        return
+    solicitud_carga_aplicada = solicitud['id']
+    if solicitud['accion'] == 'iniciar':
+        iniciar_generador(solicitud['opciones'])
+    elif generador:
+        generador.detener()
+    publicar_estado_carga()
+
+
+def publicar_estado_carga():
+    scheduler.publicar_estado({"carga": generador.estado() if generador else {"activo": False}})
+
+
+@bp.route('/carga', methods=['GET'])
+def estado_carga():
+    if scheduler.es_lider:
+        return jsonify(generador.estado() if generador else {"activo": False}), 200
+    return jsonify(scheduler.leer_estado().get('carga', {"activo": False})), 200
+
+
+@bp.route('/carga/iniciar', methods=['POST'])
+def iniciar_carga():
+    """
+    Inicia un perfil de carga en el proceso líder. Los campos del body reemplazan los
+    valores CARGA_* del entorno; se validan todos aquí, antes de enviar la orden.
+    """
+    data = request.get_json(silent=True)
+    if data is not None and not isinstance(data, dict):
+        return jsonify({"error": "El body debe ser un objeto JSON"}), 400
+    opciones = configuracion_desde_entorno()
+    opciones.update(data or {})
+    try:
+        opciones = validar_opciones(opciones)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    scheduler.solicitar('carga', {"id": str(uuid.uuid4()), "accion": "iniciar", "opciones": opciones})
+    return jsonify({"mensaje": f"Perfil de carga '{opciones['perfil']}' solicitado al proceso líder."}), 202
+
+
+@bp.route('/carga/detener', methods=['POST'])
+def detener_carga():
+    scheduler.solicitar('carga', {"id": str(uuid.uuid4()), "accion": "detener"})
+    return jsonify({"mensaje": "Detención del generador de carga solicitada al proceso líder."}), 202
+
+
+# El scheduler y el generador de carga corren en un único proceso aunque gunicorn levante varios workers
+scheduler = PlanificadorUnico('logistica')
+scheduler.al_ser_lider(buzon.iniciar)
+scheduler.al_aplicar_control(aplicar_control_carga)
+scheduler.en_cada_ciclo(publicar_estado_carga)
+opciones_carga = configuracion_desde_entorno()
+if opciones_carga['perfil']:
+    scheduler.al_ser_lider(lambda: iniciar_generador(opciones_carga))
+else:
+    scheduler.add_job(encolar_tarea, 'interval', seconds=SCHEDULER_INTERVAL_SECONDS, id='encolar_tarea_job')
+
+
+def create_app():
+    """
+    Crea la aplicación Flask sin efectos secundarios; los hilos se arrancan en iniciar_servicio().
+    """
+    app = Flask(__name__)
+    perfilado.instalar(app)
+    app.register_blueprint(bp)
+    return app
+
 
-# Initialize and start the component
-scheduler = BackgroundScheduler()
-scheduler.add_job(encolar_tarea, 'interval', seconds=SCHEDULER_INTERVAL_SECONDS, id='encolar_tarea_job')
-scheduler.start()
-logging.info(f"component iniciado. Encolando tareas cada {SCHEDULER_INTERVAL_SECONDS} segundos.")
+def iniciar_servicio():
+    """
+    Hook de arranque de cada proceso (post_worker_init en gunicorn).
+    """
+    scheduler.iniciar()
+    if opciones_carga['perfil']:
+        logging.info(f"component iniciado. Perfil de carga '{opciones_carga['perfil']}'.")
+    else:
+        logging.info(f"component iniciado. Encolando tareas cada {SCHEDULER_INTERVAL_SECONDS} segundos.")
+
+
+def detener_servicio():
+    """
+    Hook de apagado de cada proceso (worker_exit en gunicorn).
+    """
+    if generador:
+        generador.detener()
+    scheduler.detener()
+    buzon.detener()
 
 
 if __name__ == '__main__':
-    # This block is now only for local development (python main.py)
-    # The scheduler is already started above.
+    # Solo para desarrollo local (python main.py); en producción se usa gunicorn.conf.py
+    app = create_app()
+    iniciar_servicio()
     try:
         app.run(host='0.0.0.0', port=5000)
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown()
+    finally:
+        detener_servicio()
@@ -0,0 +1,233 @@
+"""
+Perfilado bajo demanda y tiempos por ruta y por tramo.
+
+GET /debug/profile?segundos=10&hz=100 muestrea las pilas de los hilos del
+proceso con sys._current_frames() y responde en formato "collapsed"
+(`hilo;marco;marco conteo` por línea), la entrada de flamegraph.pl,
+speedscope o inferno. Por defecto se omiten los hilos que solo esperan
+(inactivos=1 los incluye). Con varios workers de gunicorn solo cubre el que
+atiende la petición; su pid viene en X-Perfil-Pid.
+
+Los tiempos se encienden con PERFIL_TIEMPOS=1 o POST /debug/tiempos
+{"activo": true}. Apagados, el middleware y `span` solo leen un booleano;
+encendidos acumulan conteo, total, máximo y una muestra reciente (para
+percentiles) por (ruta, tramo). La duración de cada request queda en el
+tramo "total"; los tramos fuera de un request se agrupan por hilo.
+
+Las rutas /debug solo se registran si PERFIL_TOKEN está definido y exigen
+ese valor en el header X-Debug-Token.
+"""
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from flask import Blueprint, Response, g, jsonify, request
+
+PERFIL_TOKEN = os.environ.get('PERFIL_TOKEN', '')
+PERFIL_TIEMPOS = os.environ.get('PERFIL_TIEMPOS', '0') == '1'
+PERFIL_HZ = int(os.environ.get('PERFIL_HZ', 100))
+PERFIL_MAX_SECONDS = float(os.environ.get('PERFIL_MAX_SECONDS', 60))
+PERFIL_MUESTRA_TIEMPOS = int(os.environ.get('PERFIL_MUESTRA_TIEMPOS', 1024))
+
+# Hojas de pila de hilos que solo esperan trabajo (pool de gunicorn, schedulers, colas)
+MARCOS_INACTIVOS = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('selectors.py', 'select'),
+    ('queue.py', 'get'),
+    ('socket.py', 'accept'),
+    ('thread.py', '_worker'),
+}
+
+
+class _Tramo:
+    __slots__ = ('registro', 'nombre', 'inicio')
+
+    def __init__(self, registro, nombre):
+        self.registro = registro
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registro.registrar(self.registro.ruta_actual(), self.nombre, time.perf_counter() - self.inicio)
+
+
+class _TramoNulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+TRAMO_NULO = _TramoNulo()
+
+
+class RegistroTiempos:
+
+    def __init__(self, activo=PERFIL_TIEMPOS, tamano_muestra=PERFIL_MUESTRA_TIEMPOS):
+        self.activo = activo
+        self.tamano_muestra = tamano_muestra
+        self.estadisticas = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, nombre):
+        """Context manager que mide un tramo; sin costo medible si los tiempos están apagados"""
+        return _Tramo(self, nombre) if self.activo else TRAMO_NULO
+
+    def entrar_ruta(self, ruta):
+        self._local.ruta = ruta
+
+    def salir_ruta(self):
+        self._local.ruta = None
+
+    def ruta_actual(self):
+        return getattr(self._local, 'ruta', None) or f"hilo:{threading.current_thread().name}"
+
+    def registrar(self, ruta, tramo, segundos):
+        with self._lock:
+            entrada = self.estadisticas.get((ruta, tramo))
+            if entrada is None:
+                entrada = self.estadisticas[(ruta, tramo)] = {
+                    "conteo": 0, "total": 0.0, "max": 0.0, "muestra": deque(maxlen=self.tamano_muestra)
+                }
+            entrada["conteo"] += 1
+            entrada["total"] += segundos
+            entrada["max"] = max(entrada["max"], segundos)
+            entrada["muestra"].append(segundos)
+
+    def reiniciar(self):
+        with self._lock:
+            self.estadisticas = {}
+
+    def resumen(self):
+        with self._lock:
+            copia = [(clave, e["conteo"], e["total"], e["max"], sorted(e["muestra"])) for clave, e in self.estadisticas.items()]
+        rutas = {}
+        for (ruta, tramo), conteo, total, maximo, muestra in sorted(copia):
+            n = len(muestra)
+            rutas.setdefault(ruta, {})[tramo] = {
+                "conteo": conteo,
+                "total_ms": round(total * 1000, 3),
+                "promedio_ms": round(total * 1000 / conteo, 3),
+                "p50_ms": round(muestra[(n - 1) // 2] * 1000, 3),
+                "p95_ms": round(muestra[int(0.95 * (n - 1))] * 1000, 3),
+                "p99_ms": round(muestra[int(0.99 * (n - 1))] * 1000, 3),
+                "max_ms": round(maximo * 1000, 3),
+            }
+        return {"activo": self.activo, "pid": os.getpid(), "rutas": rutas}
+
+
+tiempos = RegistroTiempos()
+span = tiempos.span
+
+
+def _es_inactivo(marco):
+    codigo = marco.f_code
+    return (os.path.basename(codigo.co_filename), codigo.co_name) in MARCOS_INACTIVOS
+
+
+def _nombre_marco(codigo):
+    # ';' separa marcos en el formato collapsed
+    return f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})".replace(';', ':')
+
+
+def muestrear(segundos, hz=PERFIL_HZ, inactivos=False):
+    """Muestrea las pilas de los demás hilos; retorna un Counter de pila colapsada -> muestras"""
+    propio = threading.get_ident()
+    pilas = Counter()
+    periodo = 1.0 / hz
+    siguiente = time.monotonic()
+    fin = siguiente + segundos
+    while siguiente < fin:
+        nombres = {hilo.ident: hilo.name for hilo in threading.enumerate()}
+        for ident, marco in sys._current_frames().items():
+            if ident == propio or (not inactivos and _es_inactivo(marco)):
+                continue
+            pila = []
+            while marco is not None:
+                pila.append(_nombre_marco(marco.f_code))
+                marco = marco.f_back
+            pila.append(nombres.get(ident, f'hilo-{ident}').replace(';', ':'))
+            pilas[';'.join(reversed(pila))] += 1
+        siguiente += periodo
+        time.sleep(max(0.0, siguiente - time.monotonic()))
+    return pilas
+
+
+_perfilando = threading.Lock()
+
+bp = Blueprint('perfilado', __name__, url_prefix='/debug')
+
+
+@bp.before_request
+def verificar_token():
+    if not hmac.compare_digest(request.headers.get('X-Debug-Token', ''), PERFIL_TOKEN):
+        return jsonify({"status": "error", "mensaje": "Token de depuración inválido"}), 403
+
+
+@bp.route('/profile', methods=['GET'])
+def perfil():
+    try:
+        segundos = float(request.args.get('segundos', 10))
+        hz = int(request.args.get('hz', PERFIL_HZ))
+    except ValueError:
+        return jsonify({"status": "error", "mensaje": "'segundos' y 'hz' deben ser numéricos"}), 400
+    if not 0 < segundos <= PERFIL_MAX_SECONDS or not 0 < hz <= 1000:
+        return jsonify({"status": "error", "mensaje": f"Rango válido: 0 < segundos <= {PERFIL_MAX_SECONDS}, 0 < hz <= 1000"}), 400
+    if not _perfilando.acquire(blocking=False):
+        return jsonify({"status": "error", "mensaje": "Ya hay un perfilado en curso en este proceso"}), 409
+    try:
+        pilas = muestrear(segundos, hz, inactivos=request.args.get('inactivos') == '1')
+    finally:
+        _perfilando.release()
+    cuerpo = ''.join(f"{pila} {muestras}\n" for pila, muestras in pilas.most_common())
+    return Response(cuerpo, mimetype='text/plain', headers={'X-Perfil-Pid': str(os.getpid())})
+
+
+@bp.route('/tiempos', methods=['GET'])
+def ver_tiempos():
+    return jsonify(tiempos.resumen()), 200
+
+
+@bp.route('/tiempos', methods=['POST'])
+def configurar_tiempos():
+    data = request.get_json(silent=True) or {}
+    if data.get('reiniciar'):
+        tiempos.reiniciar()
+    if 'activo' in data:
+        tiempos.activo = bool(data['activo'])
+    return jsonify({"activo": tiempos.activo, "pid": os.getpid()}), 200
+
+
+def _inicio_request():
+    if tiempos.activo:
+        tiempos.entrar_ruta(request.endpoint or request.path)
+        g.perfil_inicio = time.perf_counter()
+
+
+def _fin_request(exc):
+    inicio = g.pop('perfil_inicio', None)
+    if inicio is not None:
+        tiempos.registrar(tiempos.ruta_actual(), 'total', time.perf_counter() - inicio)
+        tiempos.salir_ruta()
+
+
+def instalar(app):
+    """
+    Registra el middleware de tiempos por ruta y, si PERFIL_TOKEN está definido, las rutas /debug.
+    Se llama antes de registrar los demás blueprints para que "total" incluya sus hooks.
+    """
+    app.before_request(_inicio_request)
+    app.teardown_request(_fin_request)
+    if PERFIL_TOKEN:
+        app.register_blueprint(bp)
@@ -0,0 +1,173 @@
+"""
+Circuit breaker por destino de entrega (p. ej. 'seguridad').
+
+El estado vive en Redis y no en memoria porque rq ejecuta cada job en un
+proceso hijo y porque varios workers deben compartir la misma vista.
+
+    cerrado     -> se entrega normalmente; se cuentan errores y respuestas lentas
+                   en una ventana deslizante de buckets de CIRCUITO_BUCKET_SECONDS
+    abierto     -> no se intenta entregar; los mensajes se estacionan hasta que
+                   vence CIRCUITO_APERTURA_SECONDS
+    semiabierto -> un único worker (el que obtiene la sonda) hace un intento de
+                   prueba: si funciona se cierra, si falla se vuelve a abrir
+
+Uso como comando:
+    python circuito.py estado
+    python circuito.py reiniciar <destino>
+"""
+import argparse
+import json
+import os
+import time
+
+import redis
+from rq import get_current_connection
+
+CIRCUITO_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('CIRCUITO_CONNECT_TIMEOUT_SECONDS', 0.5))
+CIRCUITO_READ_TIMEOUT_SECONDS = float(os.environ.get('CIRCUITO_READ_TIMEOUT_SECONDS', 2.0))
+CIRCUITO_VENTANA_SECONDS = int(os.environ.get('CIRCUITO_VENTANA_SECONDS', 30))
+CIRCUITO_BUCKET_SECONDS = int(os.environ.get('CIRCUITO_BUCKET_SECONDS', 5))
+CIRCUITO_MIN_SOLICITUDES = int(os.environ.get('CIRCUITO_MIN_SOLICITUDES', 10))
+CIRCUITO_UMBRAL_ERRORES = float(os.environ.get('CIRCUITO_UMBRAL_ERRORES', 0.5))
+CIRCUITO_LATENCIA_LENTA_SECONDS = float(os.environ.get('CIRCUITO_LATENCIA_LENTA_SECONDS', 1.0))
+CIRCUITO_UMBRAL_LENTAS = float(os.environ.get('CIRCUITO_UMBRAL_LENTAS', 0.8))
+CIRCUITO_APERTURA_SECONDS = float(os.environ.get('CIRCUITO_APERTURA_SECONDS', 10.0))
+
+TIMEOUT = (CIRCUITO_CONNECT_TIMEOUT_SECONDS, CIRCUITO_READ_TIMEOUT_SECONDS)
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+CLAVE_DESTINOS = 'circuito:destinos'
+
+
+def _clave_estado(destino):
+    return f'circuito:{destino}'
+
+
+def _clave_bucket(destino, bucket):
+    return f'circuito:{destino}:ventana:{bucket}'
+
+
+def _clave_sonda(destino):
+    return f'circuito:{destino}:sonda'
+
+
+def _abrir(conexion, destino, motivo):
+    abierto_hasta = time.time() + CIRCUITO_APERTURA_SECONDS
+    conexion.hset(_clave_estado(destino), mapping={'estado': ABIERTO, 'abierto_hasta': abierto_hasta, 'motivo': motivo})
+    print(f"Circuito '{destino}' ABIERTO por {CIRCUITO_APERTURA_SECONDS}s: {motivo}")
+    return abierto_hasta
+
+
+def _cerrar(conexion, destino):
+    pipe = conexion.pipeline()
+    pipe.hset(_clave_estado(destino), mapping={'estado': CERRADO, 'abierto_hasta': 0, 'motivo': ''})
+    pipe.delete(_clave_sonda(destino))
+    # La ventana se reinicia para que los errores previos a la apertura no la reabran de inmediato
+    ultimo = int(time.time() // CIRCUITO_BUCKET_SECONDS)
+    cantidad = max(1, CIRCUITO_VENTANA_SECONDS // CIRCUITO_BUCKET_SECONDS)
+    pipe.delete(*[_clave_bucket(destino, bucket) for bucket in range(ultimo - cantidad, ultimo + 1)])
+    pipe.execute()
+    print(f"Circuito '{destino}' CERRADO")
+
+
+def permitir(destino, conexion=None):
+    """
+    Retorna (permitido, reintentar_en). Si el circuito está abierto, `reintentar_en`
+    es el instante (epoch) en que conviene volver a intentar.
+    """
+    conexion = conexion or get_current_connection()
+    estado = conexion.hgetall(_clave_estado(destino))
+    actual = estado.get(b'estado', CERRADO.encode()).decode()
+    if actual == CERRADO:
+        return True, None
+    abierto_hasta = float(estado.get(b'abierto_hasta', 0))
+    if actual == ABIERTO and time.time() < abierto_hasta:
+        return False, abierto_hasta
+    # Vencida la apertura: solo el worker que obtiene la sonda hace el intento de prueba
+    if conexion.set(_clave_sonda(destino), 1, nx=True, ex=int(CIRCUITO_READ_TIMEOUT_SECONDS + CIRCUITO_CONNECT_TIMEOUT_SECONDS) + 1):
+        conexion.hset(_clave_estado(destino), 'estado', SEMIABIERTO)
+        return True, None
+    return False, time.time() + CIRCUITO_READ_TIMEOUT_SECONDS
+
+
+def registrar_resultado(destino, exito, latencia, conexion=None):
+    """Registra el resultado de una entrega y aplica las transiciones del circuito"""
+    conexion = conexion or get_current_connection()
+    lenta = latencia > CIRCUITO_LATENCIA_LENTA_SECONDS
+    bucket = int(time.time() // CIRCUITO_BUCKET_SECONDS)
+    clave = _clave_bucket(destino, bucket)
+    pipe = conexion.pipeline()
+    pipe.sadd(CLAVE_DESTINOS, destino)
+    pipe.hincrby(clave, 'total', 1)
+    if not exito:
+        pipe.hincrby(clave, 'errores', 1)
+    if lenta:
+        pipe.hincrby(clave, 'lentas', 1)
+    pipe.expire(clave, CIRCUITO_VENTANA_SECONDS + CIRCUITO_BUCKET_SECONDS)
+    pipe.hget(_clave_estado(destino), 'estado')
+    actual = (pipe.execute()[-1] or CERRADO.encode()).decode()
+
+    if actual == SEMIABIERTO:
+        if exito and not lenta:
+            _cerrar(conexion, destino)
+        else:
+            _abrir(conexion, destino, 'falló el intento de prueba')
+        return
+
+    if actual == CERRADO and (not exito or lenta):
+        total, errores, lentas = estadisticas_ventana(destino, conexion)
+        if total < CIRCUITO_MIN_SOLICITUDES:
+            return
+        if errores / total >= CIRCUITO_UMBRAL_ERRORES:
+            _abrir(conexion, destino, f"tasa de errores {errores}/{total}")
+        elif lentas / total >= CIRCUITO_UMBRAL_LENTAS:
+            _abrir(conexion, destino, f"tasa de respuestas lentas {lentas}/{total}")
+
+
+def estadisticas_ventana(destino, conexion):
+    """Suma (total, errores, lentas) de los buckets de la ventana deslizante"""
+    ultimo = int(time.time() // CIRCUITO_BUCKET_SECONDS)
+    cantidad = max(1, CIRCUITO_VENTANA_SECONDS // CIRCUITO_BUCKET_SECONDS)
+    pipe = conexion.pipeline()
+    for bucket in range(ultimo - cantidad + 1, ultimo + 1):
+        pipe.hmget(_clave_bucket(destino, bucket), 'total', 'errores', 'lentas')
+    total = errores = lentas = 0
+    for valores in pipe.execute():
+        t, e, l = (int(v) if v else 0 for v in valores)
+        total += t
+        errores += e
+        lentas += l
+    return total, errores, lentas
+
+
+def estado(conexion):
+    """Estado de todos los destinos conocidos, para operadores"""
+    resultado = {}
+    for destino in sorted(d.decode() for d in conexion.smembers(CLAVE_DESTINOS)):
+        datos = {k.decode(): v.decode() for k, v in conexion.hgetall(_clave_estado(destino)).items()}
+        total, errores, lentas = estadisticas_ventana(destino, conexion)
+        resultado[destino] = {
+            "estado": datos.get('estado', CERRADO),
+            "abierto_hasta": float(datos.get('abierto_hasta') or 0),
+            "motivo": datos.get('motivo', ''),
+            "ventana": {"total": total, "errores": errores, "lentas": lentas},
+        }
+    return resultado
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estado de los circuit breakers del broker")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    subcomandos.add_parser('estado', help="Muestra el estado de cada destino")
+    reiniciar = subcomandos.add_parser('reiniciar', help="Fuerza el cierre del circuito de un destino")
+    reiniciar.add_argument('destino')
+    args = parser.parse_args()
+
+    conexion = redis.Redis(host=os.environ.get('REDIS_HOST', 'redis'), port=int(os.environ.get('REDIS_PORT', 6379)))
+    if args.comando == 'reiniciar':
+        _cerrar(conexion, args.destino)
+    else:
+        print(json.dumps(estado(conexion), indent=2))
@@ -0,0 +1,208 @@
+"""
+Política de entrega del broker: reintentos diferidos y dead-letter queue.
+
+Una entrega fallida no se reintenta dentro del worker (eso lo bloquearía):
+se agenda en un sorted set de Redis con score = instante de reintento, con
+backoff exponencial y jitter. Un hilo promotor mueve los reintentos vencidos
+a la cola de rq que les corresponde: la partición de su clave en el carril de
+su clase de mensaje. Tras ENTREGA_MAX_INTENTOS el mensaje va a la DLQ.
+
+La promoción no pierde mensajes: el script que los saca de los reintentos los
+deja en entrega:reintentos:en_curso, y salen de ahí en la misma transacción
+que los encola en rq. Si el encolado falla o el promotor muere a mitad, al
+vencer ENTREGA_PROMOCION_LEASE_SECONDS vuelven a los reintentos (a lo sumo
+se entregan dos veces; la idempotencia del broker descarta la repetición).
+
+Un mensaje con `ttl` (p. ej. un heartbeat) que ya tiene más edad que su ttl,
+según su `timestamp`, no se reintenta ni se estaciona: se descarta.
+
+Uso como comando:
+    python entrega.py reproducir-dlq [--limite N]
+    python entrega.py estado
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import redis
+from rq import Queue, get_current_connection
+
+from carriles import cola_de
+
+ENTREGA_MAX_INTENTOS = int(os.environ.get('ENTREGA_MAX_INTENTOS', 5))
+ENTREGA_BACKOFF_BASE_SECONDS = float(os.environ.get('ENTREGA_BACKOFF_BASE_SECONDS', 1.0))
+ENTREGA_BACKOFF_MAX_SECONDS = float(os.environ.get('ENTREGA_BACKOFF_MAX_SECONDS', 60.0))
+ENTREGA_PROMOTOR_INTERVAL_SECONDS = float(os.environ.get('ENTREGA_PROMOTOR_INTERVAL_SECONDS', 0.5))
+ENTREGA_PROMOCION_LEASE_SECONDS = float(os.environ.get('ENTREGA_PROMOCION_LEASE_SECONDS', 30.0))
+
+CLAVE_REINTENTOS = 'entrega:reintentos'
+CLAVE_EN_CURSO = 'entrega:reintentos:en_curso'
+CLAVE_DLQ = 'entrega:dlq'
+
+# Devuelve a los reintentos los que quedaron en curso desde antes de ARGV[3] y
+# pasa atómicamente a en curso hasta ARGV[2] reintentos con score <= ARGV[1]
+LUA_EXTRAER_VENCIDOS = """
+local abandonados = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[3], 'LIMIT', 0, ARGV[2])
+for _, registro in ipairs(abandonados) do
+    redis.call('ZADD', KEYS[1], ARGV[1], registro)
+end
+if #abandonados > 0 then
+    redis.call('ZREM', KEYS[2], unpack(abandonados))
+end
+local vencidos = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, registro in ipairs(vencidos) do
+    redis.call('ZADD', KEYS[2], ARGV[1], registro)
+end
+if #vencidos > 0 then
+    redis.call('ZREM', KEYS[1], unpack(vencidos))
+end
+return vencidos
+"""
+
+
+def calcular_espera(intento):
+    """Backoff exponencial con jitter completo: uniforme en [0, min(max, base * 2^intento)]"""
+    return random.uniform(0, min(ENTREGA_BACKOFF_MAX_SECONDS, ENTREGA_BACKOFF_BASE_SECONDS * (2 ** intento)))
+
+
+def edad(datos):
+    """Segundos desde el `timestamp` del mensaje; None si no tiene uno válido con zona horaria"""
+    try:
+        return (datetime.now(timezone.utc) - datetime.fromisoformat(datos['timestamp'])).total_seconds()
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def vencido(datos, ttl):
+    """True si el mensaje ya superó su ttl en segundos (None: no caduca)"""
+    if ttl is None:
+        return False
+    segundos = edad(datos)
+    return segundos is not None and segundos > ttl
+
+
+def programar_reintento(funcion, datos, intento, error, conexion=None, ttl=None):
+    """
+    Agenda un nuevo intento de `funcion` (p. ej. 'tasks.evento_ping') o,
+    si ya se agotaron los intentos, envía el mensaje a la dead-letter queue.
+    Un mensaje vencido según `ttl` se descarta.
+    """
+    if vencido(datos, ttl):
+        print(f"Mensaje vencido descartado sin reintentar ({edad(datos):.1f}s > {ttl}s): {datos}")
+        return None
+    conexion = conexion or get_current_connection()
+    siguiente = intento + 1
+    registro = {
+        "funcion": funcion,
+        "datos": datos,
+        "intento": siguiente,
+        "error": str(error),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+    }
+    if siguiente >= ENTREGA_MAX_INTENTOS:
+        conexion.rpush(CLAVE_DLQ, json.dumps(registro))
+        print(f"Mensaje enviado a la DLQ tras {siguiente} intentos: {datos}")
+        return None
+    espera = calcular_espera(intento)
+    conexion.zadd(CLAVE_REINTENTOS, {json.dumps(registro): time.time() + espera})
+    print(f"Reintento {siguiente}/{ENTREGA_MAX_INTENTOS - 1} agendado en {espera:.2f}s: {datos}")
+    return espera
+
+
+def estacionar(funcion, datos, intento, hasta, conexion=None, ttl=None):
+    """
+    Estaciona un mensaje que no se intentó entregar (p. ej. circuito abierto)
+    hasta el instante `hasta`, sin consumir un intento. Un mensaje que estaría
+    vencido según `ttl` al liberarse se descarta.
+    """
+    if ttl is not None and vencido(datos, ttl - max(0.0, hasta - time.time())):
+        print(f"Mensaje descartado en vez de estacionarlo: vencería antes de liberarse (ttl {ttl}s): {datos}")
+        return
+    conexion = conexion or get_current_connection()
+    registro = {
+        "funcion": funcion,
+        "datos": datos,
+        "intento": intento,
+        "error": "estacionado",
+        "fecha": datetime.now(timezone.utc).isoformat(),
+    }
+    # Jitter para que los mensajes estacionados no se liberen todos en el mismo instante
+    conexion.zadd(CLAVE_REINTENTOS, {json.dumps(registro): hasta + random.uniform(0, ENTREGA_BACKOFF_BASE_SECONDS)})
+
+
+def promover_vencidos(conexion, limite=500):
+    """Mueve a la cola de rq los reintentos vencidos; retorna cuántos movió"""
+    ahora = time.time()
+    vencidos = conexion.eval(LUA_EXTRAER_VENCIDOS, 2, CLAVE_REINTENTOS, CLAVE_EN_CURSO,
+                             ahora, limite, ahora - ENTREGA_PROMOCION_LEASE_SECONDS)
+    if not vencidos:
+        return 0
+    # Cada reintento vuelve a la partición de su clave en el carril de su clase de mensaje
+    por_cola = {}
+    for registro in map(json.loads, vencidos):
+        por_cola.setdefault(cola_de(registro['funcion'], registro['datos']), []).append(
+            Queue.prepare_data(registro['funcion'], args=(registro['datos'],), kwargs={'intento': registro['intento']})
+        )
+    # Encolado y confirmación en una sola transacción: si falla, siguen en curso hasta vencer
+    pipe = conexion.pipeline()
+    for cola, trabajos in por_cola.items():
+        Queue(cola, connection=conexion).enqueue_many(trabajos, pipeline=pipe)
+    pipe.zrem(CLAVE_EN_CURSO, *vencidos)
+    pipe.execute()
+    return len(vencidos)
+
+
+def iniciar_promotor(conexion):
+    """Arranca el hilo que promueve reintentos vencidos cada ENTREGA_PROMOTOR_INTERVAL_SECONDS"""
+    def bucle():
+        while True:
+            try:
+                while promover_vencidos(conexion):
+                    pass
+            except redis.RedisError as e:
+                print(f"Error promoviendo reintentos: {e}")
+            time.sleep(ENTREGA_PROMOTOR_INTERVAL_SECONDS)
+
+    hilo = threading.Thread(target=bucle, name='promotor-reintentos', daemon=True)
+    hilo.start()
+    return hilo
+
+
+def reproducir_dlq(conexion, limite=None):
+    """Re-encola los mensajes de la DLQ con el contador de intentos reiniciado"""
+    reproducidos = 0
+    while limite is None or reproducidos < limite:
+        crudo = conexion.lpop(CLAVE_DLQ)
+        if crudo is None:
+            break
+        registro = json.loads(crudo)
+        Queue(cola_de(registro['funcion'], registro['datos']), connection=conexion).enqueue(registro['funcion'], registro['datos'], intento=0)
+        reproducidos += 1
+    return reproducidos
+
+
+def estado(conexion):
+    return {
+        "reintentos_pendientes": conexion.zcard(CLAVE_REINTENTOS),
+        "reintentos_en_curso": conexion.zcard(CLAVE_EN_CURSO),
+        "dlq": conexion.llen(CLAVE_DLQ),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Administración de reintentos y dead-letter queue del broker")
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+    reproducir = subcomandos.add_parser('reproducir-dlq', help="Re-encola los mensajes de la DLQ")
+    reproducir.add_argument('--limite', type=int, default=None, help="Máximo de mensajes a re-encolar")
+    subcomandos.add_parser('estado', help="Muestra reintentos pendientes y tamaño de la DLQ")
+    args = parser.parse_args()
+
+    conexion = redis.Redis(host=os.environ.get('REDIS_HOST', 'redis'), port=int(os.environ.get('REDIS_PORT', 6379)))
+    if args.comando == 'reproducir-dlq':
+        print(f"Mensajes re-encolados desde la DLQ: {reproducir_dlq(conexion, args.limite)}")
+    else:
+        print(json.dumps(estado(conexion)))
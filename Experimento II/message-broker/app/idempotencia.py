@@ -0,0 +1,37 @@
+import os
+
+from rq import get_current_connection
+
+# Ventana de deduplicación por id de mensaje (SET NX con expiración en Redis)
+DEDUPE_TTL_SECONDS = int(os.environ.get('DEDUPE_TTL_SECONDS', 3600))
+# Lease mientras el mensaje se entrega; si el worker muere, expira y la re-entrega de rq puede reclamarlo
+DEDUPE_LEASE_SECONDS = int(os.environ.get('DEDUPE_LEASE_SECONDS', 30))
+PREFIJO_DEDUPE = 'dedupe:'
+
+
+def reclamar(id_mensaje, conexion=None):
+    """
+    Reclama el mensaje para entregarlo. Retorna False si ya fue entregado
+    (o lo está entregando otro worker) dentro de la ventana de deduplicación.
+    Los mensajes sin id no se deduplican.
+    """
+    if not id_mensaje:
+        return True
+    conexion = conexion or get_current_connection()
+    return bool(conexion.set(PREFIJO_DEDUPE + str(id_mensaje), 'en_proceso', nx=True, ex=DEDUPE_LEASE_SECONDS))
+
+
+def confirmar(id_mensaje, conexion=None):
+    """Marca el mensaje como entregado durante toda la ventana de deduplicación"""
+    if not id_mensaje:
+        return
+    conexion = conexion or get_current_connection()
+    conexion.set(PREFIJO_DEDUPE + str(id_mensaje), 'entregado', ex=DEDUPE_TTL_SECONDS)
+
+
+def liberar(id_mensaje, conexion=None):
+    """Libera el lease tras una entrega fallida para que un reintento pueda reclamarlo"""
+    if not id_mensaje:
+        return
+    conexion = conexion or get_current_connection()
+    conexion.delete(PREFIJO_DEDUPE + str(id_mensaje))
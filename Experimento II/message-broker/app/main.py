@@ -1,14 +1,52 @@
 import os
+import time
+from multiprocessing import Process
+
 import redis
 from rq import Worker, Queue, Connection
 
-listen = ['default']
+from entrega import iniciar_promotor
+from carriles import carriles_configurados, carriles_de_ayuda, colas_de_worker, iniciar_metricas
+from particiones import WorkerParticionado, particiones_de
 
 redis_host = os.environ.get('REDIS_HOST', 'redis')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
 
+
+def trabajar(carril):
+    """
+    Proceso worker de un carril: escucha sus colas en orden de prioridad. En un
+    carril particionado solo consume las particiones que le asigna el reparto.
+    """
+    with Connection(redis.Redis(host=redis_host, port=redis_port)):
+        if particiones_de(carril) > 1:
+            ayuda = carriles_de_ayuda(carril)
+            print(f"Worker del carril '{carril}' ({particiones_de(carril)} particiones), ayuda a {ayuda}")
+            worker = WorkerParticionado(carril, ayuda=ayuda)
+        else:
+            listen = colas_de_worker(carril)
+            print(f"Worker del carril '{carril}' escuchando {listen}")
+            worker = Worker(map(Queue, listen))
+        worker.work()
+
+
+def lanzar(carril):
+    proceso = Process(target=trabajar, args=(carril,), name=f'worker-{carril}')
+    proceso.start()
+    return proceso
+
+
 if __name__ == '__main__':
     redis_conn = redis.Redis(host=redis_host, port=redis_port)
-    with Connection(redis_conn):
-        worker = Worker(map(Queue, listen))
-        worker.work()
+    # Mueve a la cola los reintentos diferidos vencidos sin ocupar al worker
+    iniciar_promotor(redis_conn)
+    iniciar_metricas(redis_conn)
+
+    # Tantos workers por carril como su límite de concurrencia
+    procesos = [(carril, lanzar(carril)) for carril, concurrencia in carriles_configurados() for _ in range(concurrencia)]
+    while True:
+        time.sleep(1)
+        for i, (carril, proceso) in enumerate(procesos):
+            if not proceso.is_alive():
+                print(f"Worker del carril '{carril}' terminó (código {proceso.exitcode}), relanzando")
+                procesos[i] = (carril, lanzar(carril))
@@ -1,11 +1,47 @@
+import time
+
 import requests
 
-def evento_ping(datos):
+from idempotencia import reclamar, confirmar, liberar
+from entrega import programar_reintento, estacionar
+from circuito import permitir, registrar_resultado, TIMEOUT
+from vida import reportar_vida
+
+DESTINO_SEGURIDAD = 'seguridad'
+
+def evento_ping(datos, intento=0):
     """
     La única función de este worker es notificar al modulo de seguridad.
+    Si la entrega falla se agenda un reintento diferido en vez de bloquear el worker,
+    y si el circuito de seguridad está abierto el mensaje se estaciona sin intentarlo.
+    El evento también prueba que su productor está vivo (ver vida.py).
     """
+    if intento == 0:
+        reportar_vida(datos)
+    # Se reclama antes de consultar el circuito: un duplicado no debe tomar la sonda del semiabierto
+    if not reclamar(datos.get('id')):
+        print(f"Evento duplicado descartado: {datos.get('id')}")
+        return
+    permitido, reintentar_en = permitir(DESTINO_SEGURIDAD)
+    if not permitido:
+        liberar(datos.get('id'))
+        estacionar('tasks.evento_ping', datos, intento, reintentar_en)
+        print(f"Circuito de seguridad abierto, evento estacionado: {datos.get('id')}")
+        return
+    inicio = time.perf_counter()
     try:
-        requests.post("http://seguridad:5000/reportar-evento", json=datos)
+        respuesta = requests.post("http://seguridad:5000/reportar-evento", json=datos, timeout=TIMEOUT)
+        if respuesta.status_code >= 500:
+            registrar_resultado(DESTINO_SEGURIDAD, False, time.perf_counter() - inicio)
+            liberar(datos.get('id'))
+            print(f"Error del modulo de seguridad al reportar evento ({respuesta.status_code}): {datos}")
+            programar_reintento('tasks.evento_ping', datos, intento, f"HTTP {respuesta.status_code}")
+            return
+        registrar_resultado(DESTINO_SEGURIDAD, True, time.perf_counter() - inicio)
+        confirmar(datos.get('id'))
         print(f"Evento consumido y reportado al modulo de seguridad: {datos}")
     except requests.exceptions.RequestException as e:
+        registrar_resultado(DESTINO_SEGURIDAD, False, time.perf_counter() - inicio)
+        liberar(datos.get('id'))
         print(f"Error al reportar evento al modulo de seguridad: {e}")
+        programar_reintento('tasks.evento_ping', datos, intento, e)
@@ -0,0 +1,60 @@
+"""
+Pruebas de evento_ping sin Redis ni seguridad: se reemplazan las dependencias
+de tasks.py con mocks.
+
+    cd "Experimento II/message-broker" && python -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+import tasks  # noqa: E402
+
+
+class EventoPingTest(unittest.TestCase):
+
+    def setUp(self):
+        for nombre, valor in [('reportar_vida', None), ('permitir', (True, None)), ('reclamar', True)]:
+            parche = mock.patch.object(tasks, nombre, return_value=valor)
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.registrar_resultado = self._parchar('registrar_resultado')
+        self.programar_reintento = self._parchar('programar_reintento')
+        self.confirmar = self._parchar('confirmar')
+        self.liberar = self._parchar('liberar')
+
+    def _parchar(self, nombre):
+        parche = mock.patch.object(tasks, nombre)
+        self.addCleanup(parche.stop)
+        return parche.start()
+
+    def _entregar(self, status_code):
+        with mock.patch.object(tasks.requests, 'post', return_value=mock.Mock(status_code=status_code)):
+            tasks.evento_ping({"id": "e-1", "id_usuario": 999, "pais_consulta": "CO"})
+
+    def test_usuario_no_encontrado_no_se_reintenta_ni_cuenta_como_falla(self):
+        self._entregar(404)
+        self.programar_reintento.assert_not_called()
+        self.liberar.assert_not_called()
+        self.confirmar.assert_called_once_with("e-1")
+        self.assertTrue(self.registrar_resultado.call_args[0][1])
+
+    def test_error_del_servidor_se_reintenta_y_cuenta_como_falla(self):
+        self._entregar(500)
+        self.programar_reintento.assert_called_once()
+        self.liberar.assert_called_once_with("e-1")
+        self.assertFalse(self.registrar_resultado.call_args[0][1])
+
+    def test_duplicado_no_toma_la_sonda_del_circuito(self):
+        with mock.patch.object(tasks, 'reclamar', return_value=False), \
+                mock.patch.object(tasks, 'permitir') as permitir:
+            tasks.evento_ping({"id": "e-1", "id_usuario": 1, "pais_consulta": "CO"})
+        permitir.assert_not_called()
+        self.registrar_resultado.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
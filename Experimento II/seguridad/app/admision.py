@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+from typing import Dict, Any
+
+from config import get_config
+
+logger = logging.getLogger('seguridad.admision')
+
+PRIORIDAD_ALTA = 'alta'
+PRIORIDAD_NORMAL = 'normal'
+
+
+class ControlAdmision:
+    """
+    Control de admisión con límite de concurrencia adaptativo (AIMD).
+
+    Cada request completado ajusta el límite: si su latencia o la espera por
+    una conexión del pool superan el objetivo, el límite se reduce de forma
+    multiplicativa; si no, crece en 1/límite (≈ +1 por ventana). Los requests
+    normales solo usan la fracción (1 - reserva) del límite, dejando el resto
+    a los de prioridad alta.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.limite_minimo = self.config.ADMISION_LIMITE_MINIMO
+        self.limite_maximo = self.config.ADMISION_LIMITE_MAXIMO
+        self.latencia_objetivo = self.config.ADMISION_LATENCIA_OBJETIVO_MS / 1000.0
+        self.espera_pool_objetivo = self.config.ADMISION_ESPERA_POOL_OBJETIVO_MS / 1000.0
+        self.factor_reduccion = self.config.ADMISION_FACTOR_REDUCCION
+        self.reserva_prioritaria = self.config.ADMISION_RESERVA_PRIORITARIA
+        self.retry_after = self.config.ADMISION_RETRY_AFTER_SECONDS
+        self.limite = float(self.config.ADMISION_LIMITE_INICIAL)
+        self.en_vuelo = 0
+        self.rechazados = {PRIORIDAD_ALTA: 0, PRIORIDAD_NORMAL: 0}
+        self._sobrecarga_pool = False
+        self._ultima_reduccion = 0.0
+        self._lock = threading.Lock()
+
+    def intentar_admitir(self, prioridad: str = PRIORIDAD_NORMAL) -> bool:
+        """Reserva un cupo si hay capacidad para la prioridad dada"""
+        with self._lock:
+            capacidad = self.limite if prioridad == PRIORIDAD_ALTA else self.limite * (1 - self.reserva_prioritaria)
+            if self.en_vuelo >= max(1, int(capacidad)):
+                self.rechazados[prioridad] += 1
+                return False
+            self.en_vuelo += 1
+            return True
+
+    def liberar(self, latencia: float):
+        """Libera el cupo y ajusta el límite según la latencia observada"""
+        with self._lock:
+            self.en_vuelo = max(0, self.en_vuelo - 1)
+            sobrecarga = latencia > self.latencia_objetivo or self._sobrecarga_pool
+            self._sobrecarga_pool = False
+            if sobrecarga:
+                self._reducir()
+            else:
+                self.limite = min(self.limite_maximo, self.limite + 1.0 / self.limite)
+
+    def registrar_espera_pool(self, espera: float):
+        """Observador del pool de conexiones: marca sobrecarga si la espera excede el objetivo"""
+        if espera > self.espera_pool_objetivo:
+            with self._lock:
+                self._sobrecarga_pool = True
+
+    def registrar_pool_agotado(self):
+        with self._lock:
+            self._reducir()
+
+    def _reducir(self):
+        # Una sola reducción por intervalo de latencia objetivo para no colapsar el límite
+        # cuando muchos requests lentos terminan casi al mismo tiempo
+        ahora = time.monotonic()
+        if ahora - self._ultima_reduccion < self.latencia_objetivo:
+            return
+        self._ultima_reduccion = ahora
+        anterior = self.limite
+        self.limite = max(self.limite_minimo, self.limite * self.factor_reduccion)
+        logger.warning(f"Sobrecarga detectada, límite de concurrencia {anterior:.1f} -> {self.limite:.1f} (en vuelo: {self.en_vuelo})")
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "limite": round(self.limite, 2),
+            "en_vuelo": self.en_vuelo,
+            "rechazados": dict(self.rechazados),
+        }
+
+
+# Instancia global del control de admisión
+control_admision = ControlAdmision()
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, List, Any
+
+import numpy as np
+
+from config import get_config
+
+logger = logging.getLogger('seguridad.anomalias')
+
+
+class VentanaUsuario:
+    """
+    Ventana deslizante de un usuario dividida en buckets de `bucket_segundos`.
+
+    Mantiene contadores agregados de toda la ventana (eventos, desajustes de
+    país y conteo por país), de modo que registrar un evento y expirar un
+    bucket son O(1) amortizado.
+    """
+
+    __slots__ = ('buckets', 'eventos', 'desajustes', 'paises', 'ultimo_evento')
+
+    def __init__(self):
+        # Cada bucket: [id_bucket, eventos, desajustes, {pais: conteo}]
+        self.buckets: deque = deque()
+        self.eventos = 0
+        self.desajustes = 0
+        self.paises: Dict[str, int] = {}
+        self.ultimo_evento = 0.0
+
+    def expirar(self, bucket_minimo: int):
+        while self.buckets and self.buckets[0][0] < bucket_minimo:
+            _, eventos, desajustes, paises = self.buckets.popleft()
+            self.eventos -= eventos
+            self.desajustes -= desajustes
+            for pais, conteo in paises.items():
+                restante = self.paises[pais] - conteo
+                if restante:
+                    self.paises[pais] = restante
+                else:
+                    del self.paises[pais]
+
+    def agregar(self, id_bucket: int, pais: Optional[str], desajuste: bool, ahora: float):
+        if not self.buckets or self.buckets[-1][0] != id_bucket:
+            self.buckets.append([id_bucket, 0, 0, {}])
+        bucket = self.buckets[-1]
+        bucket[1] += 1
+        self.eventos += 1
+        if desajuste:
+            bucket[2] += 1
+            self.desajustes += 1
+        if pais:
+            bucket[3][pais] = bucket[3].get(pais, 0) + 1
+            self.paises[pais] = self.paises.get(pais, 0) + 1
+        self.ultimo_evento = ahora
+
+
+class MotorAnomalias:
+    """
+    Motor en memoria de detección de anomalías por usuario.
+
+    `registrar` actualiza la ventana del usuario en O(1) y evalúa las reglas
+    por evento (países distintos y ráfaga). `evaluar` recorre todos los
+    usuarios con NumPy para calcular un puntaje global y expulsa los usuarios
+    inactivos. Ninguna de las dos operaciones consulta la base de datos.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self.ventana_segundos = self.config.ANOMALIAS_VENTANA_SEGUNDOS
+        self.bucket_segundos = self.config.ANOMALIAS_BUCKET_SEGUNDOS
+        self.max_paises = self.config.ANOMALIAS_MAX_PAISES
+        self.max_eventos = self.config.ANOMALIAS_MAX_EVENTOS
+        self.max_desajustes = self.config.ANOMALIAS_MAX_DESAJUSTES
+        self.idle_segundos = self.config.ANOMALIAS_IDLE_SEGUNDOS
+        self.umbral_puntaje = self.config.ANOMALIAS_UMBRAL_PUNTAJE
+        self._buckets_por_ventana = max(1, int(self.ventana_segundos // self.bucket_segundos))
+        self._usuarios: Dict[Any, VentanaUsuario] = {}
+        self._sospechosos: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, ahora: float) -> int:
+        return int(ahora // self.bucket_segundos)
+
+    def registrar(self, id_usuario, pais: Optional[str], desajuste: bool,
+                  ahora: Optional[float] = None) -> Dict[str, Any]:
+        """Registra un evento y retorna el estado de la ventana y las reglas violadas"""
+        ahora = ahora if ahora is not None else time.time()
+        id_bucket = self._bucket(ahora)
+        with self._lock:
+            ventana = self._usuarios.get(id_usuario)
+            if ventana is None:
+                ventana = self._usuarios[id_usuario] = VentanaUsuario()
+            ventana.expirar(id_bucket - self._buckets_por_ventana + 1)
+            ventana.agregar(id_bucket, pais, desajuste, ahora)
+            eventos = ventana.eventos
+            desajustes = ventana.desajustes
+            paises_distintos = len(ventana.paises)
+            sospechoso = id_usuario in self._sospechosos
+
+        reglas = []
+        if paises_distintos > self.max_paises:
+            reglas.append('paises_distintos')
+        if eventos > self.max_eventos:
+            reglas.append('rafaga')
+        if desajustes > self.max_desajustes:
+            reglas.append('desajustes')
+        if sospechoso:
+            reglas.append('puntaje')
+
+        return {
+            "eventos": eventos,
+            "desajustes": desajustes,
+            "paises_distintos": paises_distintos,
+            "reglas": reglas,
+        }
+
+    def es_sospechoso(self, id_usuario) -> bool:
+        return id_usuario in self._sospechosos
+
+    def en_riesgo(self, id_usuario) -> bool:
+        """Sospechoso o con desajustes de país en su ventana actual (sin consultar la BD)"""
+        if id_usuario in self._sospechosos:
+            return True
+        ventana = self._usuarios.get(id_usuario)
+        return bool(ventana and ventana.desajustes)
+
+    def evaluar(self, ahora: Optional[float] = None) -> List[Any]:
+        """
+        Puntúa a todos los usuarios de forma vectorizada, actualiza la lista de
+        sospechosos y expulsa a los usuarios inactivos. Retorna los sospechosos.
+        """
+        ahora = ahora if ahora is not None else time.time()
+        bucket_minimo = self._bucket(ahora) - self._buckets_por_ventana + 1
+
+        with self._lock:
+            inactivos = [u for u, v in self._usuarios.items() if ahora - v.ultimo_evento > self.idle_segundos]
+            for id_usuario in inactivos:
+                del self._usuarios[id_usuario]
+
+            usuarios = list(self._usuarios.keys())
+            n = len(usuarios)
+            eventos = np.empty(n, dtype=np.float64)
+            desajustes = np.empty(n, dtype=np.float64)
+            paises = np.empty(n, dtype=np.float64)
+            for i, id_usuario in enumerate(usuarios):
+                ventana = self._usuarios[id_usuario]
+                ventana.expirar(bucket_minimo)
+                eventos[i] = ventana.eventos
+                desajustes[i] = ventana.desajustes
+                paises[i] = len(ventana.paises)
+
+        if n == 0:
+            self._sospechosos = {}
+            return []
+
+        # Puntaje: cada componente normalizado contra su umbral
+        puntaje = (
+            paises / max(self.max_paises, 1)
+            + eventos / max(self.max_eventos, 1)
+            + desajustes / max(self.max_desajustes, 1)
+        )
+        # Ráfaga relativa a la población actual (z-score de la tasa)
+        desviacion = eventos.std()
+        if desviacion > 0:
+            puntaje += np.clip((eventos - eventos.mean()) / desviacion - 3.0, 0.0, None)
+
+        indices = np.nonzero(puntaje >= self.umbral_puntaje)[0]
+        self._sospechosos = {usuarios[i]: float(puntaje[i]) for i in indices}
+
+        if inactivos or len(indices):
+            logger.info(f"Evaluación de anomalías: {n} usuarios activos, {len(indices)} sospechosos, {len(inactivos)} expulsados por inactividad")
+        return list(self._sospechosos.keys())
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "usuarios_activos": len(self._usuarios),
+            "sospechosos": dict(self._sospechosos),
+        }
+
+
+# Instancia global del motor de anomalías
+motor_anomalias = MotorAnomalias()
@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Set
+
+from config import get_config
+from database import db_manager
+
+logger = logging.getLogger('seguridad.auditoria')
+
+TABLA_EVENTOS = 'eventos_seguridad'
+COLUMNAS_EVENTOS = [
+    'id_evento',
+    'id_usuario',
+    'pais_consulta',
+    'pais_origen',
+    'decision',
+    'latencia_segundos',
+    'timestamp_origen',
+    'recibido_en',
+]
+
+
+class AuditoriaEventosWriter:
+    """
+    Escritor en segundo plano de la tabla particionada eventos_seguridad.
+
+    El request solo deposita la fila en una cola en memoria (sin I/O); un hilo
+    la vacía en lotes con COPY cada `batch_size` filas o cada
+    `flush_interval` segundos, lo que ocurra primero.
+    """
+
+    def __init__(self, db=None, config=None):
+        self.config = config or get_config()
+        self.db = db or db_manager
+        self.batch_size = self.config.EVENTOS_BATCH_SIZE
+        self.flush_interval = self.config.EVENTOS_FLUSH_INTERVAL_SECONDS
+        self._cola: queue.Queue = queue.Queue(maxsize=self.config.EVENTOS_QUEUE_MAXSIZE)
+        self._particiones_creadas: Set[str] = set()
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self.escritos = 0
+        self.descartados = 0
+
+    def iniciar(self):
+        """Arranca el hilo escritor (idempotente)"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='auditoria-eventos', daemon=True)
+        self._hilo.start()
+        logger.info(f"Escritor de auditoría iniciado (lote={self.batch_size}, intervalo={self.flush_interval}s)")
+
+    def detener(self, timeout: float = 5.0):
+        """Detiene el hilo escritor y vacía lo pendiente"""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+
+    def registrar(self, id_evento, id_usuario, pais_consulta, pais_origen, decision: str,
+                  latencia_segundos: Optional[float] = None, timestamp_origen: Optional[datetime] = None,
+                  recibido_en: Optional[datetime] = None) -> bool:
+        """Encola un evento para auditoría sin bloquear; retorna False si la cola está llena"""
+        fila = (
+            id_evento,
+            id_usuario,
+            pais_consulta,
+            pais_origen,
+            decision,
+            latencia_segundos,
+            timestamp_origen.isoformat() if timestamp_origen else None,
+            (recibido_en or datetime.now(timezone.utc)).isoformat(),
+        )
+        try:
+            self._cola.put_nowait(fila)
+            return True
+        except queue.Full:
+            self.descartados += 1
+            if self.descartados % 1000 == 1:
+                logger.warning(f"Cola de auditoría llena, eventos descartados: {self.descartados}")
+            return False
+
+    def _bucle(self):
+        lote: List[tuple] = []
+        limite = time.monotonic() + self.flush_interval
+        while not (self._detener.is_set() and self._cola.empty()):
+            espera = max(0.0, limite - time.monotonic())
+            try:
+                lote.append(self._cola.get(timeout=espera))
+                # Drenar lo que ya está disponible sin volver a esperar
+                while len(lote) < self.batch_size:
+                    lote.append(self._cola.get_nowait())
+            except queue.Empty:
+                pass
+            if len(lote) >= self.batch_size or time.monotonic() >= limite or self._detener.is_set():
+                if lote:
+                    self._escribir_lote(lote)
+                    lote = []
+                limite = time.monotonic() + self.flush_interval
+
+    def _escribir_lote(self, lote: List[tuple]):
+        try:
+            self._asegurar_particiones(lote)
+            self.escritos += self.db.execute_copy(TABLA_EVENTOS, COLUMNAS_EVENTOS, lote)
+            logger.debug(f"Lote de auditoría escrito: {len(lote)} eventos")
+        except Exception as e:
+            self.descartados += len(lote)
+            logger.error(f"Error escribiendo lote de auditoría ({len(lote)} eventos): {e}")
+
+    def _asegurar_particiones(self, lote: List[tuple]):
+        """Crea la partición diaria de cada fecha del lote que aún no se haya visto"""
+        dias = {fila[-1][:10] for fila in lote} - self._particiones_creadas
+        for dia in sorted(dias):
+            crear_particion(dia, self.db)
+            self._particiones_creadas.add(dia)
+
+
+def crear_particion(dia: str, db=None):
+    """Crea la partición de eventos para el día (YYYY-MM-DD, UTC) si no existe"""
+    (db or db_manager).execute_command_returning("SELECT crear_particion_eventos(%s::date)", (dia,))
+
+
+def preparar_particiones(dias_adelante: int = 2, db=None):
+    """Crea por adelantado las particiones de hoy y de los próximos días"""
+    hoy = datetime.now(timezone.utc).date()
+    for delta in range(dias_adelante + 1):
+        crear_particion((hoy + timedelta(days=delta)).isoformat(), db)
+
+
+def purgar_particiones(dias_retencion: Optional[int] = None, db=None) -> int:
+    """Elimina las particiones más viejas que la retención configurada"""
+    dias_retencion = dias_retencion if dias_retencion is not None else get_config().EVENTOS_RETENTION_DAYS
+    resultado = (db or db_manager).execute_command_returning(
+        "SELECT purgar_particiones_eventos(%s) AS eliminadas", (dias_retencion,)
+    )
+    eliminadas = resultado.get('eliminadas', 0) if resultado else 0
+    logger.info(f"Retención de auditoría ({dias_retencion} días): {eliminadas} particiones eliminadas")
+    return eliminadas
+
+
+# Instancia global del escritor de auditoría
+audit_writer = AuditoriaEventosWriter()
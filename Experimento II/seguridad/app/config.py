@@ -27,6 +27,20 @@ class DatabaseConfig:
             'password': self.password
         }
 
+def configurar_replicas(valor: str, primario: DatabaseConfig) -> list:
+    """Réplicas de lectura "host:puerto,host:puerto" con la misma base y credenciales que el primario"""
+    replicas = []
+    for nodo in filter(None, (parte.strip() for parte in valor.split(','))):
+        host, _, puerto = nodo.partition(':')
+        replicas.append(DatabaseConfig(
+            host=host,
+            port=int(puerto or primario.port),
+            database=primario.database,
+            username=primario.username,
+            password=primario.password
+        ))
+    return replicas
+
 @dataclass 
 class AppConfig:
     """Configuración general de la aplicación"""
@@ -51,6 +65,18 @@ class Config:
         username=os.environ.get('DB_USER', 'postgres'),
         password=os.environ.get('DB_PASSWORD', 'password')
     )
+    # Pool por nodo: sin conexión libre se espera a lo sumo DB_POOL_ESPERA_SECONDS
+    DB_POOL_MAX_CONEXIONES = int(os.environ.get('DB_POOL_MAX_CONEXIONES', 10))
+    DB_POOL_ESPERA_SECONDS = float(os.environ.get('DB_POOL_ESPERA_SECONDS', 2.0))
+    
+    # Réplicas de lectura: las consultas se reparten entre las que tengan lag aceptable
+    DATABASE_REPLICAS = configurar_replicas(os.environ.get('DB_REPLICAS', ''), DATABASE)
+    DB_REPLICA_LAG_MAX_SECONDS = float(os.environ.get('DB_REPLICA_LAG_MAX_SECONDS', 1.0))
+    DB_REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('DB_REPLICA_LAG_CHECK_SECONDS', 1.0))
+    DB_REPLICA_REINTENTO_SECONDS = float(os.environ.get('DB_REPLICA_REINTENTO_SECONDS', 5.0))
+    DB_REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT_SECONDS', 2))
+    # Ventana en la que las lecturas de una clave (id_usuario) recién escrita van al primario
+    DB_LECTURA_PRIMARIO_TRAS_ESCRITURA_SECONDS = float(os.environ.get('DB_LECTURA_PRIMARIO_TRAS_ESCRITURA_SECONDS', 5.0))
     
     # Configuración de Logging
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
@@ -71,6 +97,42 @@ class Config:
     # Configuración de Rate Limiting
     RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL', 'memory://')
     
+    # Configuración de auditoría de eventos (tabla eventos_seguridad)
+    EVENTOS_BATCH_SIZE = int(os.environ.get('EVENTOS_BATCH_SIZE', 500))
+    EVENTOS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('EVENTOS_FLUSH_INTERVAL_SECONDS', 1.0))
+    EVENTOS_QUEUE_MAXSIZE = int(os.environ.get('EVENTOS_QUEUE_MAXSIZE', 50000))
+    EVENTOS_RETENTION_DAYS = int(os.environ.get('EVENTOS_RETENTION_DAYS', 90))
+    
+    # Configuración de detección de anomalías por usuario (ventanas en memoria)
+    ANOMALIAS_VENTANA_SEGUNDOS = int(os.environ.get('ANOMALIAS_VENTANA_SEGUNDOS', 300))
+    ANOMALIAS_BUCKET_SEGUNDOS = int(os.environ.get('ANOMALIAS_BUCKET_SEGUNDOS', 10))
+    ANOMALIAS_MAX_PAISES = int(os.environ.get('ANOMALIAS_MAX_PAISES', 3))
+    ANOMALIAS_MAX_EVENTOS = int(os.environ.get('ANOMALIAS_MAX_EVENTOS', 100))
+    ANOMALIAS_MAX_DESAJUSTES = int(os.environ.get('ANOMALIAS_MAX_DESAJUSTES', 5))
+    ANOMALIAS_UMBRAL_PUNTAJE = float(os.environ.get('ANOMALIAS_UMBRAL_PUNTAJE', 2.5))
+    ANOMALIAS_IDLE_SEGUNDOS = int(os.environ.get('ANOMALIAS_IDLE_SEGUNDOS', 900))
+    ANOMALIAS_SCORING_INTERVAL_SECONDS = int(os.environ.get('ANOMALIAS_SCORING_INTERVAL_SECONDS', 5))
+    
+    # Configuración de sesiones (Redis) y filtro de Bloom de usuarios revocados
+    SESIONES_TTL_SECONDS = int(os.environ.get('SESIONES_TTL_SECONDS', 3600))
+    SESIONES_REDIS_TIMEOUT_SECONDS = float(os.environ.get('SESIONES_REDIS_TIMEOUT_SECONDS', 0.5))
+    BLOOM_CAPACIDAD = int(os.environ.get('BLOOM_CAPACIDAD', 100000))
+    BLOOM_TASA_FALSOS_POSITIVOS = float(os.environ.get('BLOOM_TASA_FALSOS_POSITIVOS', 0.001))
+    
+    # Configuración de control de admisión (límite de concurrencia AIMD)
+    ADMISION_LIMITE_INICIAL = int(os.environ.get('ADMISION_LIMITE_INICIAL', 20))
+    ADMISION_LIMITE_MINIMO = int(os.environ.get('ADMISION_LIMITE_MINIMO', 2))
+    ADMISION_LIMITE_MAXIMO = int(os.environ.get('ADMISION_LIMITE_MAXIMO', 200))
+    ADMISION_LATENCIA_OBJETIVO_MS = float(os.environ.get('ADMISION_LATENCIA_OBJETIVO_MS', 250))
+    ADMISION_ESPERA_POOL_OBJETIVO_MS = float(os.environ.get('ADMISION_ESPERA_POOL_OBJETIVO_MS', 20))
+    ADMISION_FACTOR_REDUCCION = float(os.environ.get('ADMISION_FACTOR_REDUCCION', 0.7))
+    ADMISION_RESERVA_PRIORITARIA = float(os.environ.get('ADMISION_RESERVA_PRIORITARIA', 0.2))
+    ADMISION_RETRY_AFTER_SECONDS = int(os.environ.get('ADMISION_RETRY_AFTER_SECONDS', 1))
+    
+    # Configuración de deduplicación de eventos por id (Bloom + LRU en memoria)
+    DEDUPE_CAPACIDAD = int(os.environ.get('DEDUPE_CAPACIDAD', 100000))
+    DEDUPE_CAPACIDAD_EXACTA = int(os.environ.get('DEDUPE_CAPACIDAD_EXACTA', 10000))
+    
     @classmethod
     def validate_config(cls) -> list:
         """Valida la configuración y retorna lista de errores"""
@@ -89,6 +151,9 @@ class Config:
         # Validar puerto
         if not (1 <= cls.DATABASE.port <= 65535):
             errors.append("DB_PORT debe estar entre 1 y 65535")
+        for replica in cls.DATABASE_REPLICAS:
+            if not replica.host or not (1 <= replica.port <= 65535):
+                errors.append(f"Réplica inválida en DB_REPLICAS: {replica.host}:{replica.port}")
             
         return errors
 
@@ -129,6 +194,7 @@ class TestingConfig(Config):
         username=os.environ.get('TEST_DB_USER', 'postgres'),
         password=os.environ.get('TEST_DB_PASSWORD', 'password')
     )
+    DATABASE_REPLICAS = []
 
 # Diccionario de configuraciones disponibles
 config_by_name = {
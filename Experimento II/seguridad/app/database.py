@@ -1,49 +1,282 @@
+"""
+Acceso a PostgreSQL: un primario y N réplicas de lectura, cada nodo con su pool.
+
+Las escrituras (execute_command, execute_command_returning, execute_transaction,
+execute_copy) van siempre al primario. execute_query y execute_query_one se
+reparten en round-robin entre las réplicas cuyo lag medido no supera
+DB_REPLICA_LAG_MAX_SECONDS; el lag se mide a lo sumo cada
+DB_REPLICA_LAG_CHECK_SECONDS, en línea por el primer hilo que lo necesita.
+
+Lectura de las propias escrituras: después de escribir, el resto del request
+lee del primario (iniciar_peticion() marca el comienzo de cada request), y las
+lecturas de una `clave` (id_usuario) escrita hace menos de
+DB_LECTURA_PRIMARIO_TRAS_ESCRITURA_SECONDS también. Ese registro es del
+proceso; otro worker puede leer de una réplica, pero nunca con más lag que el
+máximo aceptado.
+
+Si una réplica falla (conexión, pool), la lectura se repite en el primario y
+la réplica queda fuera del reparto durante DB_REPLICA_REINTENTO_SECONDS.
+Sin DB_REPLICAS todo va al primario, como antes.
+"""
+import csv
+import io
+import itertools
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from collections import Counter, OrderedDict
 from contextlib import contextmanager
 from typing import Optional, List, Dict, Any, Union
 import logging
+import threading
+import time
 from config import get_config
+from perfilado import span
 
 logger = logging.getLogger(__name__)
 
+PRIMARIO = 'primario'
+
+# Lag de reproducción de una réplica; NULL si el nodo no está en recuperación (no es réplica)
+CONSULTA_LAG = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag
+"""
+
+# Errores de un nodo caído o inalcanzable (no de la consulta en sí)
+ERRORES_NODO = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+
+class PoolConEspera(ThreadedConnectionPool):
+    """
+    ThreadedConnectionPool que, sin conexiones libres, espera hasta `espera`
+    segundos a que se devuelva una en vez de fallar de inmediato. Así la
+    espera que ve el control de admisión es la real del pool, y PoolError
+    solo indica que el plazo venció.
+    """
+
+    def __init__(self, minconn, maxconn, espera, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.espera = espera
+        # Un permiso por conexión prestada
+        self._libres = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self._libres.acquire(timeout=self.espera):
+            raise PoolError(f"sin conexiones libres tras {self.espera}s")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._libres.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._libres.release()
+
 class DatabaseManager:
-    """Gestor de conexiones a PostgreSQL"""
+    """Gestor de conexiones a PostgreSQL con réplicas de lectura"""
     
     def __init__(self, config=None):
         self.config = config or get_config()
-        self._pool: Optional[SimpleConnectionPool] = None
-        self._initialize_pool()
+        self._nodos = {PRIMARIO: self.config.DATABASE}
+        for i, replica in enumerate(self.config.DATABASE_REPLICAS, start=1):
+            self._nodos[f'replica-{i}'] = replica
+        self._replicas = [nodo for nodo in self._nodos if nodo != PRIMARIO]
+        self._pools: Dict[str, PoolConEspera] = {}
+        self._observadores_pool = []
+        # Los pools se crean en el primer uso, ya dentro del worker (no se comparten entre forks)
+        self._lock_pool = threading.Lock()
+        # Salud de cada réplica: lag en segundos (None: desconocido o no es réplica) y caída hasta
+        self._salud = {nodo: {"lag": None, "caida_hasta": 0.0} for nodo in self._replicas}
+        self._lag_medido = 0.0
+        self._lock_lag = threading.Lock()
+        self._turno = itertools.count()
+        # clave -> instante de su última escritura, en orden de escritura
+        self._escrituras_recientes = OrderedDict()
+        self._lock_escrituras = threading.Lock()
+        self._peticion = threading.local()
+        self.lecturas = Counter()
+        self.fallbacks = 0
     
-    def _initialize_pool(self):
-        """Inicializa el pool de conexiones"""
+    def _initialize_pool(self, nodo=PRIMARIO):
+        """Inicializa el pool de conexiones de un nodo"""
+        parametros = dict(self._nodos[nodo].connection_params)
+        if nodo != PRIMARIO:
+            # Una réplica caída no debe retener el request: se pasa al primario
+            parametros['connect_timeout'] = self.config.DB_REPLICA_CONNECT_TIMEOUT_SECONDS
         try:
-            self._pool = SimpleConnectionPool(
+            self._pools[nodo] = PoolConEspera(
                 minconn=1,
-                maxconn=10,
-                **self.config.DATABASE.connection_params
+                maxconn=self.config.DB_POOL_MAX_CONEXIONES,
+                espera=self.config.DB_POOL_ESPERA_SECONDS,
+                **parametros
             )
-            logger.info("✅ Pool de conexiones PostgreSQL inicializado")
+            logger.info(f"✅ Pool de conexiones PostgreSQL inicializado ({nodo})")
         except Exception as e:
-            logger.error(f"❌ Error inicializando pool de conexiones: {e}")
+            logger.error(f"❌ Error inicializando pool de conexiones ({nodo}): {e}")
+            raise
+    
+    def registrar_observador_pool(self, observador):
+        """Registra un observador con registrar_espera_pool(segundos) y registrar_pool_agotado()"""
+        self._observadores_pool.append(observador)
+    
+    def _obtener_del_pool(self, nodo=PRIMARIO):
+        pool = self._pools.get(nodo)
+        if pool is None:
+            with self._lock_pool:
+                if nodo not in self._pools:
+                    self._initialize_pool(nodo)
+                pool = self._pools[nodo]
+        inicio = time.perf_counter()
+        try:
+            conn = pool.getconn()
+        except PoolError:
+            for observador in self._observadores_pool:
+                observador.registrar_pool_agotado()
             raise
+        espera = time.perf_counter() - inicio
+        for observador in self._observadores_pool:
+            observador.registrar_espera_pool(espera)
+        return pool, conn
     
     @contextmanager
-    def get_connection(self):
-        """Context manager para obtener conexión del pool"""
+    def get_connection(self, nodo=PRIMARIO):
+        """Context manager para obtener conexión del pool de un nodo (por defecto el primario)"""
         conn = None
+        pool = None
+        # El tramo 'db' incluye la espera por una conexión libre del pool
+        with span('db'):
+            try:
+                pool, conn = self._obtener_del_pool(nodo)
+                yield conn
+            except Exception as e:
+                if conn and not conn.closed:
+                    conn.rollback()
+                logger.error(f"Error en conexión de base de datos ({nodo}): {e}")
+                raise
+            finally:
+                if conn:
+                    # Una conexión cerrada por el servidor no vuelve al pool
+                    pool.putconn(conn, close=bool(conn.closed))
+    
+    # --- Enrutamiento de lecturas ---
+    
+    def iniciar_peticion(self):
+        """Marca el inicio de un request en este hilo: olvida las escrituras del request anterior"""
+        self._peticion.escribio = False
+    
+    def _registrar_escritura(self, clave=None):
+        self._peticion.escribio = True
+        if clave is None or not self._replicas:
+            return
+        ahora = time.monotonic()
+        ventana = self.config.DB_LECTURA_PRIMARIO_TRAS_ESCRITURA_SECONDS
+        with self._lock_escrituras:
+            self._escrituras_recientes[clave] = ahora
+            self._escrituras_recientes.move_to_end(clave)
+            # Las más antiguas están al principio: se descartan las que ya salieron de la ventana
+            while self._escrituras_recientes:
+                primera, instante = next(iter(self._escrituras_recientes.items()))
+                if ahora - instante < ventana:
+                    break
+                del self._escrituras_recientes[primera]
+    
+    def _leer_del_primario(self, clave=None) -> bool:
+        if getattr(self._peticion, 'escribio', False):
+            return True
+        if clave is None:
+            return False
+        instante = self._escrituras_recientes.get(clave)
+        return instante is not None and time.monotonic() - instante < self.config.DB_LECTURA_PRIMARIO_TRAS_ESCRITURA_SECONDS
+    
+    def _marcar_caida(self, nodo, error):
+        salud = self._salud[nodo]
+        if salud["caida_hasta"] <= time.monotonic():
+            logger.warning(f"⚠️ Réplica {nodo} fuera del reparto por {self.config.DB_REPLICA_REINTENTO_SECONDS}s: {error}")
+        salud["caida_hasta"] = time.monotonic() + self.config.DB_REPLICA_REINTENTO_SECONDS
+        salud["lag"] = None
+    
+    def _medir_lag(self):
+        """Mide el lag de las réplicas si la última medición venció; un solo hilo mide a la vez"""
+        if time.monotonic() - self._lag_medido < self.config.DB_REPLICA_LAG_CHECK_SECONDS:
+            return
+        if not self._lock_lag.acquire(blocking=False):
+            return
         try:
-            conn = self._pool.getconn()
-            yield conn
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            logger.error(f"Error en conexión de base de datos: {e}")
-            raise
+            for nodo in self._replicas:
+                if self._salud[nodo]["caida_hasta"] > time.monotonic():
+                    continue
+                try:
+                    with self.get_connection(nodo) as conn:
+                        with self.get_cursor(conn, dict_cursor=False) as cursor:
+                            cursor.execute(CONSULTA_LAG)
+                            lag = cursor.fetchone()[0]
+                except ERRORES_NODO as e:
+                    self._marcar_caida(nodo, e)
+                    continue
+                if lag is None and self._salud[nodo]["lag"] is not None:
+                    logger.warning(f"⚠️ {nodo} no está en recuperación (¿promovida?), se excluye de las lecturas")
+                self._salud[nodo]["lag"] = None if lag is None else float(lag)
+            self._lag_medido = time.monotonic()
         finally:
-            if conn:
-                self._pool.putconn(conn)
+            self._lock_lag.release()
+    
+    def _elegir_replica(self) -> Optional[str]:
+        self._medir_lag()
+        ahora = time.monotonic()
+        disponibles = [
+            nodo for nodo in self._replicas
+            if self._salud[nodo]["caida_hasta"] <= ahora
+            and self._salud[nodo]["lag"] is not None
+            and self._salud[nodo]["lag"] <= self.config.DB_REPLICA_LAG_MAX_SECONDS
+        ]
+        if not disponibles:
+            return None
+        return disponibles[next(self._turno) % len(disponibles)]
+    
+    def _leer(self, consulta, clave=None):
+        """Ejecuta consulta(conn) en una réplica con lag aceptable; si no hay o falla, en el primario"""
+        if self._replicas and not self._leer_del_primario(clave):
+            nodo = self._elegir_replica()
+            if nodo is not None:
+                try:
+                    with self.get_connection(nodo) as conn:
+                        resultado = consulta(conn)
+                    self.lecturas[nodo] += 1
+                    return resultado
+                except ERRORES_NODO as e:
+                    self._marcar_caida(nodo, e)
+                    self.fallbacks += 1
+        with self.get_connection() as conn:
+            resultado = consulta(conn)
+        self.lecturas[PRIMARIO] += 1
+        return resultado
+    
+    def estado_nodos(self) -> Dict[str, Any]:
+        """Lag, disponibilidad y lecturas atendidas por nodo en este proceso"""
+        ahora = time.monotonic()
+        return {
+            "nodos": {
+                PRIMARIO: {"host": self._nodos[PRIMARIO].host, "lecturas": self.lecturas[PRIMARIO]},
+                **{
+                    nodo: {
+                        "host": self._nodos[nodo].host,
+                        "lag_segundos": self._salud[nodo]["lag"],
+                        "disponible": self._salud[nodo]["caida_hasta"] <= ahora,
+                        "lecturas": self.lecturas[nodo],
+                    }
+                    for nodo in self._replicas
+                },
+            },
+            "fallbacks": self.fallbacks,
+            "lag_max_segundos": self.config.DB_REPLICA_LAG_MAX_SECONDS,
+        }
     
     @contextmanager
     def get_cursor(self, connection=None, dict_cursor=True):
@@ -64,49 +297,53 @@ class DatabaseManager:
                 finally:
                     cursor.close()
     
-    def execute_query(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
-        """Ejecuta consulta SELECT y retorna resultados"""
+    def execute_query(self, query: str, params: tuple = None, clave=None) -> List[Dict[str, Any]]:
+        """Ejecuta consulta SELECT (en una réplica si es posible) y retorna resultados"""
+        def consulta(conn):
+            with self.get_cursor(conn) as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall()
+                return [dict(row) for row in results] if results else []
         try:
-            with self.get_connection() as conn:
-                with self.get_cursor(conn) as cursor:
-                    cursor.execute(query, params)
-                    results = cursor.fetchall()
-                    return [dict(row) for row in results] if results else []
+            return self._leer(consulta, clave)
         except Exception as e:
             logger.error(f"Error ejecutando consulta: {query} - {e}")
             raise
     
-    def execute_query_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
-        """Ejecuta consulta SELECT y retorna un solo resultado"""
+    def execute_query_one(self, query: str, params: tuple = None, clave=None) -> Optional[Dict[str, Any]]:
+        """Ejecuta consulta SELECT (en una réplica si es posible) y retorna un solo resultado"""
+        def consulta(conn):
+            with self.get_cursor(conn) as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchone()
+                return dict(result) if result else None
         try:
-            with self.get_connection() as conn:
-                with self.get_cursor(conn) as cursor:
-                    cursor.execute(query, params)
-                    result = cursor.fetchone()
-                    return dict(result) if result else None
+            return self._leer(consulta, clave)
         except Exception as e:
             logger.error(f"Error ejecutando consulta única: {query} - {e}")
             raise
     
-    def execute_command(self, command: str, params: tuple = None) -> int:
-        """Ejecuta comando INSERT/UPDATE/DELETE y retorna filas afectadas"""
+    def execute_command(self, command: str, params: tuple = None, clave=None) -> int:
+        """Ejecuta comando INSERT/UPDATE/DELETE en el primario y retorna filas afectadas"""
         try:
             with self.get_connection() as conn:
                 with self.get_cursor(conn, dict_cursor=False) as cursor:
                     cursor.execute(command, params)
                     conn.commit()
+                    self._registrar_escritura(clave)
                     return cursor.rowcount
         except Exception as e:
             logger.error(f"Error ejecutando comando: {command} - {e}")
             raise
     
-    def execute_command_returning(self, command: str, params: tuple = None) -> Optional[Dict[str, Any]]:
-        """Ejecuta comando con RETURNING y retorna el resultado"""
+    def execute_command_returning(self, command: str, params: tuple = None, clave=None) -> Optional[Dict[str, Any]]:
+        """Ejecuta comando con RETURNING en el primario y retorna el resultado"""
         try:
             with self.get_connection() as conn:
                 with self.get_cursor(conn) as cursor:
                     cursor.execute(command, params)
                     conn.commit()
+                    self._registrar_escritura(clave)
                     result = cursor.fetchone()
                     return dict(result) if result else None
         except Exception as e:
@@ -121,11 +358,30 @@ class DatabaseManager:
                     for command, params in commands:
                         cursor.execute(command, params)
                     conn.commit()
+                    self._registrar_escritura()
                     return True
         except Exception as e:
             logger.error(f"Error en transacción: {e}")
             raise
     
+    def execute_copy(self, table: str, columns: List[str], rows: List[tuple]) -> int:
+        """Carga filas en bloque con COPY ... FROM STDIN (CSV) y retorna filas copiadas"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows(rows)
+        buffer.seek(0)
+        copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn, dict_cursor=False) as cursor:
+                    cursor.copy_expert(copy_sql, buffer)
+                    conn.commit()
+                    self._registrar_escritura()
+                    return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error ejecutando COPY en {table} ({len(rows)} filas): {e}")
+            raise
+    
     def test_connection(self) -> bool:
         """Prueba la conexión a la base de datos"""
         try:
@@ -155,30 +411,32 @@ class DatabaseManager:
             return {}
     
     def close_pool(self):
-        """Cierra el pool de conexiones"""
-        if self._pool:
-            self._pool.closeall()
-            logger.info("Pool de conexiones cerrado")
+        """Cierra los pools de conexiones de todos los nodos"""
+        with self._lock_pool:
+            for nodo, pool in list(self._pools.items()):
+                pool.closeall()
+                logger.info(f"Pool de conexiones cerrado ({nodo})")
+            self._pools = {}
 
 # Instancia global del gestor de base de datos
 db_manager = DatabaseManager()
 
 # Funciones de conveniencia
-def execute_query(query: str, params: tuple = None) -> List[Dict[str, Any]]:
+def execute_query(query: str, params: tuple = None, clave=None) -> List[Dict[str, Any]]:
     """Función de conveniencia para consultas"""
-    return db_manager.execute_query(query, params)
+    return db_manager.execute_query(query, params, clave)
 
-def execute_query_one(query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
+def execute_query_one(query: str, params: tuple = None, clave=None) -> Optional[Dict[str, Any]]:
     """Función de conveniencia para consulta única"""
-    return db_manager.execute_query_one(query, params)
+    return db_manager.execute_query_one(query, params, clave)
 
-def execute_command(command: str, params: tuple = None) -> int:
+def execute_command(command: str, params: tuple = None, clave=None) -> int:
     """Función de conveniencia para comandos"""
-    return db_manager.execute_command(command, params)
+    return db_manager.execute_command(command, params, clave)
 
-def execute_command_returning(command: str, params: tuple = None) -> Optional[Dict[str, Any]]:
+def execute_command_returning(command: str, params: tuple = None, clave=None) -> Optional[Dict[str, Any]]:
     """Función de conveniencia para comandos con returning"""
-    return db_manager.execute_command_returning(command, params)
+    return db_manager.execute_command_returning(command, params, clave)
 
 # Decorador para manejo de errores de base de datos
 def handle_db_errors(func):
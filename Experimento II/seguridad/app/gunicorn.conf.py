@@ -0,0 +1,35 @@
+"""
+Configuración de gunicorn para producción:
+
+    gunicorn -c gunicorn.conf.py "main:create_app()"
+
+La app se importa una vez en el master (preload) y cada worker arranca sus
+hilos en post_worker_init; el mantenimiento de particiones corre en un solo
+worker gracias a PlanificadorUnico.
+"""
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# Excepción a "un worker por núcleo": las ventanas de anomalías, el control de
+# admisión y el LRU de duplicados viven en memoria del proceso; con varios
+# workers cada uno vería solo parte de los eventos de un usuario y la detección
+# se debilitaría. Por defecto un worker con tantos hilos como conexiones del
+# pool, así que el servicio usa un solo núcleo para Python (ver README).
+# WEB_CONCURRENCY > 1 funciona, con esa pérdida de precisión.
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 10))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 10))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+preload_app = True
+
+
+def post_worker_init(worker):
+    import main
+    main.iniciar_servicio()
+
+
+def worker_exit(server, worker):
+    import main
+    main.detener_servicio()
@@ -1,14 +1,23 @@
 import logging
 import os
+import time
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, request, jsonify, g
 from datetime import datetime, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # Importar configuración y database
 from config import get_config, validate_environment
 from database import db_manager, execute_query, execute_query_one, execute_command
+from auditoria import audit_writer, preparar_particiones, purgar_particiones
+from anomalias import motor_anomalias
+from sesiones import session_store
+from admision import control_admision, PRIORIDAD_ALTA, PRIORIDAD_NORMAL
+from filtros import FiltroDuplicados
+from planificador import PlanificadorUnico
+import perfilado
+from perfilado import span
 
 # Validar configuración al importar
 if not validate_environment():
@@ -96,28 +105,102 @@ logger = setup_logging()
 # Configure logging básico (para compatibilidad)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = Flask(__name__)
+bp = Blueprint('seguridad', __name__)
 
 ULTIMOS_EVENTOS = {}
 LATENCIAS = {}
 SERVICIOS_MONITOREADOS = ['modulo-pedidos-1', 'modulo-pedidos-2', 'modulo-pedidos-3']
 SCHEDULER_INTERVAL_SECONDS = int(os.environ.get('SCHEDULER_INTERVAL_SECONDS', 3))
 
+# Rutas protegidas por el control de admisión
+RUTAS_CON_ADMISION = {'seguridad.reportar_evento', 'seguridad.crear_sesion', 'seguridad.validar_sesion'}
 
-@app.route('/reportar-evento', methods=['POST'])
+db_manager.registrar_observador_pool(control_admision)
+
+# Descarta re-entregas del broker antes de tocar la base de datos
+filtro_duplicados = FiltroDuplicados(config.DEDUPE_CAPACIDAD, config.DEDUPE_CAPACIDAD_EXACTA)
+
+
+def clasificar_prioridad() -> str:
+    """
+    Prioridad alta para validaciones de sesión y eventos de usuarios en riesgo.
+    Se decide solo con estado del servidor: un campo del cliente no puede
+    saltarse la reserva prioritaria.
+    """
+    if request.endpoint == 'seguridad.validar_sesion':
+        return PRIORIDAD_ALTA
+    with span('json'):
+        data = request.get_json(silent=True) or {}
+    if motor_anomalias.en_riesgo(data.get('id_usuario')):
+        return PRIORIDAD_ALTA
+    return PRIORIDAD_NORMAL
+
+
+@bp.before_app_request
+def iniciar_peticion_bd():
+    # Lecturas posteriores a una escritura del mismo request van al primario
+    db_manager.iniciar_peticion()
+
+
+@bp.before_app_request
+def admitir_request():
+    if request.endpoint not in RUTAS_CON_ADMISION:
+        return None
+    if not control_admision.intentar_admitir(clasificar_prioridad()):
+        respuesta = jsonify({"status": "error", "mensaje": "Servicio sobrecargado, reintente más tarde"})
+        respuesta.headers['Retry-After'] = str(control_admision.retry_after)
+        return respuesta, 503
+    g.admision_inicio = time.perf_counter()
+
+
+@bp.teardown_app_request
+def liberar_admision(exc):
+    inicio = g.pop('admision_inicio', None)
+    if inicio is not None:
+        control_admision.liberar(time.perf_counter() - inicio)
+
+
+@bp.route('/estado-admision', methods=['GET'])
+def estado_admision():
+    return jsonify(control_admision.estado()), 200
+
+
+@bp.route('/estado-bd', methods=['GET'])
+def estado_bd():
+    return jsonify(db_manager.estado_nodos()), 200
+
+
+@bp.route('/reportar-evento', methods=['POST'])
 def reportar_evento():
-    data = request.json
+    with span('json'):
+        data = request.json
     if not data:
         logger.error("Request body vacío o no JSON")
         return jsonify({"status": "error", "mensaje": "Request body debe ser JSON"}), 400
     
     logger.debug("Received /reportar-evento request with data: %s", data)
 
-    result = execute_query_one("SELECT id_usuario, acceso, pais_origen FROM usuarios WHERE id_usuario = %s", (data.get('id_usuario'),))
+    if filtro_duplicados.es_duplicado(data.get('id')):
+        logger.info(f"Evento duplicado descartado: {data.get('id')}")
+        return jsonify({"status": "DUPLICADO", "id": data.get('id')}), 200
+
+    try:
+        return procesar_evento(data)
+    except Exception:
+        # El broker reintenta el 500: la re-entrega no debe descartarse como duplicado
+        filtro_duplicados.olvidar(data.get('id'))
+        raise
+
+
+def procesar_evento(data):
+    result = execute_query_one("SELECT id_usuario, acceso, pais_origen FROM usuarios WHERE id_usuario = %s", (data.get('id_usuario'),), clave=data.get('id_usuario'))
     
     if result is None:
         logger.info("Usuario no encontrado en la consulta")
-        return 200
+        with span('enqueue'):
+            audit_writer.registrar(data.get('id'), data.get('id_usuario'), data.get('pais_consulta'), None, 'USUARIO_NO_ENCONTRADO')
+        # 4xx: el broker no lo reintenta ni lo cuenta como falla del circuito
+        return jsonify({"status": "error", "mensaje": "Usuario no encontrado", "id_usuario": data.get('id_usuario')}), 404
     
     logger.debug(f"************************ Resultado de la consulta: {result} ************************")
     
@@ -125,20 +208,38 @@ def reportar_evento():
     acceso = result.get("acceso")
     pais_origen = result.get("pais_origen")
 
+    desajuste_pais = data.get('pais_consulta') != pais_origen
+    ventana = motor_anomalias.registrar(user, data.get('pais_consulta'), desajuste_pais)
     
-    if data.get('pais_consulta') != pais_origen:
-        logger.warning(f"Acceso denegado para usuario {user}, no tiene permisos para consultar el pais {data.get('pais_consulta')} ¡se deben inactivar sesiones!")
+    if desajuste_pais or ventana["reglas"]:
+        if desajuste_pais:
+            logger.warning(f"Acceso denegado para usuario {user}, no tiene permisos para consultar el pais {data.get('pais_consulta')} ¡se deben inactivar sesiones!")
+            with span('enqueue'):
+                audit_writer.registrar(data.get('id'), user, data.get('pais_consulta'), pais_origen, 'DENEGADO')
+        else:
+            logger.warning(f"Acceso denegado para usuario {user}, comportamiento anómalo {ventana['reglas']} (eventos={ventana['eventos']}, paises={ventana['paises_distintos']}) ¡se deben inactivar sesiones!")
+            with span('enqueue'):
+                audit_writer.registrar(data.get('id'), user, data.get('pais_consulta'), pais_origen, 'ANOMALIA')
+        
+        # Primero se revocan las sesiones en Redis (milisegundos), luego el flag en BD
+        try:
+            with span('redis'):
+                session_store.revocar_usuario(user)
+        except Exception as e:
+            logger.error(f"Error al revocar las sesiones del usuario {user}: {e}")
         
         try:
             rows_affected = execute_command(
                 "UPDATE usuarios SET acceso = false WHERE id_usuario = %s", 
-                (user,)
+                (user,),
+                clave=user
             )
             logger.info(f"Usuario {user} desactivado - Filas afectadas: {rows_affected}")
             
             usuario_actualizado = execute_query_one(
                 "SELECT * FROM usuarios WHERE id_usuario = %s", 
-                (user,)
+                (user,),
+                clave=user
             )
             
             if usuario_actualizado:
@@ -149,7 +250,8 @@ def reportar_evento():
         except Exception as e:
             logger.error(f"Error al actualizar el usuario {user} en la base de datos: {e}")
         
-        return jsonify({"status": "error", "mensaje": "Acceso denegado por país de origen"}), 403
+        mensaje = "Acceso denegado por país de origen" if desajuste_pais else "Acceso denegado por comportamiento anómalo"
+        return jsonify({"status": "error", "mensaje": mensaje}), 403
     
 
     timestamp_str = data.get('timestamp')
@@ -170,11 +272,20 @@ def reportar_evento():
     ULTIMOS_EVENTOS["Logistica"] = ahora_utc
     LATENCIAS["Logistica"] = latencia.total_seconds()
 
-    # Log específico para heartbeats (archivo separado)
-    evento_logger.info(f"Servicio: Logistica | Latencia: {latencia.total_seconds():.4f}s | Timestamp: {timestamp_str}")
-    
-    # Log general
-    logger.info(f"Evento recibido de Logistica - Latencia: {latencia.total_seconds():.4f}s")
+    with span('enqueue'):
+        audit_writer.registrar(
+            data.get('id'), user, data.get('pais_consulta'), pais_origen, 'PERMITIDO',
+            latencia_segundos=latencia.total_seconds(),
+            timestamp_origen=timestamp_origen,
+            recibido_en=ahora_utc
+        )
+
+    with span('logging'):
+        # Log específico para heartbeats (archivo separado)
+        evento_logger.info(f"Servicio: Logistica | Latencia: {latencia.total_seconds():.4f}s | Timestamp: {timestamp_str}")
+
+        # Log general
+        logger.info(f"Evento recibido de Logistica - Latencia: {latencia.total_seconds():.4f}s")
     
     return jsonify({
         "status": "OK",
@@ -182,11 +293,90 @@ def reportar_evento():
     }), 200
 
 
+@bp.route('/sesiones', methods=['POST'])
+def crear_sesion():
+    data = request.json
+    if not data or 'id_usuario' not in data:
+        return jsonify({"status": "error", "mensaje": "Falta 'id_usuario' en el request"}), 400
+    
+    usuario = execute_query_one("SELECT id_usuario, acceso FROM usuarios WHERE id_usuario = %s", (data['id_usuario'],), clave=data['id_usuario'])
+    if usuario is None:
+        return jsonify({"status": "error", "mensaje": "Usuario no encontrado"}), 404
+    if not usuario.get("acceso"):
+        return jsonify({"status": "error", "mensaje": "Usuario sin acceso"}), 403
+    
+    id_sesion = session_store.crear_sesion(usuario["id_usuario"])
+    return jsonify({"status": "OK", "id_sesion": id_sesion}), 201
+
+
+@bp.route('/sesiones/<id_sesion>', methods=['GET'])
+def validar_sesion(id_sesion):
+    sesion = session_store.obtener_sesion(id_sesion)
+    if sesion is None:
+        return jsonify({"status": "error", "mensaje": "Sesión inválida o revocada"}), 401
+    return jsonify({"status": "OK", **sesion}), 200
+
+
+# Mantenimiento de particiones y del filtro de revocados publicado: una sola vez por contenedor, en el proceso líder
+scheduler = PlanificadorUnico('seguridad')
+scheduler.add_job(preparar_particiones, 'cron', hour=0, minute=5, id='preparar_particiones_job')
+scheduler.add_job(purgar_particiones, 'cron', hour=1, minute=0, id='purgar_particiones_job')
+scheduler.add_job(session_store.reconstruir_filtro, 'cron', hour=2, minute=0, id='reconstruir_filtro_revocados_job')
+
+
+def preparar_particiones_al_iniciar():
+    try:
+        preparar_particiones()
+    except Exception as e:
+        logger.error(f"No se pudieron preparar las particiones de auditoría: {e}")
+
+
+scheduler.al_ser_lider(preparar_particiones_al_iniciar)
+
+# Estado en memoria de cada proceso (ventanas de anomalías): en todos los workers
+scheduler_local = BackgroundScheduler()
+scheduler_local.add_job(motor_anomalias.evaluar, 'interval', seconds=config.ANOMALIAS_SCORING_INTERVAL_SECONDS, id='evaluar_anomalias_job')
+
+
+def create_app():
+    """
+    Crea la aplicación Flask sin efectos secundarios; los hilos se arrancan en iniciar_servicio().
+    """
+    app = Flask(__name__)
+    perfilado.instalar(app)
+    app.register_blueprint(bp)
+    return app
+
+
+def iniciar_servicio():
+    """
+    Hook de arranque de cada proceso (post_worker_init en gunicorn).
+    """
+    audit_writer.iniciar()
+    session_store.iniciar_sincronizacion()
+    scheduler_local.start()
+    scheduler.iniciar()
+
+
+def detener_servicio():
+    """
+    Hook de apagado de cada proceso (worker_exit en gunicorn): vacía la auditoría pendiente y cierra el pool.
+    """
+    scheduler.detener()
+    if scheduler_local.running:
+        scheduler_local.shutdown(wait=False)
+    audit_writer.detener()
+    db_manager.close_pool()
+
 
 if __name__ == '__main__':
+    # Solo para desarrollo local (python main.py); en producción se usa gunicorn.conf.py
+    app = create_app()
+    iniciar_servicio()
     try:
         app.run(host='0.0.0.0', port=5000)
     except Exception as e:
         logger.error(f"Error fatal en la aplicación: {e}")
-        scheduler.shutdown()
         raise
+    finally:
+        detener_servicio()
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+import uuid
+from typing import Optional, Dict, Any
+
+import redis
+
+from config import get_config
+from filtros import FiltroBloom
+
+logger = logging.getLogger('seguridad.sesiones')
+
+PREFIJO_SESION = 'sesion:'
+PREFIJO_SESIONES_USUARIO = 'usuario:{}:sesiones'
+CLAVE_REVOCADOS = 'sesiones:revocados'
+CLAVE_BLOOM = 'sesiones:revocados:bloom'
+CANAL_REVOCACIONES = 'sesiones:revocaciones'
+
+# Revoca todas las sesiones de un usuario en un solo round trip y de forma atómica:
+# borra cada sesión y el índice del usuario, lo marca como revocado, enciende sus
+# bits en el filtro de Bloom publicado y notifica a los suscriptores.
+LUA_REVOCAR_USUARIO = """
+local sesiones = redis.call('SMEMBERS', KEYS[1])
+for i = 1, #sesiones do
+    redis.call('DEL', ARGV[2] .. sesiones[i])
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[2], ARGV[1])
+for i = 4, #ARGV do
+    redis.call('SETBIT', KEYS[3], ARGV[i], 1)
+end
+redis.call('PUBLISH', ARGV[3], ARGV[1])
+return #sesiones
+"""
+
+
+class SesionStore:
+    """
+    Almacén de sesiones en Redis indexado por usuario.
+
+    Mantiene además una copia en proceso del filtro de Bloom de usuarios
+    revocados, sincronizada por pub/sub, para que la validación de una sesión
+    de un usuario no revocado no requiera llamadas de red.
+    """
+
+    def __init__(self, config=None, redis_conn: Optional[redis.Redis] = None):
+        self.config = config or get_config()
+        self.redis = redis_conn or redis.Redis(
+            host=self.config.REDIS_HOST,
+            port=self.config.REDIS_PORT,
+            password=self.config.REDIS_PASSWORD or None,
+            socket_timeout=self.config.SESIONES_REDIS_TIMEOUT_SECONDS,
+            socket_connect_timeout=self.config.SESIONES_REDIS_TIMEOUT_SECONDS,
+        )
+        self.ttl = self.config.SESIONES_TTL_SECONDS
+        self.bloom = self._nuevo_filtro()
+        self._revocar = self.redis.register_script(LUA_REVOCAR_USUARIO)
+        self._hilo: Optional[threading.Thread] = None
+
+    def _nuevo_filtro(self) -> FiltroBloom:
+        return FiltroBloom(self.config.BLOOM_CAPACIDAD, self.config.BLOOM_TASA_FALSOS_POSITIVOS)
+
+    def crear_sesion(self, id_usuario) -> str:
+        """Crea una sesión para el usuario y la indexa en su conjunto de sesiones"""
+        id_sesion = str(uuid.uuid4())
+        clave_usuario = PREFIJO_SESIONES_USUARIO.format(id_usuario)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(PREFIJO_SESION + id_sesion, mapping={'id_usuario': id_usuario, 'creada_en': time.time()})
+        pipe.expire(PREFIJO_SESION + id_sesion, self.ttl)
+        pipe.sadd(clave_usuario, id_sesion)
+        pipe.expire(clave_usuario, self.ttl)
+        pipe.srem(CLAVE_REVOCADOS, id_usuario)
+        pipe.execute()
+        return id_sesion
+
+    def obtener_sesion(self, id_sesion: str) -> Optional[Dict[str, Any]]:
+        """Retorna la sesión si existe y su usuario no está revocado"""
+        datos = self.redis.hgetall(PREFIJO_SESION + id_sesion)
+        if not datos:
+            return None
+        id_usuario = datos[b'id_usuario'].decode()
+        if self.usuario_revocado(id_usuario):
+            return None
+        return {'id_sesion': id_sesion, 'id_usuario': id_usuario, 'creada_en': float(datos[b'creada_en'])}
+
+    def revocar_usuario(self, id_usuario) -> int:
+        """Revoca atómicamente todas las sesiones del usuario; retorna cuántas se eliminaron"""
+        inicio = time.perf_counter()
+        revocadas = self._revocar(
+            keys=[PREFIJO_SESIONES_USUARIO.format(id_usuario), CLAVE_REVOCADOS, CLAVE_BLOOM],
+            args=[str(id_usuario), PREFIJO_SESION, CANAL_REVOCACIONES, *self.bloom.posiciones(str(id_usuario))],
+        )
+        self.bloom.agregar(str(id_usuario))
+        logger.info(f"Sesiones del usuario {id_usuario} revocadas: {revocadas} en {(time.perf_counter() - inicio) * 1000:.2f}ms")
+        return revocadas
+
+    def usuario_revocado(self, id_usuario) -> bool:
+        """Consulta el filtro local; solo ante un posible positivo confirma en Redis"""
+        if not self.bloom.contiene(str(id_usuario)):
+            return False
+        return bool(self.redis.sismember(CLAVE_REVOCADOS, str(id_usuario)))
+
+    def reconstruir_filtro(self):
+        """
+        Reconstruye el filtro desde el conjunto de revocados (limpia usuarios
+        reactivados). Lo reemplaza con WATCH/MULTI: si una revocación toca el
+        conjunto o el filtro publicado mientras se recorre, se vuelve a empezar
+        en vez de pisar sus bits. Debe correr en un solo proceso (el líder).
+        """
+        def reconstruir(pipe):
+            filtro = self._nuevo_filtro()
+            for id_usuario in pipe.sscan_iter(CLAVE_REVOCADOS, count=1000):
+                filtro.agregar(id_usuario.decode())
+            pipe.multi()
+            pipe.set(CLAVE_BLOOM, filtro.a_bytes())
+            return filtro
+
+        self.bloom = self.redis.transaction(reconstruir, CLAVE_REVOCADOS, CLAVE_BLOOM, value_from_callable=True)
+        logger.info("Filtro de Bloom de usuarios revocados reconstruido")
+
+    def iniciar_sincronizacion(self):
+        """Carga el filtro publicado y escucha nuevas revocaciones en segundo plano"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._hilo = threading.Thread(target=self._escuchar, name='sesiones-revocaciones', daemon=True)
+        self._hilo.start()
+
+    def _escuchar(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CANAL_REVOCACIONES)
+                # Tras (re)suscribirse se une el filtro publicado para cubrir el hueco
+                publicado = self.redis.get(CLAVE_BLOOM)
+                if publicado:
+                    self.bloom.combinar_bytes(publicado)
+                while True:
+                    mensaje = pubsub.get_message(timeout=1.0)
+                    if mensaje:
+                        self.bloom.agregar(mensaje['data'].decode())
+            except redis.RedisError as e:
+                logger.error(f"Error en suscripción de revocaciones, reintentando: {e}")
+                time.sleep(1)
+
+
+# Instancia global del almacén de sesiones
+session_store = SesionStore()
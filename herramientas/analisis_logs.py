@@ -0,0 +1,282 @@
+"""
+Análisis offline de los logs de los experimentos.
+
+Lee los logs y sus respaldos rotados (monitor_heartbeats.log*, monitor_alerts.log*,
+alertas.jsonl de cada shard del monitor; eventos.log* y seguridad_alerts.log*
+de seguridad) con mmap, sin cargarlos en memoria. Los logs voluminosos
+(heartbeats, eventos) se dividen en bloques de líneas completas que se
+reparten entre procesos: la regex recorre el bloque entero y la conversión de
+latencias y timestamps se hace vectorizada con NumPy. Los logs
+de alertas, pequeños, se leen con un generador de líneas. En memoria solo
+quedan dos float64 por muestra. Métricas:
+
+    - percentiles de latencia por servicio
+    - distribución de los intervalos entre heartbeats y disponibilidad
+    - tiempo de detección (sin heartbeat al momento de la alerta) por estado
+    - tasa de denegación de eventos de seguridad
+
+Uso:
+    python analisis_logs.py --monitor-logs "../Experimento I/logs/monitor" "../Experimento I/logs/monitor-2" \\
+        --seguridad-logs "../Experimento II/logs/seguridad" --formato csv --salida metricas.csv
+"""
+import argparse
+import csv
+import glob
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+from array import array
+from contextlib import nullcontext
+
+import numpy as np
+
+PERCENTILES = [50, 90, 95, 99]
+
+TAMANO_BLOQUE = 16 * 1024 * 1024
+
+# Grupos: servicio, latencia, timestamp sin zona horaria, zona horaria (opcional)
+RE_HEARTBEAT = re.compile(
+    rb"Servicio: ([^|\n]+?) \| Latencia: (-?[\d.]+)s \| "
+    rb"Timestamp: (\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?)(Z|[+-]\d\d:\d\d)?"
+)
+RE_TRANSICION = re.compile(
+    r"Servicio '(?P<servicio>[^']+)' (?P<anterior>\w+) -> (?P<estado>\w+) "
+    r"\(sin heartbeat por (?P<segundos>[\d.]+)s, último: (?P<ultimo>[^)]+)\)"
+)
+# Formato anterior a las alertas por flanco: una línea por evaluación mientras dure la falla
+RE_ALERTA_ANTERIOR = re.compile(r"Servicio '(?P<servicio>[^']+)' sin heartbeat por (?P<segundos>[\d.]+) segundos \(último: (?P<ultimo>[^)]+)\)")
+RE_DENEGADO = re.compile(rb"Acceso denegado para usuario (?P<usuario>\S+), (?P<motivo>no tiene permisos|comportamiento an)")
+
+
+def archivos(directorios, nombre):
+    """Archivo actual y respaldos rotados (`nombre.1`, `nombre.2026-01-01`, ...) de cada directorio"""
+    encontrados = []
+    for directorio in directorios:
+        encontrados.extend(sorted(glob.glob(os.path.join(glob.escape(directorio), nombre + '*'))))
+    return [ruta for ruta in encontrados if os.path.isfile(ruta) and os.path.getsize(ruta) > 0]
+
+
+def lineas(rutas):
+    """Generador de líneas (bytes) de varios archivos usando mmap"""
+    for ruta in rutas:
+        with open(ruta, 'rb') as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            yield from iter(mapa.readline, b'')
+
+
+def rangos(rutas, tamano=TAMANO_BLOQUE):
+    """(ruta, inicio, fin) de bloques de ~`tamano` bytes que terminan en fin de línea"""
+    for ruta in rutas:
+        with open(ruta, 'rb') as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            inicio = 0
+            while inicio < len(mapa):
+                fin = mapa.find(b'\n', min(inicio + tamano, len(mapa) - 1))
+                fin = len(mapa) if fin == -1 else fin + 1
+                yield ruta, inicio, fin
+                inicio = fin
+
+
+def _segundos_zona(zona):
+    if zona in (b'', b'Z'):
+        return 0
+    signo = -1 if zona[:1] == b'-' else 1
+    return signo * (int(zona[1:3]) * 3600 + int(zona[4:6]) * 60)
+
+
+def _latencias_de_rango(rango):
+    """Procesa un bloque en un proceso del pool: {servicio: (recibido_epoch, latencia)}"""
+    ruta, inicio, fin = rango
+    with open(ruta, 'rb') as archivo, mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        coincidencias = RE_HEARTBEAT.findall(mapa, inicio, fin)
+    if not coincidencias:
+        return {}
+    servicios, latencias, timestamps, zonas = (np.array(columna) for columna in zip(*coincidencias))
+    latencias = latencias.astype(np.float64)
+    origen = timestamps.astype('datetime64[us]').astype(np.int64) / 1e6
+    zonas_unicas, indice_zona = np.unique(zonas, return_inverse=True)
+    origen -= np.array([_segundos_zona(z) for z in zonas_unicas], dtype=np.float64)[indice_zona]
+    servicios_unicos, indice_servicio = np.unique(servicios, return_inverse=True)
+    resultado = {}
+    for i, servicio in enumerate(servicios_unicos):
+        seleccion = indice_servicio == i
+        resultado[servicio.decode()] = (origen[seleccion] + latencias[seleccion], latencias[seleccion])
+    return resultado
+
+
+def leer_latencias(rutas, procesos=None):
+    """
+    Retorna {servicio: (recibido_epoch, latencia)} como arreglos NumPy ordenados por llegada.
+    El instante de llegada es timestamp de origen + latencia (resolución sub-segundo).
+    Los bloques se reparten entre `procesos` procesos (por defecto, uno por núcleo).
+    """
+    partes = {}
+    with multiprocessing.Pool(procesos) as pool:
+        for parcial in pool.imap_unordered(_latencias_de_rango, rangos(rutas)):
+            for servicio, trozo in parcial.items():
+                partes.setdefault(servicio, []).append(trozo)
+
+    resultado = {}
+    for servicio, trozos in partes.items():
+        instantes = np.concatenate([t[0] for t in trozos])
+        latencias = np.concatenate([t[1] for t in trozos])
+        orden = np.argsort(instantes, kind='stable')
+        resultado[servicio] = (instantes[orden], latencias[orden])
+    return resultado
+
+
+def leer_transiciones(rutas_log, rutas_jsonl):
+    """
+    Tiempos de detección por (servicio, estado). Del log de alertas se toma la
+    primera línea de cada episodio (mismo servicio, estado y último heartbeat),
+    lo que también sirve para el formato anterior que repetía la alerta.
+    """
+    vistos = set()
+    detecciones = {}
+
+    def registrar(servicio, estado, ultimo, segundos):
+        clave = (servicio, estado, ultimo)
+        if clave in vistos:
+            return
+        vistos.add(clave)
+        detecciones.setdefault((servicio, estado), array('d')).append(segundos)
+
+    for linea in lineas(rutas_log):
+        texto = linea.decode('utf-8', errors='replace')
+        coincidencia = RE_TRANSICION.search(texto)
+        if coincidencia:
+            registrar(coincidencia['servicio'], coincidencia['estado'], coincidencia['ultimo'], float(coincidencia['segundos']))
+            continue
+        coincidencia = RE_ALERTA_ANTERIOR.search(texto)
+        if coincidencia:
+            registrar(coincidencia['servicio'], 'timeout', coincidencia['ultimo'], float(coincidencia['segundos']))
+
+    # alertas.jsonl incluye también RECOVERED/UP (el log de alertas solo guarda WARNING)
+    for linea in lineas(rutas_jsonl):
+        try:
+            alerta = json.loads(linea)
+        except ValueError:
+            continue
+        registrar(alerta['servicio'], alerta['estado'], str(alerta.get('ultimo_heartbeat')), float(alerta['tiempo_sin_heartbeat']))
+
+    return {clave: np.frombuffer(valores, dtype=np.float64) for clave, valores in detecciones.items()}
+
+
+def contar_denegaciones(rutas):
+    conteo = {'pais': 0, 'anomalia': 0}
+    for linea in lineas(rutas):
+        coincidencia = RE_DENEGADO.search(linea)
+        if coincidencia:
+            conteo['pais' if coincidencia['motivo'] == b'no tiene permisos' else 'anomalia'] += 1
+    return conteo
+
+
+def resumen(valores, prefijo):
+    if len(valores) == 0:
+        return {f'{prefijo}_n': 0}
+    metricas = {f'{prefijo}_n': int(len(valores))}
+    for percentil, valor in zip(PERCENTILES, np.percentile(valores, PERCENTILES)):
+        metricas[f'{prefijo}_p{percentil}'] = float(valor)
+    metricas[f'{prefijo}_media'] = float(valores.mean())
+    metricas[f'{prefijo}_max'] = float(valores.max())
+    return metricas
+
+
+def metricas_heartbeats(series, umbral_gap):
+    resultado = {}
+    for servicio, (instantes, latencias) in sorted(series.items()):
+        metricas = resumen(latencias, 'latencia')
+        gaps = np.diff(instantes)
+        metricas.update(resumen(gaps, 'gap'))
+        metricas['gaps_sobre_umbral'] = int((gaps > umbral_gap).sum())
+        duracion = instantes[-1] - instantes[0] if len(instantes) > 1 else 0.0
+        # Tiempo caído: lo que excede el umbral en cada intervalo entre heartbeats
+        caido = float(np.clip(gaps - umbral_gap, 0, None).sum())
+        metricas['duracion_segundos'] = float(duracion)
+        metricas['disponibilidad'] = 1.0 - caido / duracion if duracion > 0 else None
+        resultado[servicio] = metricas
+    return resultado
+
+
+def analizar(args):
+    resultado = {}
+    if args.monitor_logs:
+        resultado['heartbeats'] = metricas_heartbeats(
+            leer_latencias(archivos(args.monitor_logs, 'monitor_heartbeats.log'), args.procesos), args.umbral_gap
+        )
+        detecciones = leer_transiciones(
+            archivos(args.monitor_logs, 'monitor_alerts.log'), archivos(args.monitor_logs, 'alertas.jsonl')
+        )
+        resultado['deteccion'] = {
+            f'{servicio}:{estado}': resumen(valores, 'tiempo_deteccion')
+            for (servicio, estado), valores in sorted(detecciones.items())
+        }
+    if args.seguridad_logs:
+        eventos = leer_latencias(archivos(args.seguridad_logs, 'eventos.log'), args.procesos)
+        permitidos = sum(len(latencias) for _, latencias in eventos.values())
+        denegados = contar_denegaciones(archivos(args.seguridad_logs, 'seguridad_alerts.log'))
+        total = permitidos + sum(denegados.values())
+        resultado['eventos'] = {
+            servicio: resumen(latencias, 'latencia') for servicio, (_, latencias) in sorted(eventos.items())
+        }
+        resultado['denegaciones'] = {
+            'total': {
+                'permitidos': permitidos,
+                'denegados_pais': denegados['pais'],
+                'denegados_anomalia': denegados['anomalia'],
+                'tasa_denegacion': sum(denegados.values()) / total if total else None,
+            }
+        }
+    return resultado
+
+
+def filas(resultado):
+    """Formato largo (seccion, clave, metrica, valor) para CSV y Parquet"""
+    for seccion, claves in resultado.items():
+        for clave, metricas in claves.items():
+            for metrica, valor in metricas.items():
+                yield {'seccion': seccion, 'clave': clave, 'metrica': metrica, 'valor': valor}
+
+
+def escribir(resultado, formato, salida):
+    if formato == 'json':
+        with (open(salida, 'w') if salida else nullcontext(sys.stdout)) as destino:
+            json.dump(resultado, destino, indent=2)
+            destino.write('\n')
+    elif formato == 'csv':
+        with (open(salida, 'w', newline='') if salida else nullcontext(sys.stdout)) as destino:
+            escritor = csv.DictWriter(destino, fieldnames=['seccion', 'clave', 'metrica', 'valor'])
+            escritor.writeheader()
+            escritor.writerows(filas(resultado))
+    else:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit("El formato parquet requiere pyarrow (pip install pyarrow)")
+        if not salida:
+            sys.exit("El formato parquet requiere --salida")
+        registros = list(filas(resultado))
+        tabla = pa.table({
+            'seccion': [r['seccion'] for r in registros],
+            'clave': [r['clave'] for r in registros],
+            'metrica': [r['metrica'] for r in registros],
+            'valor': pa.array([r['valor'] for r in registros], type=pa.float64()),
+        })
+        pq.write_table(tabla, salida)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Métricas offline de los logs de heartbeats, alertas y eventos")
+    parser.add_argument('--monitor-logs', nargs='*', default=[], help="Directorios de logs del monitor (uno por shard)")
+    parser.add_argument('--seguridad-logs', nargs='*', default=[], help="Directorios de logs de seguridad")
+    parser.add_argument('--umbral-gap', type=float, default=6.0, help="Segundos sin heartbeat a partir de los cuales se cuenta indisponibilidad")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos para leer los logs (por defecto, uno por núcleo)")
+    parser.add_argument('--formato', choices=['json', 'csv', 'parquet'], default='json')
+    parser.add_argument('--salida', help="Archivo de salida (por defecto stdout, salvo parquet)")
+    args = parser.parse_args()
+
+    if not args.monitor_logs and not args.seguridad_logs:
+        parser.error("Indique --monitor-logs y/o --seguridad-logs")
+    escribir(analizar(args), args.formato, args.salida)
@@ -0,0 +1,214 @@
+"""
+Ejecutor de experimentos de falla y tiempo de detección (Experimento I).
+
+Lee un archivo de escenarios (ver escenarios/failover.json), provoca la falla
+en el modulo-pedidos objetivo con sus endpoints (/shutdown, /resume,
+/reschedule), escucha las transiciones de alerta de todos los shards del
+monitor por /estado/stream y reporta, sobre todas las repeticiones, la
+distribución del tiempo de detección (SUSPECT y DOWN) y del tiempo de
+recuperación. Todos los tiempos se miden con el reloj local del ejecutor.
+
+    kill      -> /shutdown, espera `duracion` y /resume
+    slowdown  -> /reschedule a `intervalo` segundos durante `duracion` y vuelve a `intervalo_normal`
+    flap      -> `ciclos` veces /shutdown y /resume, cada `periodo` segundos
+
+Uso:
+    python experimento_failover.py escenarios/failover.json --salida resultados.json
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+import numpy as np
+
+TIMEOUT_HTTP_SECONDS = 5
+PERCENTILES = [50, 90, 95, 99]
+
+
+class EscuchaTransiciones:
+    """Suscriptor SSE a /estado/stream de cada shard del monitor"""
+
+    def __init__(self, monitores):
+        self.monitores = monitores
+        self.transiciones = []
+        self.estados = {}
+        self._cond = threading.Condition()
+
+    def iniciar(self):
+        for url in self.monitores:
+            self._cargar_snapshot(url)
+            threading.Thread(target=self._escuchar, args=(url,), name=f'sse-{url}', daemon=True).start()
+
+    def _cargar_snapshot(self, url):
+        try:
+            with urllib.request.urlopen(f'{url}/estado', timeout=TIMEOUT_HTTP_SECONDS) as respuesta:
+                self._aplicar_snapshot(json.load(respuesta))
+        except OSError as e:
+            print(f"No se pudo leer {url}/estado: {e}", file=sys.stderr)
+
+    def _aplicar_snapshot(self, snapshot):
+        with self._cond:
+            for servicio, estado in snapshot.get('servicios', {}).items():
+                self.estados[servicio] = estado.get('alerta')
+            self._cond.notify_all()
+
+    def _escuchar(self, url):
+        while True:
+            try:
+                with urllib.request.urlopen(f'{url}/estado/stream') as respuesta:
+                    evento, datos = None, []
+                    for crudo in respuesta:
+                        linea = crudo.decode().rstrip('\n')
+                        if linea.startswith('event:'):
+                            evento = linea[6:].strip()
+                        elif linea.startswith('data:'):
+                            datos.append(linea[5:].strip())
+                        elif not linea and datos:
+                            self._procesar(evento, json.loads('\n'.join(datos)))
+                            evento, datos = None, []
+            except (OSError, ValueError) as e:
+                print(f"Conexión con {url}/estado/stream perdida, reintentando: {e}", file=sys.stderr)
+                time.sleep(1)
+
+    def _procesar(self, evento, datos):
+        if evento == 'estado':
+            self._aplicar_snapshot(datos)
+        elif evento == 'transicion':
+            with self._cond:
+                self.transiciones.append((time.time(), datos))
+                self.estados[datos['servicio']] = datos['estado']
+                self._cond.notify_all()
+
+    def esperar_estado(self, servicio, estados, timeout):
+        """Espera a que `servicio` esté en alguno de `estados`; retorna True si lo logró"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.estados.get(servicio) in estados, timeout=timeout)
+
+    def entre(self, desde, hasta):
+        with self._cond:
+            return [(t, datos) for t, datos in self.transiciones if desde <= t <= hasta]
+
+
+def post(url, cuerpo=None):
+    solicitud = urllib.request.Request(
+        url,
+        data=json.dumps(cuerpo or {}).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    with urllib.request.urlopen(solicitud, timeout=TIMEOUT_HTTP_SECONDS) as respuesta:
+        return respuesta.status
+
+
+def provocar_falla(escenario):
+    """Ejecuta la falla; retorna (inicio_falla, inicio_recuperacion) en reloj local"""
+    url = escenario['url']
+    tipo = escenario['tipo']
+    if tipo == 'kill':
+        post(f'{url}/shutdown')
+        inicio_falla = time.time()
+        time.sleep(escenario['duracion'])
+        post(f'{url}/resume')
+    elif tipo == 'slowdown':
+        post(f'{url}/reschedule', {'interval': escenario['intervalo']})
+        inicio_falla = time.time()
+        time.sleep(escenario['duracion'])
+        post(f'{url}/reschedule', {'interval': escenario.get('intervalo_normal', 3)})
+    elif tipo == 'flap':
+        inicio_falla = None
+        for _ in range(escenario['ciclos']):
+            post(f'{url}/shutdown')
+            inicio_falla = inicio_falla or time.time()
+            time.sleep(escenario['periodo'] / 2)
+            post(f'{url}/resume')
+            time.sleep(escenario['periodo'] / 2)
+    else:
+        raise ValueError(f"Tipo de escenario desconocido: '{tipo}'")
+    return inicio_falla, time.time()
+
+
+def medir(transiciones, objetivo, inicio_falla, inicio_recuperacion):
+    propias = [(t, d) for t, d in transiciones if d['servicio'] == objetivo]
+
+    def primera(estados, desde):
+        return next((t - desde for t, d in propias if d['estado'] in estados and t >= desde), None)
+
+    return {
+        'deteccion_suspect': primera({'SUSPECT'}, inicio_falla),
+        'deteccion_down': primera({'DOWN'}, inicio_falla),
+        'recuperacion': primera({'RECOVERED', 'UP'}, inicio_recuperacion),
+        'transiciones': len(propias),
+        # Transiciones de otros servicios durante la falla: falsos positivos del monitor
+        'otras_transiciones': len(transiciones) - len(propias),
+    }
+
+
+def ejecutar(escenario, escucha):
+    objetivo = escenario['objetivo']
+    espera_recuperacion = escenario.get('espera_recuperacion', 60)
+    corridas = []
+    for repeticion in range(escenario.get('repeticiones', 1)):
+        if not escucha.esperar_estado(objetivo, {'UP'}, espera_recuperacion):
+            print(f"[{escenario['nombre']}] '{objetivo}' no está UP, se omite la repetición {repeticion + 1}", file=sys.stderr)
+            continue
+        time.sleep(escenario.get('inicio', 0))
+        inicio_falla, inicio_recuperacion = provocar_falla(escenario)
+        escucha.esperar_estado(objetivo, {'UP'}, espera_recuperacion)
+        corrida = medir(escucha.entre(inicio_falla, time.time()), objetivo, inicio_falla, inicio_recuperacion)
+        corrida['repeticion'] = repeticion + 1
+        corridas.append(corrida)
+        print(f"[{escenario['nombre']}] repetición {repeticion + 1}: {corrida}")
+        time.sleep(escenario.get('pausa', 0))
+    return corridas
+
+
+def distribucion(valores):
+    medidos = np.array([v for v in valores if v is not None], dtype=np.float64)
+    resultado = {'n': int(len(medidos)), 'sin_medicion': len(valores) - int(len(medidos))}
+    if len(medidos):
+        for percentil, valor in zip(PERCENTILES, np.percentile(medidos, PERCENTILES)):
+            resultado[f'p{percentil}'] = float(valor)
+        resultado['min'] = float(medidos.min())
+        resultado['max'] = float(medidos.max())
+    return resultado
+
+
+def resumir(corridas):
+    return {
+        metrica: distribucion([c[metrica] for c in corridas])
+        for metrica in ('deteccion_suspect', 'deteccion_down', 'recuperacion', 'transiciones', 'otras_transiciones')
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Experimentos de falla y tiempo de detección del monitor")
+    parser.add_argument('escenarios', help="Archivo JSON de escenarios")
+    parser.add_argument('--solo', nargs='*', help="Nombres de los escenarios a ejecutar")
+    parser.add_argument('--salida', help="Archivo JSON con las corridas y distribuciones")
+    args = parser.parse_args()
+
+    with open(args.escenarios) as archivo:
+        definicion = json.load(archivo)
+
+    escucha = EscuchaTransiciones(definicion['monitores'])
+    escucha.iniciar()
+
+    resultados = {'fecha': datetime.now(timezone.utc).isoformat(), 'escenarios': {}}
+    for escenario in definicion['escenarios']:
+        if args.solo and escenario['nombre'] not in args.solo:
+            continue
+        corridas = ejecutar(escenario, escucha)
+        resultados['escenarios'][escenario['nombre']] = {
+            'definicion': escenario,
+            'corridas': corridas,
+            'resumen': resumir(corridas),
+        }
+        print(json.dumps({escenario['nombre']: resultados['escenarios'][escenario['nombre']]['resumen']}, indent=2))
+
+    if args.salida:
+        with open(args.salida, 'w') as archivo:
+            json.dump(resultados, archivo, indent=2)